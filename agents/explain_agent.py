@@ -5,6 +5,10 @@ import logging
 import pandas as pd
 from crewai import Agent
 from config.config import get_agent_model
+from src.utils.tracing import span, record_llm_call
+from src.utils.cancellation import stage_deadline
+from src.utils.llm_router import generate_text
+from src.utils.insights import build_fact_sheet, format_fact_sheet
 
 logger = logging.getLogger(__name__)
 
@@ -38,32 +42,43 @@ class ExplainAgent(Agent):
             Dict con la explicación y análisis adicional
         """
         try:
-            prompt = f"""
-            Analyze and explain these analysis results:
+            with span('explain'), stage_deadline('explain'):
+                # Hechos calculados sobre el resultado completo (tamaño fijo) en lugar de filas crudas
+                facts = build_fact_sheet(sql_results['results'])
+                
+                prompt = f"""
+                Analyze and explain these analysis results:
 
-            Original Question: {question}
-            SQL Query: {sql_results['query']}
-            Data Results: {sql_results['results'][:5]}  # Muestra primeros 5 resultados
-            Visualization Type: {viz_info['visualization_type']}
+                Original Question: {question}
+                SQL Query: {sql_results['query']}
+                Fact sheet computed over all {sql_results['row_count']} result rows:
+                {format_fact_sheet(facts)}
+                Visualization Type: {viz_info['visualization_type'] or 'none (table only)'}
             
-            Please provide:
-            1. A clear explanation of the findings
-            2. Key insights from the data
-            3. Any notable patterns or trends
-            4. Potential business implications
+                Base every number you mention on the fact sheet; do not invent values.
+                Shares and changes are fractions (0.25 = 25%). If last_period_partial is True,
+                do not read the last period's drop as a real decline.
             
-            Keep the explanation concise but informative.
-            Focus on what would be most valuable to understand.
-            """
+                Please provide:
+                1. A clear explanation of the findings
+                2. Key insights from the data
+                3. Any notable patterns or trends
+                4. Potential business implications
             
-            explanation = self.llm.generate(prompt)
+                Keep the explanation concise but informative.
+                Focus on what would be most valuable to understand.
+                """
             
-            return {
-                'explanation': explanation,
-                'question': question,
-                'total_records': sql_results['row_count'],
-                'timestamp': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
+                explanation = generate_text('explain', prompt)
+                record_llm_call(prompt, explanation)
+            
+                return {
+                    'explanation': explanation,
+                    'question': question,
+                    'total_records': sql_results['row_count'],
+                    'facts': facts,
+                    'timestamp': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
+                }
 
         except Exception as e:
             logger.error(f"Error generating explanation: {str(e)}")
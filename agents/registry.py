@@ -0,0 +1,31 @@
+# agents/registry.py
+
+import importlib
+from functools import lru_cache
+from typing import Any, Dict, Tuple
+
+# Las clases de agentes se importan bajo demanda: cada módulo carga crewai,
+# sqlglot, duckdb y pyarrow, que no hacen falta para renderizar la primera página
+AGENT_CLASSES: Dict[str, Tuple[str, str]] = {
+    'schema': ('agents.schema_agent', 'SchemaAgent'),
+    'sql': ('agents.sql_agent', 'SQLAgent'),
+    'viz': ('agents.viz_agent', 'VizAgent'),
+    'explain': ('agents.explain_agent', 'ExplainAgent')
+}
+
+@lru_cache(maxsize=None)
+def get_agent_class(agent_type: str) -> type:
+    """
+    Resuelve la clase de un agente importando su módulo en el primer uso
+
+    Args:
+        agent_type: Tipo de agente ('schema', 'sql', 'viz', 'explain')
+    """
+    if agent_type not in AGENT_CLASSES:
+        raise ValueError(f"Tipo de agente no válido: {agent_type}")
+    module_name, class_name = AGENT_CLASSES[agent_type]
+    return getattr(importlib.import_module(module_name), class_name)
+
+def create_agent(agent_type: str) -> Any:
+    """Crea una instancia del agente registrado para el tipo dado"""
+    return get_agent_class(agent_type)()
@@ -3,17 +3,21 @@
 from typing import Dict
 import logging
 from crewai import Agent
-from sqlalchemy import create_engine, inspect
-import pandas as pd
-from config.config import get_mysql_uri, get_agent_model
+from config.config import get_agent_model
+from src.utils.database import get_table_schema, read_sql
+from src.utils.db_router import get_read_engine, get_read_router
+from src.utils.tracing import span, record_llm_call
+from src.utils.cancellation import stage_deadline
+from src.utils.llm_router import generate_text
+from src.utils.value_dictionary import get_value_dictionary
 
 logger = logging.getLogger(__name__)
 
 class SchemaAgent(Agent):
     def __init__(self):
-        # Inicializar el engine antes del super().__init__
+        # Inicializar los engines (primario y réplicas) antes del super().__init__
         try:
-            engine = create_engine(get_mysql_uri())
+            get_read_router()
             logger.info("Database engine initialized successfully")
         except Exception as e:
             logger.error(f"Error initializing database engine: {str(e)}")
@@ -31,13 +35,11 @@ class SchemaAgent(Agent):
             verbose=True,
             allow_delegation=False
         )
-        
-        # Asignar el engine como atributo después de la inicialización
-        self._engine = engine
 
     @property
     def engine(self):
-        return self._engine
+        """Engine de lectura: cada acceso elige una réplica sana (o el primario)"""
+        return get_read_engine()
 
     def analyze_table(self, table_name: str) -> Dict:
         """
@@ -50,45 +52,56 @@ class SchemaAgent(Agent):
             Dict con información relevante de la tabla
         """
         try:
-            # Obtener información del esquema usando inspector
-            inspector = inspect(self.engine)
-            columns_info = inspector.get_columns(table_name)
+            with span('schema'), stage_deadline('schema'):
+                # Un mismo destino de lectura para todo el análisis de la tabla
+                engine = self.engine
+                # Obtener información del esquema (grabada en el cassette como db_meta)
+                columns_info = get_table_schema(engine, table_name).get('columns')
+                if not columns_info:
+                    raise ValueError(f"Could not read the columns of table {table_name}")
             
-            # Obtener muestra de datos
-            query = f"SELECT * FROM {table_name} LIMIT 100"
-            df = pd.read_sql(query, self.engine)
+                # Obtener muestra de datos
+                query = f"SELECT * FROM {table_name} LIMIT 100"
+                df = read_sql(query, engine)
             
-            # Preparar información de columnas en formato más amigable
-            columns_data = [{
-                'name': col['name'],
-                'type': str(col['type']),
-                'nullable': col['nullable']
-            } for col in columns_info]
+                # Preparar información de columnas en formato más amigable
+                columns_data = [{
+                    'name': col['name'],
+                    'type': str(col['type']),
+                    'nullable': col['nullable']
+                } for col in columns_info]
+                
+                # Valores distintos de columnas categóricas (se recalcula sólo si cambian los datos)
+                value_dictionary = get_value_dictionary(engine, table_name, columns_data)
             
-            # Analizar la estructura usando el LLM
-            prompt = f"""
-            Analyze this table structure and sample data:
+                # Analizar la estructura usando el LLM
+                prompt = f"""
+                Analyze this table structure and sample data:
             
-            Table: {table_name}
-            Columns: {columns_data}
-            Sample Data Stats: {df.describe().to_dict()}
+                Table: {table_name}
+                Columns: {columns_data}
+                Sample Data Stats: {df.describe().to_dict()}
             
-            Provide a concise analysis of:
-            1. Column types and their purpose
-            2. Key patterns in the data
-            3. Potential relationships between columns
+                Provide a concise analysis of:
+                1. Column types and their purpose
+                2. Key patterns in the data
+                3. Potential relationships between columns
             
-            Return the analysis in a structured format.
-            """
+                Return the analysis in a structured format.
+                """
             
-            analysis = self.llm.generate(prompt)
+                analysis = generate_text('schema', prompt)
+                record_llm_call(prompt, analysis)
             
-            return {
-                'table_name': table_name,
-                'analysis': analysis,
-                'columns': columns_data,
-                'sample_data': df.head(5).to_dict('records')
-            }
+                return {
+                    'table_name': table_name,
+                    'analysis': analysis,
+                    'columns': columns_data,
+                    'sample_data': df.head(5).to_dict('records'),
+                    'value_dictionary': value_dictionary,
+                    # Muestra para validar localmente las consultas generadas (no se envía al LLM)
+                    'validation_sample': df.to_dict('records')
+                }
             
         except Exception as e:
             logger.error(f"Error analyzing table {table_name}: {str(e)}")
@@ -3,12 +3,32 @@
 from typing import Dict
 import logging
 from crewai import Agent
-from sqlalchemy import create_engine
-import pandas as pd
-from config.config import get_mysql_uri, get_agent_model
+from config.config import get_agent_model, USE_SNAPSHOTS, MAX_SQL_REPAIR_ATTEMPTS
+from src.utils.database import read_arrow, get_sql_dialect
+from src.utils.db_router import get_read_engine
+from src.utils.snapshot import get_snapshot
+from src.utils.tracing import span, record_llm_call
+from src.utils.cancellation import OperationCancelled, stage_deadline
+from src.utils.llm_router import generate_text
+from src.utils.value_dictionary import format_value_hints
+from src.utils.sql_validator import SQLValidationError, clean_sql, validate_sql
+from src.utils.progressive import try_progressive_query
 
 logger = logging.getLogger(__name__)
 
+# Indicaciones específicas por dialecto para que el LLM genere SQL ejecutable
+DIALECT_HINTS = {
+    'MySQL': "Quote identifiers with backticks; use DATE_FORMAT(col, '%Y-%m') for months and LIMIT for top-N. "
+             "To filter by date, compare the date column itself with literals (col >= '2024-01-01') "
+             "instead of wrapping it in functions, so only the matching partitions are read.",
+    'DuckDB': "Quote identifiers with double quotes; use date_trunc('month', col) or strftime(col, '%Y-%m') for months, "
+              "and LIMIT for top-N. Do not use MySQL-only functions such as DATE_FORMAT.",
+    'SQLite': "Quote identifiers with double quotes; use strftime('%Y-%m', col) for months and LIMIT for top-N.",
+}
+
+# Claves de schema_info que no se envían en el prompt (se usan localmente)
+PROMPT_EXCLUDED_KEYS = ('value_dictionary', 'validation_sample')
+
 class SQLAgent(Agent):
     def __init__(self):
         model_config = get_agent_model('sql')
@@ -21,53 +41,124 @@ class SQLAgent(Agent):
             model=model_config['model'],
             verbose=True
         )
-        
-        # Inicializar el engine como atributo protegido
-        self._engine = create_engine(get_mysql_uri())
 
     @property
     def engine(self):
-        """Property para acceder al engine de manera segura"""
-        return self._engine
+        """Engine de lectura: cada acceso elige una réplica sana (o el primario)"""
+        return get_read_engine()
 
-    def generate_and_execute(self, question: str, schema_info: Dict) -> Dict:
+    def generate_and_execute(self, question: str, schema_info: Dict, use_snapshot: bool = USE_SNAPSHOTS,
+                             progressive: bool = False) -> Dict:
         """
         Genera y ejecuta una consulta SQL basada en la pregunta y el esquema
         
         Args:
             question: Pregunta en lenguaje natural
             schema_info: Información del esquema proporcionada por SchemaAgent
+            use_snapshot: Ejecutar sobre el snapshot local de la tabla (DuckDB) si existe
+            progressive: Responder primero con estimaciones sobre la muestra de la tabla y
+                dejar la consulta exacta en segundo plano (ver progressive.start_progressive_query)
             
         Returns:
-            Dict con la consulta y sus resultados
+            Dict con la consulta y sus resultados; en modo progresivo con 'approximate',
+            'margins', 'sample_fraction' y 'exact_job' si se usó la muestra
         """
         try:
-            # Formar el prompt para el LLM incluyendo el contexto del esquema
-            prompt = f"""
-            Based on this database schema:
-            {schema_info}
+            with span('sql'), stage_deadline('sql'):
+                # Con snapshot local la consulta la ejecuta DuckDB en lugar de la base de datos
+                snapshot = get_snapshot(schema_info['table_name']) if use_snapshot and schema_info.get('table_name') else None
+                # Un mismo destino para todos los intentos de esta pregunta
+                engine = None if snapshot else self.engine
+                dialect = 'DuckDB' if snapshot else get_sql_dialect(engine)
+                
+                # El diccionario de valores se envía resumido (top valores y términos reconocidos)
+                schema_context = {k: v for k, v in schema_info.items() if k not in PROMPT_EXCLUDED_KEYS}
+                value_hints = format_value_hints(question, schema_info.get('value_dictionary', {}))
+                
+                # Formar el prompt para el LLM incluyendo el contexto del esquema
+                prompt = f"""
+                Based on this database schema:
+                {schema_context}
+                
+                {value_hints}
             
-            Generate a SQL query to answer: {question}
+                Generate a {dialect} SQL query to answer: {question}
             
-            Consider:
-            - Use appropriate aggregations when needed
-            - Include relevant columns for visualization
-            - Return only the SQL query, no explanations
-            """
+                Consider:
+                - {DIALECT_HINTS.get(dialect, f"Use only syntax supported by {dialect}.")}
+                - Use appropriate aggregations when needed
+                - Include relevant columns for visualization
+                - Return only the SQL query, no explanations
+                """
             
-            # Generar la consulta usando el LLM
-            query = self.llm.generate(prompt).strip()
+                # Generar la consulta usando el LLM
+                query = clean_sql(generate_text('sql', prompt))
+                record_llm_call(prompt, query)
+                
+                # Validar localmente y pedir reparaciones acotadas antes de consultar la base de datos
+                attempt = 0
+                preview = None
+                while True:
+                    error = validate_sql(query, schema_info, dialect)
+                    if error is None:
+                        try:
+                            if progressive and not snapshot and schema_info.get('table_name'):
+                                preview = try_progressive_query(query, schema_info['table_name'], engine)
+                            # Ejecutar la consulta usando el snapshot o el destino de lectura elegido
+                            if preview:
+                                results = preview['results']
+                            else:
+                                results = snapshot.query(query) if snapshot else read_arrow(query, engine)
+                            break
+                        except OperationCancelled:
+                            raise
+                        except Exception as e:
+                            error = f"Database error: {str(e)}"
+                    
+                    if attempt >= MAX_SQL_REPAIR_ATTEMPTS:
+                        raise SQLValidationError(f"Invalid SQL after {attempt} repair attempts: {error}")
+                    attempt += 1
+                    logger.warning(f"Repairing SQL (attempt {attempt}): {error}")
+                    query = self._repair_query(question, query, error, schema_context, dialect)
             
-            # Ejecutar la consulta usando el property engine
-            results = pd.read_sql(query, self.engine)
-            
-            return {
-                'query': query,
-                'results': results.to_dict('records'),
-                'columns': list(results.columns),
-                'row_count': len(results)
-            }
+                # El QueryResult (Arrow) se pasa por referencia a viz, explain y la interfaz
+                output = {
+                    'query': query,
+                    'results': results,
+                    'columns': results.columns,
+                    'row_count': len(results),
+                    'source': 'snapshot' if snapshot else 'sample' if preview else 'database',
+                    'repair_attempts': attempt
+                }
+                if preview:
+                    output.update({
+                        'approximate': True,
+                        'margins': preview['margins'],
+                        'sample_fraction': preview['fraction'],
+                        'exact_job': preview['exact_job']
+                    })
+                return output
 
         except Exception as e:
             logger.error(f"Error in SQL generation/execution: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    def _repair_query(self, question: str, query: str, error: str, schema_context: Dict, dialect: str) -> str:
+        """Pide al LLM una corrección puntual de la consulta a partir del error"""
+        prompt = f"""
+        This {dialect} SQL query was generated to answer: {question}
+        
+        {query}
+        
+        It failed with this error:
+        {error}
+        
+        Table schema:
+        {schema_context}
+        
+        Fix only what causes the error. Return only the corrected SQL query, no explanations.
+        """
+        
+        fixed = clean_sql(generate_text('sql', prompt))
+        record_llm_call(prompt, fixed)
+        return fixed
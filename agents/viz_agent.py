@@ -1,15 +1,90 @@
 # agents/viz_agent.py
 
-from typing import Dict, Any
+from typing import TYPE_CHECKING, Dict, Any, Optional, Tuple
+import json
 import logging
+import re
 from crewai import Agent
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 from config.config import get_agent_model
+from src.utils.tracing import span, record_llm_call
+from src.utils.cancellation import stage_deadline
+from src.utils.llm_router import generate_text
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+# Primer objeto JSON de la respuesta (el LLM suele envolverlo en texto o en ```json)
+JSON_OBJECT_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+
+def parse_viz_plan(text: str) -> Dict[str, Any]:
+    """Plan de visualización del LLM como dict; {} si la respuesta no contiene JSON válido"""
+    match = JSON_OBJECT_PATTERN.search(text or '')
+    if not match:
+        return {}
+    try:
+        plan = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    return plan if isinstance(plan, dict) else {}
+
+def _is_identifier(column: str) -> bool:
+    name = str(column).lower()
+    return name == 'id' or name.endswith('_id') or name.startswith('id_')
+
+def resolve_axes(plan: Dict[str, Any], df: 'pd.DataFrame') -> Tuple[str, Optional[str]]:
+    """
+    Columnas x/y del plan si existen en el resultado (y numérica); si no,
+    la primera dimensión y la primera medida del DataFrame (y None si no hay medidas)
+    """
+    # Enteros, sin signo y reales ('b' booleano queda como dimensión)
+    numeric = [col for col in df.columns if df[col].dtype.kind in 'iuf']
+    x_column, y_column = plan.get('x_column'), plan.get('y_column')
+    if x_column in df.columns and y_column in numeric:
+        return x_column, y_column
+    measures = [col for col in numeric if not _is_identifier(col)] or numeric
+    dimensions = [col for col in df.columns if col not in measures]
+    y_column = measures[0] if measures else None
+    x_column = dimensions[0] if dimensions else df.columns[0]
+    logger.warning(f"Visualization plan without usable columns ({plan.get('x_column')}, "
+                   f"{plan.get('y_column')}); using {x_column} / {y_column}")
+    return x_column, y_column
+
+def build_chart_spec(chart_type: str, x_column: str, y_column: str) -> Dict[str, Any]:
+    """Especificación Vega-Lite del gráfico sugerido sobre las columnas del resultado"""
+    if chart_type == 'pie':
+        return {
+            'mark': 'arc',
+            'encoding': {
+                'theta': {'field': y_column, 'type': 'quantitative'},
+                'color': {'field': x_column, 'type': 'nominal'}
+            }
+        }
+    if chart_type == 'line':
+        return {
+            'mark': {'type': 'line', 'point': True},
+            'encoding': {
+                'x': {'field': x_column, 'type': 'ordinal'},
+                'y': {'field': y_column, 'type': 'quantitative'}
+            }
+        }
+    if chart_type == 'scatter':
+        return {
+            'mark': 'point',
+            'encoding': {
+                'x': {'field': x_column, 'type': 'quantitative'},
+                'y': {'field': y_column, 'type': 'quantitative'}
+            }
+        }
+    return {
+        'mark': 'bar',
+        'encoding': {
+            'x': {'field': x_column, 'type': 'nominal', 'sort': '-y'},
+            'y': {'field': y_column, 'type': 'quantitative'}
+        }
+    }
+
 class VizAgent(Agent):
     def __init__(self):
         model_config = get_agent_model('viz')
@@ -33,50 +108,58 @@ class VizAgent(Agent):
             original_question: Pregunta original del usuario
         
         Returns:
-            Dict con datos para visualización en Streamlit
+            Dict con el tipo de gráfico, las columnas x/y y la especificación Vega-Lite
+            (chart_spec None si el resultado no tiene columnas numéricas)
         """
         try:
-            # Convertir resultados a DataFrame
-            df = pd.DataFrame(query_results['results'])
+            with span('viz'), stage_deadline('viz'):
+                # DataFrame del QueryResult (la conversión se comparte con ExplainAgent)
+                df = query_results['results'].to_pandas()
             
-            # Consultar al LLM sobre el mejor tipo de visualización
-            prompt = f"""
-            Analyze these query results and the original question:
+                # Consultar al LLM sobre el mejor tipo de visualización
+                prompt = f"""
+                Analyze these query results and the original question:
             
-            Question: {original_question}
-            Columns: {query_results['columns']}
-            Data Sample: {df.head().to_dict('records')}
+                Question: {original_question}
+                Columns: {query_results['columns']}
+                Data Sample: {df.head().to_dict('records')}
             
-            Determine:
-            1. Best visualization type (bar, line, pie, scatter)
-            2. Which columns to use for x and y axes
-            3. Any necessary data transformations
-            4. Color scheme and styling suggestions
+                Determine:
+                1. Best visualization type (bar, line, pie, scatter)
+                2. Which columns to use for x and y axes
+                3. Any necessary data transformations
+                4. Color scheme and styling suggestions
             
-            Format response as a JSON-like structure.
-            """
+                Respond with a JSON object with the keys "chart_type", "x_column", "y_column",
+                "title", "x_label" and "y_label", using column names exactly as listed.
+                """
             
-            viz_plan = self.llm.generate(prompt)
+                response = generate_text('viz', prompt)
+                record_llm_call(prompt, response)
+                viz_plan = parse_viz_plan(response)
+                x_column, y_column = resolve_axes(viz_plan, df)
             
-            # Preparar datos para visualización en Streamlit
-            # Convertimos a formato esperado por el frontend
-            viz_data = []
-            
-            # El agente usará las columnas que el LLM sugirió como mejores para la visualización
-            for _, row in df.iterrows():
-                # Generamos el formato estándar que espera el frontend
-                viz_data.append({
-                    "Categoría": str(row[viz_plan['x_column']]),
-                    "Cantidad": float(row[viz_plan['y_column']])
-                })
+                if y_column is None:
+                    # Resultado sin columnas numéricas: sólo la tabla, sin gráfico
+                    return {
+                        'visualization_type': None,
+                        'title': viz_plan.get('title', original_question),
+                        'x_column': x_column,
+                        'y_column': None,
+                        'chart_spec': None
+                    }
 
-            return {
-                'visualization_data': viz_data,
-                'visualization_type': viz_plan['chart_type'],
-                'title': viz_plan.get('title', original_question),
-                'x_label': viz_plan.get('x_label', viz_plan['x_column']),
-                'y_label': viz_plan.get('y_label', viz_plan['y_column'])
-            }
+                chart_type = viz_plan.get('chart_type', 'bar')
+                # La interfaz grafica el resultado Arrow con chart_spec (sin copiar filas aquí)
+                return {
+                    'visualization_type': chart_type,
+                    'title': viz_plan.get('title', original_question),
+                    'x_label': viz_plan.get('x_label', x_column),
+                    'y_label': viz_plan.get('y_label', y_column),
+                    'x_column': x_column,
+                    'y_column': y_column,
+                    'chart_spec': build_chart_spec(chart_type, x_column, y_column)
+                }
 
         except Exception as e:
             logger.error(f"Error creating visualization: {str(e)}")
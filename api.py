@@ -0,0 +1,194 @@
+"""
+Servicio HTTP para ejecutar el pipeline fuera de Streamlit.
+
+Uso:
+    python api.py
+
+Endpoints:
+    POST   /ask               {"question": "...", "table": "..."} -> 202 con job_id (429 si está saturado)
+    GET    /status/<job_id>   Estado del trabajo
+    GET    /result/<job_id>   Resultado (202 mientras está pendiente); hasta API_RESULT_PREVIEW_ROWS filas
+                              en execute_query, el resto con los endpoints de descarga
+    GET    /result/<job_id>/parquet  Resultados de la consulta en Parquet, enviados por lotes
+    GET    /result/<job_id>/arrow    Resultados de la consulta en Arrow IPC (stream), por lotes
+    DELETE /jobs/<job_id>     Cancela el trabajo
+    GET    /tables            Tablas disponibles
+    GET    /metrics           Métricas en formato Prometheus
+    GET    /health            Estado del servicio y estadísticas de los modelos
+"""
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+from config.config import (
+    API_HOST, API_PORT, API_WORKERS, API_MAX_QUEUE, API_JOB_TIMEOUT, API_RESULT_TTL, API_RESULT_PREVIEW_ROWS
+)
+from src.utils.arrow_result import DOWNLOAD_FORMATS, QueryResult, to_json_default
+from src.utils.database import get_table_names
+from src.utils.db_router import get_read_engine, get_read_router
+from src.utils.job_queue import Job, JobManager, QueueFullError
+from src.utils.pipeline import run_crew_analysis
+from src.utils.llm_router import get_router
+from src.utils.tracing import start_trace, render_prometheus
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def run_job(job: Job) -> Dict[str, Any]:
+    """Ejecuta el análisis de un trabajo dentro de su propia traza"""
+    with start_trace(job.question, job.table):
+        return run_crew_analysis(job.question, job.table)
+
+
+def result_payload(job: Job) -> Dict[str, Any]:
+    """
+    Resultado del trabajo para /result: los resultados de la consulta van acotados a
+    API_RESULT_PREVIEW_ROWS filas, con los enlaces de descarga para obtenerlos completos
+    """
+    result = dict(job.result)
+    rows = result.get('execute_query')
+    if isinstance(rows, QueryResult):
+        result['execute_query'] = rows.to_records(limit=API_RESULT_PREVIEW_ROWS)
+        result['row_count'] = len(rows)
+        result['truncated'] = len(rows) > API_RESULT_PREVIEW_ROWS
+        result['downloads'] = {fmt: f"/result/{job.id}/{fmt}" for fmt in DOWNLOAD_FORMATS}
+    return result
+
+
+job_manager = JobManager(
+    handler=run_job,
+    workers=API_WORKERS,
+    max_queue=API_MAX_QUEUE,
+    timeout=API_JOB_TIMEOUT,
+    result_ttl=API_RESULT_TTL
+)
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    server_version = 'SQLCrewAPI/1.0'
+
+    def _send_json(self, status: int, payload: Any, headers: Dict[str, str] = None) -> None:
+        body = json.dumps(payload, default=to_json_default, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_download(self, job: Job, fmt: str) -> None:
+        result = (job.result or {}).get('execute_query')
+        if result is None:
+            return self._send_json(404, {'error': f"Job {job.id} has no query results"})
+        extension, content_type = DOWNLOAD_FORMATS[fmt]
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Disposition', f'attachment; filename="{job.id}.{extension}"')
+        # Sin Content-Length: el cuerpo se envía por lotes y la conexión se cierra al terminar (HTTP/1.0)
+        self.end_headers()
+        for chunk in result.iter_bytes(fmt):
+            self.wfile.write(chunk)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _job_or_404(self, job_id: str):
+        job = job_manager.get(job_id)
+        if job is None:
+            self._send_json(404, {'error': f"Job {job_id} not found"})
+        return job
+
+    def do_POST(self):
+        if self.path != '/ask':
+            return self._send_json(404, {'error': 'Not found'})
+        try:
+            payload = self._read_json()
+        except ValueError:
+            return self._send_json(400, {'error': 'Invalid JSON body'})
+
+        question = (payload.get('question') or '').strip()
+        table = (payload.get('table') or '').strip()
+        if not question or not table:
+            return self._send_json(400, {'error': "'question' and 'table' are required"})
+
+        try:
+            job = job_manager.submit(question, table)
+        except QueueFullError as e:
+            return self._send_json(429, {'error': str(e)}, headers={'Retry-After': '5'})
+        self._send_json(202, job.to_dict())
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['health']:
+            return self._send_json(200, {'status': 'ok', 'pending_jobs': job_manager.pending_count(),
+                                         'models': get_router().snapshot(),
+                                         'databases': get_read_router().snapshot()})
+        if parts == ['metrics']:
+            body = render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if parts == ['tables']:
+            return self._send_json(200, {'tables': get_table_names(get_read_engine())})
+
+        if len(parts) == 2 and parts[0] in ('status', 'result'):
+            job = self._job_or_404(parts[1])
+            if job is None:
+                return
+            if parts[0] == 'status':
+                return self._send_json(200, job.to_dict())
+            if not job.finished:
+                return self._send_json(202, job.to_dict())
+            if job.status == 'done':
+                return self._send_json(200, {**job.to_dict(), 'result': result_payload(job)})
+            status_code = {'timeout': 504, 'cancelled': 409}.get(job.status, 500)
+            return self._send_json(status_code, job.to_dict())
+
+        if len(parts) == 3 and parts[0] == 'result' and parts[2] in DOWNLOAD_FORMATS:
+            job = self._job_or_404(parts[1])
+            if job is None:
+                return
+            if job.status != 'done':
+                return self._send_json(409, job.to_dict())
+            return self._send_download(job, parts[2])
+
+        self._send_json(404, {'error': 'Not found'})
+
+    def do_DELETE(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'jobs':
+            return self._send_json(404, {'error': 'Not found'})
+        job = job_manager.cancel(parts[1])
+        if job is None:
+            return self._send_json(404, {'error': f"Job {parts[1]} not found"})
+        self._send_json(200, job.to_dict())
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+
+def main():
+    server = ThreadingHTTPServer((API_HOST, API_PORT), APIHandler)
+    logger.info(f"API listening on http://{API_HOST}:{API_PORT} "
+                f"({API_WORKERS} workers, queue {API_MAX_QUEUE})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down API")
+    finally:
+        server.server_close()
+        job_manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
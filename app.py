@@ -1,83 +1,311 @@
+import logging
+import time
 import streamlit as st
-from crewai import Crew, Task
-from sqlalchemy import create_engine
-from src.utils.database import get_mysql_uri, get_table_names
-from src.utils.agent_output_handler import AgentOutputHandler
 from src.components.agent_reasoning import display_agent_reasoning_component
-from typing import Dict, Any
-# Importar los agentes
-from agents.schema_agent import SchemaAgent
-from agents.sql_agent import SQLAgent
-from agents.viz_agent import VizAgent
-from agents.explain_agent import ExplainAgent
+from src.components.performance_panel import display_performance_panel
+from src.utils.tracing import start_trace, span
+from src.utils.profiling import profile_run
+from src.utils.api_client import APIClient
+from src.utils.cancellation import CancelToken, OperationCancelled, DeadlineExceeded, cancel_scope, run_polling
+from src.utils.result_store import get_result_store, make_result_key
+from config.config import (
+    PROFILING_ENABLED, PROFILES_DIR, API_BASE_URL, SCHEMA_TOP_K, TOTAL_TIMEOUT_SECONDS, HISTORY_PAGE_SIZE,
+    PROGRESSIVE_QUERIES, PROGRESSIVE_POLL_SECONDS
+)
+from typing import Dict, Any, Optional, Tuple
+
+# Los módulos pesados (crewai y agentes, sqlalchemy, faiss, pyarrow) se importan
+# dentro de las funciones que los usan para que la primera página cargue rápido.
+# python scripts/benchmark_startup.py mide el tiempo de importación.
+
+logger = logging.getLogger(__name__)
+
+# Seconds between Streamlit calls while an analysis runs (lets a new question interrupt it)
+ANALYSIS_POLL_SECONDS = 0.5
 
 def initialize_session_state() -> None:
     """Initialize session state variables"""
+    # El historial sólo guarda pregunta, tabla y clave; la salida completa está en el ResultStore
     if 'history' not in st.session_state:
         st.session_state['history'] = []
     if 'selected_table' not in st.session_state:
         st.session_state['selected_table'] = None
     if 'schema_info' not in st.session_state:
         st.session_state['schema_info'] = None
+    if 'cancel_token' not in st.session_state:
+        st.session_state['cancel_token'] = None
+    if 'exact_job' not in st.session_state:
+        st.session_state['exact_job'] = None
 
-def create_agents():
-    """Create instances of all agents"""
-    return {
-        'schema': SchemaAgent(),
-        'sql': SQLAgent(),
-        'viz': VizAgent(),
-        'explain': ExplainAgent()
-    }
-
-def create_crew(question: str, selected_table: str) -> Crew:
-    """Create and configure the CrewAI crew"""
-    agents = create_agents()
-    
-    tasks = [
-        Task(
-            description=f"Analyze the structure of table {selected_table}",
-            agent=agents['schema'],
-            expected_output="Table schema analysis"
-        ),
-        Task(
-            description=f"Generate and execute SQL query for: {question}",
-            agent=agents['sql'],
-            expected_output="SQL query results"
-        ),
-        Task(
-            description="Create visualization from query results",
-            agent=agents['viz'],
-            expected_output="Visualization data"
-        ),
-        Task(
-            description="Explain the analysis results",
-            agent=agents['explain'],
-            expected_output="Clear explanation of findings"
-        )
-    ]
-    
-    return Crew(
-        agents=list(agents.values()),
-        tasks=tasks
-    )
+def start_cancel_token() -> CancelToken:
+    """Cancel the analysis of the previous rerun (if still running) and start a new deadline"""
+    previous = st.session_state.get('cancel_token')
+    if previous is not None:
+        previous.cancel('superseded by a new question')
+        previous.close()
+    token = CancelToken(timeout=TOTAL_TIMEOUT_SECONDS)
+    st.session_state['cancel_token'] = token
+    return token
+
+def finish_cancel_token(completed: bool) -> None:
+    """
+    Release the token of an analysis that ended in this run
 
-def process_analysis(question: str, selected_table: str) -> Dict[str, Any]:
+    A completed analysis may leave the exact query of a preview running; later reruns must not
+    cancel it (track_exact_job does once the preview is replaced). A failed one cancels it now.
+    """
+    token = st.session_state.get('cancel_token')
+    if token is None:
+        return
+    if not completed:
+        token.cancel('analysis did not complete')
+    token.close()
+    st.session_state['cancel_token'] = None
+
+def track_exact_job(job_id: Optional[str]) -> None:
+    """Cancel the session's previous background exact query once the page no longer waits for it"""
+    previous = st.session_state.get('exact_job')
+    if previous and previous != job_id:
+        from src.utils.progressive import get_exact_runner
+        get_exact_runner().cancel(previous)
+    st.session_state['exact_job'] = job_id
+
+def process_analysis(question: str, selected_table: str, schema_context: str = None) -> Dict[str, Any]:
     """Process the analysis using CrewAI and return formatted results"""
     try:
-        # Crear el crew con la pregunta y tabla específica
-        crew = create_crew(question, selected_table)
-        
-        # Obtener la respuesta de CrewAI
-        result = crew.kickoff()
-        
-        # Formatear la salida usando el handler
-        formatted_output = AgentOutputHandler.format_agent_output(result)
-        
-        return formatted_output
+        # Con API_BASE_URL configurado, Streamlit actúa como cliente del servicio HTTP
+        if API_BASE_URL:
+            analyze, args = APIClient().analyze, (question, selected_table)
+        else:
+            from src.utils.pipeline import run_crew_analysis
+            analyze, args = run_crew_analysis, (question, selected_table, schema_context, PROGRESSIVE_QUERIES)
+        # Streamlit only stops a script run (new question, Stop button) when the script calls into it,
+        # so the analysis runs in a helper thread while this thread keeps updating the status line;
+        # an interrupted wait cancels the analysis token
+        status = st.empty()
+        started = time.monotonic()
+        try:
+            result = run_polling(lambda: status.caption(f"⏳ Running for {time.monotonic() - started:.0f}s"),
+                                 ANALYSIS_POLL_SECONDS, analyze, *args)
+        except Exception:
+            status.empty()
+            raise
+        status.empty()
+        return result
+    except DeadlineExceeded:
+        st.warning(f"The analysis took longer than {TOTAL_TIMEOUT_SECONDS:.0f}s and was stopped. "
+                   "Try a more specific question.")
+        return None
+    except OperationCancelled:
+        st.info("The previous analysis was cancelled.")
+        return None
     except Exception as e:
         st.error(f"Error processing analysis: {str(e)}")
         return None
 
+def get_result_key(question: str, selected_table: str) -> Tuple[str, Optional[str]]:
+    """Memoization key for (table, question, data version); the version changes when the data does"""
+    data_version = None
+    if not API_BASE_URL:
+        from src.utils.database import get_data_version, get_engine
+        try:
+            # Always the primary: replicas at different lag would change the key between reruns
+            engine = get_engine()
+            data_version = ';'.join(get_data_version(engine, table) for table in selected_table.split(', '))
+        except Exception as e:
+            logger.warning(f"Data version unavailable, memoizing without it: {str(e)}")
+    return make_result_key(question, selected_table, data_version), data_version
+
+def load_session_result(result_key: str) -> Optional[Dict[str, Any]]:
+    """Return a result already computed in this session (e.g. on a rerun), or None"""
+    if not any(item['key'] == result_key for item in st.session_state['history']):
+        return None
+    return get_result_store().get(result_key)
+
+def save_result(result_key: str, question: str, selected_table: str, data_version: Optional[str],
+                formatted_output: Dict[str, Any], performance: Dict[str, Any]) -> None:
+    """Spill the result to the local store and add its key to the session history"""
+    try:
+        get_result_store().put(result_key, question, selected_table, data_version,
+                               {'output': formatted_output, 'performance': performance})
+    except Exception as e:
+        st.warning(f"Result could not be stored for reuse: {str(e)}")
+        return
+    st.session_state['history'].append({
+        'question': question,
+        'table': selected_table,
+        'key': result_key
+    })
+
+def retrieve_schema_context(question: str) -> Dict[str, Any]:
+    """Retrieve the most relevant tables and join paths for a question (multi-table mode)"""
+    from src.utils.db_router import get_read_engine
+    from src.utils.schema_index import get_schema_index
+    with span('schema_retrieval'):
+        index = get_schema_index()
+        index.sync(get_read_engine())
+        return index.build_context(question, SCHEMA_TOP_K)
+
+def promote_exact_result(result_key: str, formatted_output: Dict[str, Any], exact_results=None) -> None:
+    """Replace a sampled preview with the exact result (or keep the estimate) in the stored output"""
+    output = {k: v for k, v in formatted_output.items() if k != 'exact_job'}
+    if exact_results is not None:
+        for preview_key in ('approximate', 'margins', 'sample_fraction'):
+            output.pop(preview_key, None)
+        output['execute_query'] = exact_results
+        output['insights_from_preview'] = bool(output.get('insights'))
+    store = get_result_store()
+    stored = store.get(result_key)
+    if stored is not None:
+        stored['output'] = output
+        store.update_payload(result_key, stored)
+
+@st.fragment(run_every=PROGRESSIVE_POLL_SECONDS)
+def poll_exact_result(formatted_output: Dict[str, Any], result_key: str) -> None:
+    """Wait for the exact query behind a sampled preview; the page reruns with it once it finishes"""
+    from src.utils.progressive import get_exact_runner
+    try:
+        exact_results = get_exact_runner().poll(formatted_output['exact_job'])
+        if exact_results is None:
+            st.caption("⏳ Exact result still running in the background; the preview will be replaced "
+                       "when it finishes. You can keep asking questions meanwhile.")
+            return
+    except KeyError:
+        st.caption("The exact result expired; keeping the estimate.")
+        exact_results = None
+    except Exception as e:
+        st.warning(f"The exact query failed, keeping the estimate: {str(e)}")
+        exact_results = None
+    promote_exact_result(result_key, formatted_output, exact_results)
+    st.rerun()
+
+def render_downloads(results) -> None:
+    """Parquet / Arrow IPC download; the file is only serialized when requested"""
+    from src.utils.arrow_result import DOWNLOAD_FORMATS
+    with st.expander("Download results"):
+        fmt = st.radio("Format", list(DOWNLOAD_FORMATS), horizontal=True, key='download_format')
+        if st.toggle("Prepare file", key='download_prepare'):
+            extension, mime = DOWNLOAD_FORMATS[fmt]
+            st.download_button(f"Download {len(results):,} rows (.{extension})", data=results.to_bytes(fmt),
+                               file_name=f"results.{extension}", mime=mime)
+
+def render_query_results(formatted_output: Dict[str, Any]) -> None:
+    """Show the result table; sampled previews add a 95% margin column per estimate"""
+    from src.utils.arrow_result import as_query_result
+    # Resultados Arrow: st.dataframe los recibe sin convertirlos a pandas
+    results = as_query_result(formatted_output['execute_query'])
+    st.subheader("Query Results")
+    if not formatted_output.get('approximate'):
+        st.dataframe(results.table)
+        render_downloads(results)
+        return
+
+    st.caption(f"≈ Estimated from a {formatted_output['sample_fraction']:.2%} random sample "
+               "(± is the 95% margin of error; groups absent from the sample are not shown)")
+    table = results.to_pandas().copy()
+    for column, margins in formatted_output.get('margins', {}).items():
+        table.insert(table.columns.get_loc(column) + 1, f"{column} ±95%", margins)
+    st.dataframe(table)
+
+def render_analysis(formatted_output: Dict[str, Any]):
+    """Render reasoning, SQL, results and visualization; returns the performance panel placeholder"""
+    # Mostrar el proceso de razonamiento
+    display_agent_reasoning_component(formatted_output['reasoning'])
+    
+    # Reservar espacio para el panel de rendimiento junto al razonamiento
+    performance_placeholder = st.empty()
+    
+    # Mostrar la consulta SQL
+    if formatted_output['query']:
+        st.subheader("Generated SQL Query")
+        st.code(formatted_output['query'], language='sql')
+        
+        # Ejecutar la consulta y mostrar resultados
+        if 'execute_query' in formatted_output:
+            render_query_results(formatted_output)
+    
+    # Mostrar visualización si existe
+    if formatted_output.get('visualization'):
+        st.subheader("Data Visualization")
+        st.plotly_chart(formatted_output['visualization'])
+    elif formatted_output.get('chart_spec') and formatted_output.get('execute_query'):
+        # Gráfico de la vía rápida por plantillas (especificación Vega-Lite)
+        st.subheader("Data Visualization")
+        from src.utils.arrow_result import as_query_result
+        st.vega_lite_chart(as_query_result(formatted_output['execute_query']).table, formatted_output['chart_spec'],
+                           use_container_width=True)
+    
+    if formatted_output.get('insights'):
+        st.subheader("Insights")
+        if formatted_output.get('insights_from_preview'):
+            st.caption("Written from the sampled preview, before the exact result arrived.")
+        st.write(formatted_output['insights'])
+    
+    return performance_placeholder
+
+def display_saved_questions() -> None:
+    """Saved questions: refreshing one only aggregates the rows added since its last refresh"""
+    from src.utils.saved_questions import get_saved_question_store, refresh_question
+    store = get_saved_question_store()
+    saved = store.list()
+    if not saved:
+        return
+    
+    st.subheader("Saved Questions")
+    if st.button("Refresh all saved questions"):
+        with st.spinner("Refreshing saved questions..."):
+            for item in saved:
+                try:
+                    refresh_question(item['id'])
+                except Exception as e:
+                    st.error(f"Error refreshing '{item['question']}': {str(e)}")
+        saved = store.list()
+    
+    for item in saved:
+        with st.expander(f"⭐ {item['question']} ({item['table_name']})"):
+            state = item['state']
+            mode = 'incremental' if state.get('incremental') else 'full recompute'
+            st.caption(f"Refresh mode: {mode} · last refresh: {state.get('last_refresh')} · "
+                       f"data up to {item['watermark_column']} = {state.get('max')}"
+                       if item['watermark_column'] else "Refresh mode: full recompute (no watermark column)")
+            st.code(item['query'], language='sql')
+            columns = st.columns(2)
+            if columns[0].button("Refresh", key=f"saved_refresh_{item['id']}"):
+                try:
+                    refreshed = refresh_question(item['id'])
+                    st.success(f"Refreshed ({refreshed['state']['last_refresh']})")
+                except Exception as e:
+                    st.error(f"Error refreshing saved question: {str(e)}")
+            if columns[1].button("Remove", key=f"saved_remove_{item['id']}"):
+                store.delete(item['id'])
+                st.rerun()
+            # El resultado guardado se lee del disco sólo al pedirlo
+            if st.toggle("Show result", key=f"saved_show_{item['id']}"):
+                stored = store.get(item['id'])
+                if stored:
+                    st.dataframe(stored[1].table)
+
+def display_snapshot_status(table_name: str) -> None:
+    """Show snapshot staleness for the selected table with a refresh button"""
+    from src.utils.snapshot import TableSnapshot, format_staleness
+    snapshot = TableSnapshot(table_name)
+    meta = snapshot.meta
+    if meta:
+        st.caption(
+            f"📦 Snapshot: {meta['row_count']:,} rows, "
+            f"refreshed {format_staleness(snapshot.staleness())} ago"
+        )
+    else:
+        st.caption("📦 No local snapshot for this table")
+    
+    if st.button("Refresh snapshot" if meta else "Create snapshot"):
+        with st.spinner(f"Exporting {table_name}..."):
+            try:
+                snapshot.refresh()
+                st.rerun()
+            except Exception as e:
+                st.error(f"Error refreshing snapshot: {str(e)}")
+
 def main():
     initialize_session_state()
     
@@ -90,21 +318,43 @@ def main():
         st.header("Configuration")
         
         # Obtener lista de tablas
-        engine = create_engine(get_mysql_uri())
-        tables = get_table_names(engine)
+        if API_BASE_URL:
+            tables = APIClient().get_table_names()
+        else:
+            from src.utils.database import get_table_names
+            from src.utils.db_router import get_read_engine
+            tables = get_table_names(get_read_engine())
+        
+        # Modo multi-tabla: las tablas se recuperan del índice de esquema para cada pregunta
+        multi_table = not API_BASE_URL and st.checkbox(
+            "🔎 Multi-table mode",
+            help="Pick the relevant tables for each question automatically"
+        )
         
         selected_table = st.selectbox(
             "Select a table to analyze:",
             options=tables,
-            key='table_selector'
+            key='table_selector',
+            disabled=multi_table
         )
         
         if selected_table != st.session_state.get('selected_table'):
             st.session_state['selected_table'] = selected_table
             st.session_state['schema_info'] = None
+        
+        # Estado del snapshot local de la tabla
+        if selected_table and not API_BASE_URL and not multi_table:
+            display_snapshot_status(selected_table)
+        
+        # Captura de perfil CPU/memoria para la siguiente pregunta
+        profile_enabled = st.checkbox(
+            "🔬 Profile next question",
+            value=PROFILING_ENABLED,
+            help="Saves a flamegraph-compatible CPU profile and top allocations report"
+        )
     
     # Main area
-    if selected_table:
+    if selected_table or multi_table:
         # Input para la pregunta
         question = st.text_input(
             "Ask a question about your data:",
@@ -114,48 +364,104 @@ def main():
         if question:
             with st.spinner("Processing your question..."):
                 try:
-                    # Procesar análisis
-                    formatted_output = process_analysis(question, selected_table)
+                    # Una nueva pregunta (o rerun) cancela las consultas y llamadas al LLM de la anterior
+                    with cancel_scope(start_cancel_token()), start_trace(question, selected_table) as trace:
+                        schema_context = None
+                        if multi_table:
+                            retrieval = retrieve_schema_context(question)
+                            selected_table = trace.table = ', '.join(retrieval['tables'])
+                            schema_context = retrieval['context']
+                            if selected_table:
+                                st.caption(f"Tables used: {selected_table}")
+                            else:
+                                st.warning("No relevant tables found for this question.")
+                        
+                        formatted_output = None
+                        performance = None
+                        if selected_table:
+                            # Los reruns de Streamlit (expandir el historial, cambiar el sidebar)
+                            # reutilizan el resultado si la pregunta y los datos no cambiaron
+                            with span('result_cache'):
+                                result_key, data_version = get_result_key(question, selected_table)
+                                stored = load_session_result(result_key)
+                            
+                            if stored:
+                                formatted_output = stored['output']
+                                performance = stored['performance']
+                                st.caption("♻️ Showing the result computed earlier in this session")
+                            else:
+                                # Procesar análisis
+                                with profile_run(question, selected_table, profile_enabled) as question_id:
+                                    formatted_output = process_analysis(question, selected_table, schema_context)
+                                finish_cancel_token(completed=formatted_output is not None)
+                                
+                                if question_id:
+                                    st.caption(f"Profile saved under {PROFILES_DIR}/{question_id}")
+                                elif profile_enabled:
+                                    st.caption("Another session was being profiled; "
+                                               "this question ran without a profile.")
+                        
+                        track_exact_job(formatted_output.get('exact_job') if formatted_output else None)
+                        if formatted_output:
+                            with span('render'):
+                                performance_placeholder = render_analysis(formatted_output)
                     
                     if formatted_output:
-                        # Mostrar el proceso de razonamiento
-                        display_agent_reasoning_component(formatted_output['reasoning'])
+                        if performance is None:
+                            # El resumen se toma al cerrar la traza para incluir el render
+                            performance = trace.summary()
+                            # Agregar a historial
+                            save_result(result_key, question, selected_table, data_version,
+                                        formatted_output, performance)
                         
-                        # Mostrar la consulta SQL
-                        if formatted_output['query']:
-                            st.subheader("Generated SQL Query")
-                            st.code(formatted_output['query'], language='sql')
-                            
-                            # Ejecutar la consulta y mostrar resultados
-                            if 'execute_query' in formatted_output:
-                                results = formatted_output['execute_query']
-                                st.subheader("Query Results")
-                                st.dataframe(results)
+                        with performance_placeholder.container():
+                            display_performance_panel(performance)
                         
-                        # Mostrar visualización si existe
-                        if formatted_output.get('visualization'):
-                            st.subheader("Data Visualization")
-                            st.plotly_chart(formatted_output['visualization'])
+                        # Vista previa sobre la muestra: se sondea la consulta exacta una vez guardado el resultado
+                        if formatted_output.get('exact_job'):
+                            poll_exact_result(formatted_output, result_key)
                         
-                        # Agregar a historial
-                        st.session_state['history'].append({
-                            'question': question,
-                            'output': formatted_output
-                        })
+                        # Guardar la pregunta para refrescarla después sólo con los datos nuevos
+                        if not API_BASE_URL and not multi_table and formatted_output.get('query'):
+                            if st.button("⭐ Save question"):
+                                from src.utils.saved_questions import save_question
+                                try:
+                                    save_question(question, selected_table, formatted_output['query'])
+                                    st.success("Question saved; refreshing it will only process new rows.")
+                                except Exception as e:
+                                    st.error(f"Error saving question: {str(e)}")
                         
                 except Exception as e:
                     st.error(f"An error occurred: {str(e)}")
                     st.error("Please try again with a different question.")
         
-        # Mostrar historial
+        if not API_BASE_URL:
+            display_saved_questions()
+        
+        # Mostrar historial (paginado: sólo se renderizan las preguntas de la página actual)
         if st.session_state['history']:
             st.subheader("Question History")
-            for item in reversed(st.session_state['history']):
+            history = list(reversed(st.session_state['history']))
+            pages = (len(history) - 1) // HISTORY_PAGE_SIZE + 1
+            page = 1
+            if pages > 1:
+                page = st.number_input(f"History page (of {pages})", min_value=1, max_value=pages,
+                                       value=1, key='history_page')
+            for item in history[(page - 1) * HISTORY_PAGE_SIZE:page * HISTORY_PAGE_SIZE]:
                 with st.expander(f"Q: {item['question']}"):
-                    if 'reasoning' in item['output']:
-                        display_agent_reasoning_component(item['output']['reasoning'])
-                    if 'query' in item['output']:
-                        st.code(item['output']['query'], language='sql')
+                    # El contenido del expander se ejecuta siempre: la salida se lee del disco sólo al pedirla
+                    if not st.toggle("Show details", key=f"history_{item['key']}"):
+                        continue
+                    stored = get_result_store().get(item['key'])
+                    if stored is None:
+                        st.caption("This result is no longer stored.")
+                        continue
+                    output = stored['output']
+                    if 'reasoning' in output:
+                        display_agent_reasoning_component(output['reasoning'], key=f"history_{item['key']}")
+                    if 'query' in output:
+                        st.code(output['query'], language='sql')
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     main()
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""
+Ejecución headless del pipeline para muchas preguntas.
+
+Uso:
+    python batch.py questions.jsonl --output-dir batch_output --concurrency 4
+
+El archivo de entrada puede ser JSONL o CSV con las columnas `question` y
+`table` (y opcionalmente `id`). Por cada pregunta se escriben en
+<output-dir>/<id>/ la consulta (query.sql), los resultados (result.parquet),
+la explicación (explanation.md) y un resumen (result.json).
+"""
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+
+import pandas as pd
+
+from config.config import BATCH_CONCURRENCY, LLM_REQUESTS_PER_MINUTE, TOTAL_TIMEOUT_SECONDS
+from src.utils.cancellation import CancelToken, cancel_scope
+from src.utils.pipeline import create_agents, run_stages
+from src.utils.rate_limit import RateLimiter
+from src.utils.tracing import start_trace
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def load_questions(input_path: str) -> List[Dict[str, str]]:
+    """Lee preguntas y tablas desde un archivo JSONL o CSV"""
+    path = Path(input_path)
+    if path.suffix.lower() == '.csv':
+        records = pd.read_csv(path, dtype=str).to_dict('records')
+    else:
+        with open(path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+
+    questions = []
+    for index, record in enumerate(records, 1):
+        if not record.get('question') or not record.get('table'):
+            raise ValueError(f"Line {index} of {input_path} needs 'question' and 'table'")
+        record_id = str(record.get('id') or f"{index:05d}")
+        questions.append({
+            'id': re.sub(r'[^\w.-]', '_', record_id),
+            'question': record['question'],
+            'table': record['table']
+        })
+    return questions
+
+
+class BatchRunner:
+    """Ejecuta preguntas en paralelo compartiendo el análisis de esquema por tabla"""
+
+    def __init__(self, output_dir: str, concurrency: int, requests_per_minute: float):
+        self.output_dir = Path(output_dir)
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(requests_per_minute)
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_cache: Dict[str, Future] = {}
+
+    def _agents(self) -> Dict:
+        # Cada hilo trabajador mantiene sus propios agentes (y engines)
+        if not hasattr(self._local, 'agents'):
+            self._local.agents = create_agents()
+        return self._local.agents
+
+    def _get_schema_info(self, table: str) -> Dict:
+        # El primer hilo que pide una tabla calcula su esquema; el resto espera el mismo Future
+        with self._schema_lock:
+            future = self._schema_cache.get(table)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._schema_cache[table] = future
+
+        if owner:
+            # Token propio: cancelar la pregunta que lo calcula (o su plazo) no afecta a las demás
+            token = CancelToken(timeout=TOTAL_TIMEOUT_SECONDS)
+            try:
+                with cancel_scope(token):
+                    future.set_result(self.limiter.call(self._agents()['schema'].analyze_table, table))
+            except Exception as e:
+                # Un error transitorio no queda cacheado: la próxima pregunta de la tabla reintenta
+                with self._schema_lock:
+                    self._schema_cache.pop(table, None)
+                future.set_exception(e)
+            finally:
+                token.close()
+        return future.result()
+
+    def _write_result(self, item: Dict, result: Dict) -> None:
+        target = self.output_dir / item['id']
+        target.mkdir(parents=True, exist_ok=True)
+
+        sql_results = result['sql_results']
+        (target / 'query.sql').write_text(sql_results['query'], encoding='utf-8')
+        sql_results['results'].write_parquet(target / 'result.parquet')
+        (target / 'explanation.md').write_text(str(result['explanation']['explanation']), encoding='utf-8')
+        (target / 'result.json').write_text(json.dumps({
+            'id': item['id'],
+            'question': item['question'],
+            'table': item['table'],
+            'row_count': sql_results['row_count'],
+            'visualization_type': result['viz_info'].get('visualization_type')
+        }, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    def run_one(self, item: Dict) -> Dict:
+        """Procesa una pregunta y retorna su estado"""
+        start = time.perf_counter()
+        token = CancelToken(timeout=TOTAL_TIMEOUT_SECONDS)
+        try:
+            with cancel_scope(token), start_trace(item['question'], item['table']):
+                schema_info = self._get_schema_info(item['table'])
+                result = run_stages(item['question'], item['table'], self._agents(),
+                                    schema_info=schema_info, limiter=self.limiter)
+                self._write_result(item, result)
+            return {'id': item['id'], 'status': 'ok', 'seconds': time.perf_counter() - start}
+        except Exception as e:
+            logger.error(f"Question {item['id']} failed: {str(e)}")
+            return {'id': item['id'], 'status': 'error', 'error': str(e),
+                    'seconds': time.perf_counter() - start}
+        finally:
+            token.close()
+
+    def run(self, questions: List[Dict]) -> Dict:
+        """
+        Ejecuta todas las preguntas con concurrencia acotada
+
+        Returns:
+            Dict con totales, throughput y fallos
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        statuses = []
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='batch') as executor:
+            futures = [executor.submit(self.run_one, item) for item in questions]
+            for done, future in enumerate(as_completed(futures), 1):
+                status = future.result()
+                statuses.append(status)
+                logger.info(f"[{done}/{len(questions)}] {status['id']}: {status['status']} "
+                            f"({status['seconds']:.1f}s)")
+
+        elapsed = time.perf_counter() - start
+        failures = [s for s in statuses if s['status'] != 'ok']
+        summary = {
+            'total': len(statuses),
+            'succeeded': len(statuses) - len(failures),
+            'failed': len(failures),
+            'elapsed_seconds': round(elapsed, 2),
+            'questions_per_minute': round(len(statuses) / elapsed * 60, 2) if elapsed else None,
+            'failures': failures
+        }
+        (self.output_dir / 'summary.json').write_text(
+            json.dumps(summary, ensure_ascii=False, indent=2), encoding='utf-8'
+        )
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the SQL crew pipeline for a batch of questions")
+    parser.add_argument('input', help="JSONL or CSV file with 'question' and 'table' columns")
+    parser.add_argument('--output-dir', default='batch_output', help="Directory for results")
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY,
+                        help="Maximum questions processed in parallel")
+    parser.add_argument('--rpm', type=float, default=LLM_REQUESTS_PER_MINUTE,
+                        help="Maximum LLM requests per minute across all workers")
+    args = parser.parse_args()
+
+    questions = load_questions(args.input)
+    logger.info(f"Loaded {len(questions)} questions from {args.input}")
+
+    summary = BatchRunner(args.output_dir, args.concurrency, args.rpm).run(questions)
+    logger.info(f"Finished: {summary['succeeded']}/{summary['total']} succeeded, "
+                f"{summary['failed']} failed in {summary['elapsed_seconds']}s "
+                f"({summary['questions_per_minute']} questions/min)")
+    for failure in summary['failures']:
+        logger.error(f"  {failure['id']}: {failure['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@
 from dotenv import load_dotenv
 import os
 import logging
-from typing import Dict
+from typing import Dict, List
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +21,96 @@ MYSQL_PASSWORD = Config.get_env("MYSQL_PASSWORD")
 MYSQL_HOST = Config.get_env("MYSQL_HOST")
 MYSQL_DATABASE = Config.get_env("MYSQL_DATABASE")
 
+# Backend analítico: 'mysql' o 'duckdb' (embebido, sobre Parquet/CSV locales)
+DB_BACKEND = Config.get_env("DB_BACKEND", "mysql").lower()
+DUCKDB_PATH = Config.get_env("DUCKDB_PATH", ":memory:")
+DUCKDB_DATA_DIR = Config.get_env("DUCKDB_DATA_DIR", "data")
+
+# Destinos de base de datos: primario (escrituras de los loaders) y réplicas de lectura
+DB_PRIMARY_URI = Config.get_env("DB_PRIMARY_URI")  # Reemplaza MYSQL_* (p.ej. sqlite:///primary.db para pruebas locales)
+DB_REPLICA_URIS = [uri.strip() for uri in Config.get_env("DB_REPLICA_URIS", "").split(",") if uri.strip()]
+MYSQL_REPLICA_HOSTS = [host.strip() for host in Config.get_env("MYSQL_REPLICA_HOSTS", "").split(",") if host.strip()]
+DB_READ_BALANCING = Config.get_env("DB_READ_BALANCING", "round_robin").lower()  # 'round_robin' o 'latency'
+DB_REPLICA_MAX_LAG_SECONDS = float(Config.get_env("DB_REPLICA_MAX_LAG_SECONDS", "30"))
+DB_REPLICA_CHECK_SECONDS = float(Config.get_env("DB_REPLICA_CHECK_SECONDS", "15"))
+DB_REPLICA_LAG_QUERY = Config.get_env("DB_REPLICA_LAG_QUERY")  # Consulta propia que retorna el retraso en segundos
+DB_POOL_SIZE = int(Config.get_env("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(Config.get_env("DB_MAX_OVERFLOW", "10"))
+
+# Snapshots locales (Parquet) de tablas MySQL
+USE_SNAPSHOTS = Config.get_env("USE_SNAPSHOTS", "false").lower() == "true"
+SNAPSHOT_DIR = Config.get_env("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_CHUNK_ROWS = int(Config.get_env("SNAPSHOT_CHUNK_ROWS", "100000"))
+SNAPSHOT_WATERMARK_COLUMNS = [
+    col.strip() for col in Config.get_env("SNAPSHOT_WATERMARK_COLUMNS", "id,fecha_venta").split(",") if col.strip()
+]
+
+# Índice de esquema para modo multi-tabla
+SCHEMA_INDEX_DIR = Config.get_env("SCHEMA_INDEX_DIR", "schema_index")
+SCHEMA_EMBEDDINGS = Config.get_env("SCHEMA_EMBEDDINGS", "hash").lower()  # 'hash' (local), 'openai' u 'ollama'
+SCHEMA_EMBEDDING_MODEL = Config.get_env("SCHEMA_EMBEDDING_MODEL", "text-embedding-3-small")
+SCHEMA_INDEX_REFRESH_SECONDS = float(Config.get_env("SCHEMA_INDEX_REFRESH_SECONDS", "600"))
+SCHEMA_TOP_K = int(Config.get_env("SCHEMA_TOP_K", "5"))
+SCHEMA_PROMPT_MAX_CHARS = int(Config.get_env("SCHEMA_PROMPT_MAX_CHARS", "6000"))
+
+# Diccionario de valores categóricos para los prompts SQL
+VALUE_DICT_DIR = Config.get_env("VALUE_DICT_DIR", "value_dictionary")
+VALUE_DICT_MAX_CARDINALITY = int(Config.get_env("VALUE_DICT_MAX_CARDINALITY", "100"))
+VALUE_DICT_MAX_VALUES = int(Config.get_env("VALUE_DICT_MAX_VALUES", "100"))
+VALUE_DICT_SAMPLE_ROWS = int(Config.get_env("VALUE_DICT_SAMPLE_ROWS", "100000"))
+
+# Validación local y reparación de SQL generado
+MAX_SQL_REPAIR_ATTEMPTS = int(Config.get_env("MAX_SQL_REPAIR_ATTEMPTS", "2"))
+
+# Memoización de resultados e historial en disco (app.py)
+RESULT_STORE_PATH = Config.get_env("RESULT_STORE_PATH", "results/results.sqlite")
+RESULT_STORE_TTL_SECONDS = float(Config.get_env("RESULT_STORE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Segundos que se reutiliza la versión de datos de una tabla (COUNT/MAX) entre reruns
+DATA_VERSION_TTL_SECONDS = float(Config.get_env("DATA_VERSION_TTL_SECONDS", "30"))
+
+# Preguntas guardadas con refresco incremental por watermark
+SAVED_QUESTIONS_PATH = Config.get_env("SAVED_QUESTIONS_PATH", "results/saved_questions.sqlite")
+
+# Paginación de la interfaz (líneas de razonamiento por página, preguntas del historial por página)
+REASONING_PAGE_SIZE = int(Config.get_env("REASONING_PAGE_SIZE", "50"))
+HISTORY_PAGE_SIZE = int(Config.get_env("HISTORY_PAGE_SIZE", "10"))
+
+# Vía rápida por plantillas (preguntas frecuentes respondidas sin LLM)
+FAST_PATH_ENABLED = Config.get_env("FAST_PATH_ENABLED", "true").lower() == "true"
+FAST_PATH_MIN_CONFIDENCE = float(Config.get_env("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+FAST_PATH_SCHEMA_TTL = float(Config.get_env("FAST_PATH_SCHEMA_TTL", "300"))
+FAST_PATH_MAX_ROWS = int(Config.get_env("FAST_PATH_MAX_ROWS", "1000"))
+
+# Resultados en Arrow: filas por lote al leer del driver y al serializar descargas
+ARROW_BATCH_ROWS = int(Config.get_env("ARROW_BATCH_ROWS", "65536"))
+
+# Modo progresivo: vista previa sobre una muestra aleatoria mantenida por los loaders
+# y consulta exacta en segundo plano que reemplaza la vista previa al terminar
+PROGRESSIVE_QUERIES = Config.get_env("PROGRESSIVE_QUERIES", "true").lower() == "true"
+SAMPLE_FRACTION = float(Config.get_env("SAMPLE_FRACTION", "0.01"))
+SAMPLE_MIN_BASE_ROWS = int(Config.get_env("SAMPLE_MIN_BASE_ROWS", "100000"))  # Tablas menores no se muestrean
+SAMPLE_TABLE_SUFFIX = "__sample"
+SAMPLE_META_TABLE = "sqlcrew_samples"
+PROGRESSIVE_EXACT_WORKERS = int(Config.get_env("PROGRESSIVE_EXACT_WORKERS", "2"))
+PROGRESSIVE_EXACT_TIMEOUT = float(Config.get_env("PROGRESSIVE_EXACT_TIMEOUT", "900"))
+PROGRESSIVE_RESULT_TTL = float(Config.get_env("PROGRESSIVE_RESULT_TTL", "900"))
+PROGRESSIVE_POLL_SECONDS = float(Config.get_env("PROGRESSIVE_POLL_SECONDS", "2"))
+
+# Hoja de hechos calculada localmente para ExplainAgent (tamaño fijo)
+INSIGHT_TOP_K = int(Config.get_env("INSIGHT_TOP_K", "5"))
+INSIGHT_MAX_MEASURES = int(Config.get_env("INSIGHT_MAX_MEASURES", "3"))
+INSIGHT_MAX_GROUPS = int(Config.get_env("INSIGHT_MAX_GROUPS", "50"))  # cardinalidad máxima de la dimensión
+INSIGHT_MAX_COLUMNS = int(Config.get_env("INSIGHT_MAX_COLUMNS", "20"))
+
+# Plazos (segundos) por etapa y por pregunta completa
+TOTAL_TIMEOUT_SECONDS = float(Config.get_env("TOTAL_TIMEOUT_SECONDS", "300"))
+STAGE_TIMEOUT_SECONDS = {
+    'schema': float(Config.get_env("SCHEMA_STAGE_TIMEOUT", "60")),
+    'sql': float(Config.get_env("SQL_STAGE_TIMEOUT", "120")),
+    'viz': float(Config.get_env("VIZ_STAGE_TIMEOUT", "60")),
+    'explain': float(Config.get_env("EXPLAIN_STAGE_TIMEOUT", "60")),
+}
+
 # Agent Models Config (Principales y por defecto)
 SCHEMA_AGENT_MODEL = Config.get_env("SCHEMA_AGENT_MODEL", "gpt-4o-mini")
 SQL_AGENT_MODEL = Config.get_env("SQL_AGENT_MODEL", "gpt-4o-mini")
@@ -30,9 +120,93 @@ EXPLAIN_AGENT_MODEL = Config.get_env("EXPLAIN_AGENT_MODEL", "gpt-4o-mini")
 # OpenAI Config
 OPENAI_API_KEY = Config.get_env("OPENAI_API_KEY")
 
+OPENAI_BASE_URL = Config.get_env("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
 # Ollama Config (para modelos locales)
 OLLAMA_BASE_URL = Config.get_env("OLLAMA_BASE_URL", "http://localhost:11434")
 
+# Gateway LLM compartido: conexiones keep-alive y límites globales por proveedor
+LLM_POOL_SIZE = int(Config.get_env("LLM_POOL_SIZE", "16"))
+LLM_MAX_CONCURRENCY = int(Config.get_env("LLM_MAX_CONCURRENCY", "8"))
+LLM_TOKENS_PER_MINUTE = float(Config.get_env("LLM_TOKENS_PER_MINUTE", "200000"))  # 0 = sin límite
+LLM_COMPLETION_TOKENS_ESTIMATE = int(Config.get_env("LLM_COMPLETION_TOKENS_ESTIMATE", "500"))
+OLLAMA_MAX_CONCURRENCY = int(Config.get_env("OLLAMA_MAX_CONCURRENCY", "2"))
+OLLAMA_REQUESTS_PER_MINUTE = float(Config.get_env("OLLAMA_REQUESTS_PER_MINUTE", "600"))
+LLM_MAX_BACKOFF_SECONDS = float(Config.get_env("LLM_MAX_BACKOFF_SECONDS", "60"))  # tope de la pausa ante 429
+
+# Router de modelos: candidatos por etapa (en orden de preferencia), failover y hedging
+LOCAL_SMALL_MODEL = Config.get_env("LOCAL_SMALL_MODEL", "llama3.2:3b")
+STRONG_MODEL = Config.get_env("STRONG_MODEL", "gpt-4o")
+ROUTER_ENABLED = Config.get_env("ROUTER_ENABLED", "true").lower() == "true"
+ROUTER_CALL_TIMEOUT = float(Config.get_env("ROUTER_CALL_TIMEOUT", "60"))
+ROUTER_HEDGE_MIN_DELAY = float(Config.get_env("ROUTER_HEDGE_MIN_DELAY", "2"))
+ROUTER_HEDGE_MAX_DELAY = float(Config.get_env("ROUTER_HEDGE_MAX_DELAY", "20"))
+ROUTER_COOLDOWN_SECONDS = float(Config.get_env("ROUTER_COOLDOWN_SECONDS", "60"))
+ROUTER_STATS_WINDOW = int(Config.get_env("ROUTER_STATS_WINDOW", "50"))
+# Fracción de llamadas de etapas 'latency' que prueban primero un modelo aún sin mediciones
+ROUTER_PROBE_RATE = float(Config.get_env("ROUTER_PROBE_RATE", "0.05"))
+
+# Etapas baratas priorizan latencia; SQL y explicación priorizan el modelo más fuerte disponible
+STAGE_ROUTING = {'schema': 'latency', 'viz': 'latency', 'sql': 'quality', 'explain': 'quality'}
+
+# Ejecución batch y límites del LLM
+BATCH_CONCURRENCY = int(Config.get_env("BATCH_CONCURRENCY", "4"))
+LLM_REQUESTS_PER_MINUTE = float(Config.get_env("LLM_REQUESTS_PER_MINUTE", "60"))
+
+# Servicio HTTP (api.py)
+API_HOST = Config.get_env("API_HOST", "0.0.0.0")
+API_PORT = int(Config.get_env("API_PORT", "8000"))
+API_WORKERS = int(Config.get_env("API_WORKERS", "4"))
+API_MAX_QUEUE = int(Config.get_env("API_MAX_QUEUE", "16"))
+API_JOB_TIMEOUT = float(Config.get_env("API_JOB_TIMEOUT", "300"))
+API_RESULT_TTL = float(Config.get_env("API_RESULT_TTL", "900"))
+# Filas de resultados incluidas en el JSON de /result (el resto se descarga en Arrow/Parquet)
+API_RESULT_PREVIEW_ROWS = int(Config.get_env("API_RESULT_PREVIEW_ROWS", "100"))
+API_BASE_URL = Config.get_env("API_BASE_URL")  # Si se define, Streamlit delega el análisis al servicio
+
+# Tracing / Métricas de rendimiento
+TRACING_ENABLED = Config.get_env("TRACING_ENABLED", "true").lower() == "true"
+TRACE_LOG_FILE = Config.get_env("TRACE_LOG_FILE")  # JSONL con un span por línea
+METRICS_FILE = Config.get_env("METRICS_FILE")  # Archivo en formato Prometheus (textfile collector)
+
+# Profiling bajo demanda
+PROFILING_ENABLED = Config.get_env("PROFILING_ENABLED", "false").lower() == "true"
+PROFILES_DIR = Config.get_env("PROFILES_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL_MS = float(Config.get_env("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_TOP_ALLOCATIONS = int(Config.get_env("PROFILE_TOP_ALLOCATIONS", "30"))
+
+# Grabación / reproducción de interacciones con el LLM y la base de datos
+CASSETTE_MODE = Config.get_env("CASSETTE_MODE", "off").lower()  # off | record | replay
+CASSETTE_PATH = Config.get_env("CASSETTE_PATH", "cassettes/session.jsonl.gz")
+CASSETTE_REPLAY_LATENCY = Config.get_env("CASSETTE_REPLAY_LATENCY", "false").lower() == "true"
+
+def get_model_provider(model: str) -> str:
+    """Proveedor de un modelo: 'openai' para modelos gpt*, 'ollama' para el resto (locales)"""
+    return 'openai' if model.startswith('gpt') else 'ollama'
+
+def get_stage_candidates(stage: str) -> List[Dict[str, str]]:
+    """
+    Modelos candidatos de una etapa en orden de preferencia
+
+    Se pueden definir con <ETAPA>_MODEL_CANDIDATES (lista separada por comas);
+    por defecto las etapas baratas empiezan por el modelo local pequeño y SQL
+    por el modelo más fuerte. El modelo configurado del agente siempre se incluye.
+    """
+    defaults = {
+        'schema': [LOCAL_SMALL_MODEL, SCHEMA_AGENT_MODEL],
+        'viz': [LOCAL_SMALL_MODEL, VIZ_AGENT_MODEL],
+        'sql': [STRONG_MODEL, SQL_AGENT_MODEL, LOCAL_SMALL_MODEL],
+        'explain': [EXPLAIN_AGENT_MODEL, SQL_AGENT_MODEL]
+    }
+    if stage not in defaults:
+        raise ValueError(f"Tipo de agente no válido: {stage}")
+
+    configured = Config.get_env(f"{stage.upper()}_MODEL_CANDIDATES")
+    models = [m.strip() for m in configured.split(',') if m.strip()] if configured else defaults[stage]
+    models = models + [get_agent_model(stage)['model']]
+    # Sin duplicados, conservando el orden
+    return [{'provider': get_model_provider(model), 'model': model} for model in dict.fromkeys(models)]
+
 def get_agent_model(agent_type: str) -> Dict[str, str]:
     """
     Obtiene la configuración del modelo para un tipo específico de agente
@@ -55,16 +229,10 @@ def get_agent_model(agent_type: str) -> Dict[str, str]:
         raise ValueError(f"Tipo de agente no válido: {agent_type}")
     
     # Determinar si es un modelo de OpenAI o local
-    if model.startswith('gpt'):
-        return {
-            'provider': 'openai',
-            'model': model
-        }
-    else:
-        return {
-            'provider': 'ollama',
-            'model': model
-        }
+    return {
+        'provider': get_model_provider(model),
+        'model': model
+    }
 
 # Database Connection String
 def get_mysql_uri() -> str:
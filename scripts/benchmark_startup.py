@@ -0,0 +1,90 @@
+"""
+Mide el tiempo de arranque en frío (importación) de los puntos de entrada.
+
+Cada corrida importa el módulo en un proceso nuevo con `python -X importtime`
+y reporta la mediana del tiempo total junto con los paquetes de primer nivel
+más costosos. Con --max-seconds termina con código 1 si la mediana supera el
+límite, para detectar regresiones en CI.
+
+Uso:
+    python scripts/benchmark_startup.py
+    python scripts/benchmark_startup.py --module api --runs 10 --max-seconds 1.5
+"""
+
+import argparse
+import logging
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+
+# "import time:   self [us] |  cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def measure_once(module: str) -> Tuple[float, Dict[str, float]]:
+    """Importa el módulo en un proceso nuevo; retorna (segundos, {paquete: segundos acumulados})"""
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT_PATH, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'unknown error'
+        raise RuntimeError(f"Importing {module} failed: {error}")
+
+    packages = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        # Sólo importaciones de primer nivel (sin sangría): su tiempo acumulado incluye sus dependencias
+        if match and not match.group(3):
+            packages[match.group(4)] = int(match.group(2)) / 1e6
+    return elapsed, packages
+
+
+def run_benchmark(module: str, runs: int) -> Tuple[List[float], Dict[str, float]]:
+    timings = []
+    package_times = defaultdict(list)
+    for _ in range(runs):
+        elapsed, packages = measure_once(module)
+        timings.append(elapsed)
+        for package, seconds in packages.items():
+            package_times[package].append(seconds)
+    return timings, {package: statistics.median(values) for package, values in package_times.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de tiempo de arranque (importación)')
+    parser.add_argument('--module', default='app', help='Módulo a importar (app, api, batch)')
+    parser.add_argument('--runs', type=int, default=5, help='Corridas en procesos nuevos')
+    parser.add_argument('--top', type=int, default=15, help='Paquetes más costosos a mostrar')
+    parser.add_argument('--max-seconds', type=float, help='Falla si la mediana supera este límite')
+    args = parser.parse_args()
+
+    timings, packages = run_benchmark(args.module, args.runs)
+    median = statistics.median(timings)
+    logger.info(f"import {args.module}: median {median:.3f}s, min {min(timings):.3f}s, "
+                f"max {max(timings):.3f}s over {args.runs} runs")
+    for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        logger.info(f"  {seconds:8.3f}s  {package}")
+
+    if args.max_seconds is not None and median > args.max_seconds:
+        logger.error(f"Startup regression: {median:.3f}s > {args.max_seconds:.3f}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
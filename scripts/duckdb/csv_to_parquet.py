@@ -0,0 +1,53 @@
+# csv_to_parquet.py
+import logging
+import sys
+from pathlib import Path
+
+import duckdb
+
+# Configurar logging básico
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def convert_directory(directory: str = 'data') -> None:
+    """
+    Convierte cada CSV del directorio a Parquet (ZSTD) para el backend DuckDB
+
+    Las columnas fecha/date se tipan automáticamente con read_csv_auto. Si ya existe
+    un Parquet más reciente que el CSV, el archivo se omite.
+    """
+    # Obtener ruta raíz del proyecto (2 niveles arriba de scripts/duckdb)
+    root_path = Path(__file__).parent.parent.parent
+    data_dir = root_path / directory
+    if not data_dir.exists():
+        logger.error(f"El directorio {directory} no existe")
+        sys.exit(1)
+
+    csv_files = list(data_dir.glob('*.csv'))
+    if not csv_files:
+        logger.warning(f"No se encontraron CSVs en {directory}")
+        return
+
+    conn = duckdb.connect()
+    try:
+        for csv_file in csv_files:
+            parquet_file = csv_file.with_suffix('.parquet')
+            if parquet_file.exists() and parquet_file.stat().st_mtime >= csv_file.stat().st_mtime:
+                logger.info(f"{parquet_file.name} está actualizado")
+                continue
+
+            source = csv_file.as_posix().replace("'", "''")
+            target = parquet_file.as_posix().replace("'", "''")
+            conn.execute(
+                f"COPY (SELECT * FROM read_csv_auto('{source}')) "
+                f"TO '{target}' (FORMAT PARQUET, COMPRESSION ZSTD)"
+            )
+            logger.info(f"Convertido {csv_file.name} -> {parquet_file.name}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    convert_directory(sys.argv[1] if len(sys.argv) > 1 else 'data')
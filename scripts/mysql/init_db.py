@@ -1,11 +1,14 @@
 # init_db.py
 import os
 import sys
+import argparse
 import logging
 import mysql.connector
 from pathlib import Path
 from dotenv import load_dotenv
 
+from partitions import PARTITION_SCHEMES, convert_to_partitioned, get_partition_column
+
 # Configurar logging
 logging.basicConfig(
     level=logging.INFO,
@@ -90,10 +93,48 @@ def create_database():
             conn.close()
         logger.info("Conexión cerrada")
 
+def partition_table(table_name: str, column: str, scheme: str):
+    """Convierte una tabla plana existente en particionada por rango de fechas (mes o año)"""
+    config = load_environment()
+    conn = cursor = None
+    try:
+        conn = mysql.connector.connect(
+            **config,
+            database=os.getenv('MYSQL_DATABASE'),
+            auth_plugin='mysql_native_password'
+        )
+        cursor = conn.cursor()
+        
+        current = get_partition_column(cursor, table_name)
+        if current:
+            logger.info(f"La tabla '{table_name}' ya está particionada por {current}")
+            return
+        convert_to_partitioned(cursor, table_name, column, scheme)
+        conn.commit()
+        
+    except (mysql.connector.Error, ValueError) as err:
+        logger.error(f"Error al particionar la tabla {table_name}: {err}")
+        sys.exit(1)
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crea/verifica la base de datos y opcionalmente particiona una tabla")
+    parser.add_argument('--partition-table', help="Tabla existente a particionar por rango de fechas")
+    parser.add_argument('--partition-column', help="Columna de fecha de la partición (p.ej. fecha_venta)")
+    parser.add_argument('--partition-by', choices=PARTITION_SCHEMES, default='month')
+    args = parser.parse_args()
+    if args.partition_table and not args.partition_column:
+        parser.error("--partition-table requiere --partition-column")
+    
     try:
         logger.info("=== Iniciando proceso de creación/verificación de base de datos ===")
         create_database()
+        if args.partition_table:
+            partition_table(args.partition_table, args.partition_column, args.partition_by)
         logger.info("=== Proceso finalizado exitosamente ===")
     except Exception as e:
         logger.error(f"Error inesperado: {str(e)}")
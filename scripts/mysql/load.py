@@ -1,10 +1,16 @@
 import os
+import argparse
 import mysql.connector
 from mysql.connector import Error
 from dotenv import load_dotenv
 import pandas as pd
 import logging
 from pathlib import Path
+from datetime import datetime
+from typing import Optional
+
+from partitions import (PARTITION_SCHEMES, add_partitions, drop_expired_partitions, get_partition_column,
+                        get_partitions, partition_clause, partition_name, period_start, periods_in)
 
 # Configurar logging básico
 logging.basicConfig(
@@ -14,10 +20,11 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class SimpleCSVLoader:
-    def __init__(self):
+    def __init__(self, partition_by: Optional[str] = None, retention: Optional[int] = None):
         # Cargar variables de entorno
         load_dotenv()
         
+        # Las escrituras van siempre al primario (MYSQL_HOST), nunca a MYSQL_REPLICA_HOSTS
         self.config = {
             'user': os.getenv('MYSQL_USER'),
             'password': os.getenv('MYSQL_PASSWORD'),
@@ -25,6 +32,18 @@ class SimpleCSVLoader:
             'database': os.getenv('MYSQL_DATABASE')
         }
         
+        # Muestra aleatoria para las vistas previas del modo progresivo (SQLAgent)
+        self.sample_fraction = float(os.getenv('SAMPLE_FRACTION', '0.01'))
+        self.sample_min_rows = int(os.getenv('SAMPLE_MIN_BASE_ROWS', '100000'))
+        
+        # Particionado por rango de fechas: 'month', 'year' o '' (tabla plana)
+        self.partition_by = (partition_by if partition_by is not None
+                             else os.getenv('MYSQL_PARTITION_BY', '')).lower()
+        if self.partition_by not in PARTITION_SCHEMES:
+            self.partition_by = ''
+        # Periodos completos que se conservan; 0 = no se eliminan particiones
+        self.retention = retention if retention is not None else int(os.getenv('MYSQL_PARTITION_RETENTION', '0'))
+        
         self.conn = None
         self.cursor = None
 
@@ -39,8 +58,27 @@ class SimpleCSVLoader:
             logger.error(f"Error de conexión: {str(e)}")
             return False
 
-    def create_table_from_df(self, table_name: str, df: pd.DataFrame) -> bool:
-        """Crea una tabla basada en la estructura del DataFrame"""
+    def detect_partition_column(self, df: pd.DataFrame, date_columns) -> Optional[str]:
+        """
+        Columna de fecha principal para particionar: la primera sin nulos
+        (MySQL la exige en la clave primaria, que no admite NULL)
+        """
+        if not self.partition_by:
+            return None
+        for col in date_columns:
+            if df[col].notna().all():
+                return col
+        if date_columns:
+            logger.warning(f"Las columnas de fecha {date_columns} tienen nulos: la tabla no se particiona")
+        return None
+
+    def create_table_from_df(self, table_name: str, df: pd.DataFrame, partition_column: Optional[str] = None) -> bool:
+        """
+        Crea una tabla basada en la estructura del DataFrame
+
+        Con partition_column la tabla se particiona por mes o año (self.partition_by)
+        con una partición por periodo presente en los datos más `pmax`
+        """
         try:
             # Mapeo simple de tipos de datos
             type_mapping = {
@@ -56,14 +94,24 @@ class SimpleCSVLoader:
             for col in df.columns:
                 col_type = str(df[col].dtype)
                 sql_type = type_mapping.get(col_type, 'TEXT')
-                columns.append(f"`{col}` {sql_type}")
+                not_null = ' NOT NULL' if col == partition_column else ''
+                columns.append(f"`{col}` {sql_type}{not_null}")
+            
+            # La columna de particionado debe formar parte de la clave primaria
+            if partition_column:
+                key = f"id INT AUTO_INCREMENT, {', '.join(columns)}, PRIMARY KEY (id, `{partition_column}`)"
+                partitioning = partition_clause(partition_column, periods_in(df[partition_column], self.partition_by),
+                                                self.partition_by)
+            else:
+                key = f"id INT AUTO_INCREMENT PRIMARY KEY, {', '.join(columns)}"
+                partitioning = ''
             
             # SQL para crear la tabla
             create_table_sql = f"""
             CREATE TABLE IF NOT EXISTS `{table_name}` (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                {', '.join(columns)}
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+                {key}
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            {partitioning};
             """
             
             self.cursor.execute(create_table_sql)
@@ -75,6 +123,47 @@ class SimpleCSVLoader:
             logger.error(f"Error creando tabla: {str(e)}")
             return False
 
+    def refresh_sample_table(self, table_name: str) -> bool:
+        """
+        Recrea `<tabla>__sample` con una fracción aleatoria de las filas y registra
+        la fracción real en sqlcrew_samples (misma lógica que src/utils/progressive.refresh_sample)
+        """
+        try:
+            self.cursor.execute(f"SELECT COUNT(*) FROM `{table_name}`")
+            base_rows = self.cursor.fetchone()[0]
+            if base_rows < self.sample_min_rows:
+                logger.info(f"Tabla {table_name} con {base_rows} filas: no se genera muestra")
+                return True
+            
+            sample_table = f"{table_name}__sample"
+            # Se construye aparte y se intercambia para no exponer una muestra a medio cargar
+            self.cursor.execute(f"DROP TABLE IF EXISTS `{sample_table}_new`")
+            self.cursor.execute(
+                f"CREATE TABLE `{sample_table}_new` AS SELECT * FROM `{table_name}` WHERE RAND() < %s",
+                (self.sample_fraction,)
+            )
+            self.cursor.execute(f"SELECT COUNT(*) FROM `{sample_table}_new`")
+            sample_rows = self.cursor.fetchone()[0]
+            self.cursor.execute(f"DROP TABLE IF EXISTS `{sample_table}`")
+            self.cursor.execute(f"RENAME TABLE `{sample_table}_new` TO `{sample_table}`")
+            
+            self.cursor.execute(
+                "CREATE TABLE IF NOT EXISTS `sqlcrew_samples` (table_name VARCHAR(255) PRIMARY KEY, "
+                "sample_table VARCHAR(255), fraction DOUBLE PRECISION, base_rows BIGINT, refreshed_at VARCHAR(32))"
+            )
+            self.cursor.execute(
+                "REPLACE INTO `sqlcrew_samples` VALUES (%s, %s, %s, %s, %s)",
+                (table_name, sample_table, sample_rows / base_rows, base_rows,
+                 datetime.now().isoformat(timespec='seconds'))
+            )
+            self.conn.commit()
+            logger.info(f"Muestra {sample_table} actualizada: {sample_rows} de {base_rows} filas")
+            return True
+            
+        except Error as e:
+            logger.error(f"Error actualizando muestra de {table_name}: {str(e)}")
+            return False
+
     def load_csv_to_table(self, csv_path: str) -> bool:
         """Carga un archivo CSV a una tabla en MySQL"""
         try:
@@ -90,35 +179,77 @@ class SimpleCSVLoader:
                 df[col] = pd.to_datetime(df[col], errors='coerce')
             
             # Crear tabla
-            if not self.create_table_from_df(table_name, df):
+            if not self.create_table_from_df(table_name, df, self.detect_partition_column(df, date_columns)):
                 return False
             
-            # Preparar la inserción
-            columns = df.columns
-            placeholders = ', '.join(['%s'] * len(columns))
-            
-            # Insertar por lotes
-            batch_size = 1000
-            for i in range(0, len(df), batch_size):
-                batch = df.iloc[i:i + batch_size]
-                values = [tuple(x) for x in batch.replace({pd.NA: None}).values]
-                
-                insert_sql = f"""
-                INSERT INTO `{table_name}` 
-                (`{'`, `'.join(columns)}`) 
-                VALUES ({placeholders})
-                """
-                
-                self.cursor.executemany(insert_sql, values)
-                self.conn.commit()
-                logger.info(f"Insertados registros {i} a {i + len(batch)}")
+            # Si la tabla ya existía particionada, se usa su columna y se agregan los periodos nuevos
+            partition_column = get_partition_column(self.cursor, table_name) if self.partition_by else None
+            if partition_column:
+                add_partitions(self.cursor, table_name, periods_in(df[partition_column], self.partition_by),
+                               self.partition_by)
+                self.insert_by_partition(table_name, df, partition_column)
+            else:
+                self.insert_batches(table_name, df)
             
+            # La muestra se regenera con las filas nuevas; si falla, la carga igual es válida
+            self.refresh_sample_table(table_name)
             return True
             
         except Exception as e:
             logger.error(f"Error cargando CSV: {str(e)}")
             return False
 
+    def insert_batches(self, table_name: str, df: pd.DataFrame, partition: Optional[str] = None):
+        """Inserta el DataFrame por lotes (en la partición indicada, si se da)"""
+        columns = df.columns
+        placeholders = ', '.join(['%s'] * len(columns))
+        target = f"`{table_name}` PARTITION ({partition})" if partition else f"`{table_name}`"
+        
+        insert_sql = f"""
+        INSERT INTO {target} 
+        (`{'`, `'.join(columns)}`) 
+        VALUES ({placeholders})
+        """
+        
+        # Insertar por lotes
+        batch_size = 1000
+        for i in range(0, len(df), batch_size):
+            batch = df.iloc[i:i + batch_size]
+            values = [tuple(x) for x in batch.replace({pd.NA: None}).values]
+            self.cursor.executemany(insert_sql, values)
+            self.conn.commit()
+            logger.info(f"Insertados registros {i} a {i + len(batch)}" + (f" en {partition}" if partition else ""))
+
+    def insert_by_partition(self, table_name: str, df: pd.DataFrame, partition_column: str):
+        """
+        Agrupa las filas por periodo e inserta cada grupo en su partición, de modo que
+        cada lote escribe en un solo árbol InnoDB. Las filas anteriores a la primera
+        partición o posteriores a la última con límite van a la que las contiene.
+        """
+        missing_dates = df[partition_column].isna()
+        if missing_dates.any():
+            logger.warning(f"{missing_dates.sum()} filas sin {partition_column} no se cargan (clave de partición)")
+            df = df[~missing_dates]
+        partitions = get_partitions(self.cursor, table_name)
+        names = {name for name, _ in partitions}
+        periods = df[partition_column].map(lambda value: period_start(value, self.partition_by))
+        for start, group in df.groupby(periods, sort=True):
+            name = partition_name(start, self.partition_by)
+            self.insert_batches(table_name, group, name if name in names else None)
+
+    def expire_partitions(self, table_name: str) -> bool:
+        """Elimina las particiones más antiguas que la retención configurada"""
+        if not self.partition_by or self.retention <= 0 or not get_partition_column(self.cursor, table_name):
+            return True
+        try:
+            if drop_expired_partitions(self.cursor, table_name, self.partition_by, self.retention):
+                # La muestra del modo progresivo no debe conservar filas eliminadas
+                self.refresh_sample_table(table_name)
+            return True
+        except Error as e:
+            logger.error(f"Error eliminando particiones de {table_name}: {str(e)}")
+            return False
+
     def process_directory(self, directory: str = 'data'):
         """Procesa todos los CSVs en un directorio"""
         try:
@@ -142,6 +273,7 @@ class SimpleCSVLoader:
             for csv_file in csv_files:
                 logger.info(f"Procesando {csv_file}")
                 if self.load_csv_to_table(str(csv_file)):
+                    self.expire_partitions(csv_file.stem)
                     logger.info(f"Archivo {csv_file} procesado exitosamente")
                 else:
                     logger.error(f"Error procesando {csv_file}")
@@ -156,7 +288,15 @@ class SimpleCSVLoader:
                 logger.info("Conexión cerrada")
 
 def main():
-    loader = SimpleCSVLoader()
+    parser = argparse.ArgumentParser(description="Carga los CSV de data/ en MySQL")
+    parser.add_argument('--partition-by', choices=PARTITION_SCHEMES,
+                        help="Particionar las tablas nuevas por rango de fechas (default: MYSQL_PARTITION_BY)")
+    parser.add_argument('--retention', type=int,
+                        help="Periodos completos a conservar; los anteriores se eliminan "
+                             "(default: MYSQL_PARTITION_RETENTION, 0 = todos)")
+    args = parser.parse_args()
+    
+    loader = SimpleCSVLoader(partition_by=args.partition_by, retention=args.retention)
     loader.process_directory()
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+# partitions.py
+"""
+Particionado por rango de fechas (mes o año) para las tablas de MySQL.
+
+Las tablas se crean con PARTITION BY RANGE COLUMNS(<columna fecha>): una
+partición por periodo más `pmax` (MAXVALUE) para las fechas futuras. Las
+consultas que comparan la columna directamente con literales (p.ej.
+fecha >= '2024-01-01') sólo leen las particiones de ese rango.
+
+Lo usan load.py (creación, cargas incrementales y expiración) e init_db.py
+(conversión de una tabla plana existente).
+"""
+
+import logging
+from datetime import date, datetime
+from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PARTITION_SCHEMES = ('month', 'year')
+MAX_PARTITION = 'pmax'
+
+
+def period_start(value, scheme: str) -> date:
+    """Primer día del mes o año que contiene la fecha"""
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.replace(month=1, day=1) if scheme == 'year' else value.replace(day=1)
+
+
+def shift_period(start: date, scheme: str, periods: int = 1) -> date:
+    """Inicio del periodo desplazado `periods` meses o años (negativo hacia atrás)"""
+    if scheme == 'year':
+        return start.replace(year=start.year + periods)
+    months = start.year * 12 + start.month - 1 + periods
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(start: date, scheme: str) -> str:
+    return f"p{start.year}" if scheme == 'year' else f"p{start.year}{start.month:02d}"
+
+
+def partition_definitions(starts: Iterable[date], scheme: str) -> List[str]:
+    """Definiciones PARTITION ... VALUES LESS THAN para cada periodo"""
+    return [
+        f"PARTITION {partition_name(start, scheme)} VALUES LESS THAN ('{shift_period(start, scheme).isoformat()}')"
+        for start in sorted(set(starts))
+    ]
+
+
+def partition_clause(column: str, starts: Iterable[date], scheme: str) -> str:
+    """Cláusula PARTITION BY completa para CREATE/ALTER TABLE"""
+    definitions = partition_definitions(starts, scheme)
+    definitions.append(f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    return f"PARTITION BY RANGE COLUMNS(`{column}`) ({', '.join(definitions)})"
+
+
+def period_range(first: date, last: date, scheme: str) -> List[date]:
+    """Periodos consecutivos de first a last (inclusive), sin huecos"""
+    starts = []
+    start = period_start(first, scheme)
+    while start <= last:
+        starts.append(start)
+        start = shift_period(start, scheme)
+    return starts
+
+
+def periods_in(dates: Iterable, scheme: str) -> List[date]:
+    """Periodos que cubren una serie de fechas, de la mínima a la máxima (ignora nulos y NaT)"""
+    starts = {period_start(value, scheme) for value in dates if value is not None and value == value}
+    return period_range(min(starts), max(starts), scheme) if starts else []
+
+
+def get_partitions(cursor, table_name: str) -> List[Tuple[str, Optional[date]]]:
+    """
+    Particiones de la tabla en orden, con el límite superior de cada una
+    (None para MAXVALUE). Lista vacía si la tabla no está particionada.
+    """
+    cursor.execute(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION",
+        (table_name,)
+    )
+    partitions = []
+    for name, description in cursor.fetchall():
+        # RANGE COLUMNS describe el límite como literal: '2024-02-01' o '2024-02-01 00:00:00'
+        bound = None if description == 'MAXVALUE' else date.fromisoformat(description.strip("'")[:10])
+        partitions.append((name, bound))
+    return partitions
+
+
+def get_partition_column(cursor, table_name: str) -> Optional[str]:
+    """Columna de particionado de la tabla (None si no está particionada)"""
+    cursor.execute(
+        "SELECT PARTITION_EXPRESSION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL LIMIT 1",
+        (table_name,)
+    )
+    row = cursor.fetchone()
+    return row[0].strip('`') if row and row[0] else None
+
+
+def add_partitions(cursor, table_name: str, starts: Iterable[date], scheme: str) -> List[str]:
+    """
+    Agrega particiones para los periodos posteriores a la última existente,
+    dividiendo `pmax` (REORGANIZE mueve sólo las filas de pmax, que suele estar vacía).
+    Los periodos anteriores a la primera partición quedan en ella.
+
+    Returns:
+        Nombres de las particiones agregadas
+    """
+    partitions = get_partitions(cursor, table_name)
+    bounds = [bound for _, bound in partitions if bound is not None]
+    if not bounds:
+        return []
+    new_starts = [start for start in set(starts) if start >= bounds[-1]]
+    if not new_starts:
+        return []
+    # Sin huecos: también se crean los periodos intermedios sin filas
+    missing = period_range(bounds[-1], max(new_starts), scheme)
+    definitions = partition_definitions(missing, scheme)
+    definitions.append(f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    cursor.execute(
+        f"ALTER TABLE `{table_name}` REORGANIZE PARTITION {MAX_PARTITION} INTO ({', '.join(definitions)})"
+    )
+    added = [partition_name(start, scheme) for start in missing]
+    logger.info(f"Particiones agregadas a {table_name}: {', '.join(added)}")
+    return added
+
+
+def expired_partitions(partitions: List[Tuple[str, Optional[date]]], scheme: str, retention: int,
+                       today: Optional[date] = None) -> List[str]:
+    """
+    Particiones cuyos datos son anteriores a los últimos `retention` periodos
+    completos (el periodo en curso siempre se conserva)
+    """
+    if retention <= 0:
+        return []
+    cutoff = shift_period(period_start(today or date.today(), scheme), scheme, -retention)
+    expired = [name for name, bound in partitions if bound is not None and bound <= cutoff]
+    # MySQL no permite quitar todas las particiones: se conserva al menos una con límite
+    if len(expired) == len([bound for _, bound in partitions if bound is not None]):
+        expired = expired[:-1]
+    return expired
+
+
+def drop_expired_partitions(cursor, table_name: str, scheme: str, retention: int) -> List[str]:
+    """Elimina (DROP PARTITION, sin borrar fila por fila) las particiones expiradas"""
+    expired = expired_partitions(get_partitions(cursor, table_name), scheme, retention)
+    if expired:
+        cursor.execute(f"ALTER TABLE `{table_name}` DROP PARTITION {', '.join(expired)}")
+        logger.info(f"Particiones expiradas eliminadas de {table_name}: {', '.join(expired)}")
+    return expired
+
+
+def convert_to_partitioned(cursor, table_name: str, column: str, scheme: str) -> None:
+    """
+    Convierte una tabla plana (PRIMARY KEY (id)) en particionada por la columna de fecha.
+
+    MySQL exige que la columna de particionado forme parte de la clave primaria,
+    por lo que la clave pasa a ser (id, columna) y la columna a NOT NULL.
+    """
+    cursor.execute(f"SELECT COUNT(*) FROM `{table_name}` WHERE `{column}` IS NULL")
+    if cursor.fetchone()[0]:
+        raise ValueError(f"Column {column} of {table_name} has NULL values; it cannot be a partition key")
+    cursor.execute(f"SELECT MIN(`{column}`), MAX(`{column}`) FROM `{table_name}`")
+    low, high = cursor.fetchone()
+    starts = periods_in([low, high], scheme) or [period_start(date.today(), scheme)]
+
+    cursor.execute(f"SHOW COLUMNS FROM `{table_name}` LIKE %s", (column,))
+    column_type = cursor.fetchone()[1]
+    cursor.execute(
+        f"ALTER TABLE `{table_name}` MODIFY `{column}` {column_type} NOT NULL, "
+        f"DROP PRIMARY KEY, ADD PRIMARY KEY (id, `{column}`)"
+    )
+    cursor.execute(f"ALTER TABLE `{table_name}` {partition_clause(column, starts, scheme)}")
+    logger.info(f"Tabla {table_name} particionada por {scheme} en {column} ({len(starts)} periodos)")
@@ -0,0 +1,44 @@
+"""
+Refresca todas las preguntas guardadas (p.ej. desde cron, después de cada carga).
+
+Las preguntas con agregaciones descomponibles sólo procesan las filas nuevas
+desde su último watermark; el resto se recalcula completo. Termina con código 1
+si alguna pregunta falla.
+
+Uso:
+    python scripts/refresh_saved_questions.py
+"""
+
+import logging
+import sys
+import time
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_PATH))
+
+from src.utils.saved_questions import get_saved_question_store, refresh_question  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    failures = 0
+    for item in get_saved_question_store().list():
+        start = time.perf_counter()
+        try:
+            refreshed = refresh_question(item['id'])
+            logger.info(f"{item['question']!r}: {refreshed['state']['last_refresh']} "
+                        f"in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            failures += 1
+            logger.error(f"{item['question']!r}: {str(e)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
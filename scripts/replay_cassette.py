@@ -0,0 +1,83 @@
+"""
+Reproduce sin red las corridas grabadas en un cassette y mide su tiempo.
+
+Grabar: CASSETTE_MODE=record (Streamlit, api.py o cualquier llamada a
+run_crew_analysis) escribe cada prompt/respuesta del LLM y cada resultado SQL en
+CASSETTE_PATH. Este script vuelve a ejecutar esas corridas sirviendo las
+respuestas desde el cassette, sin OpenAI/Ollama ni MySQL, para comparar el efecto
+de cambios de rendimiento en la app, los agentes y AgentOutputHandler.
+
+Con --latency se espera el tiempo original de cada interacción (tiempo total
+realista); sin él se mide sólo el trabajo local. Termina con código 1 si alguna
+corrida diverge de lo grabado (CassetteMiss).
+
+Uso:
+    python scripts/replay_cassette.py cassettes/session.jsonl.gz
+    python scripts/replay_cassette.py cassettes/session.jsonl.gz --repeat 5 --latency
+"""
+
+import argparse
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_PATH))
+
+from config.config import CASSETTE_PATH  # noqa: E402
+from src.utils.cassette import Cassette, CassetteMiss, use_cassette  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('cassette', nargs='?', default=CASSETTE_PATH, help="Cassette grabado (default: CASSETTE_PATH)")
+    parser.add_argument('--repeat', type=int, default=1, help="Veces que se reproduce el cassette completo")
+    parser.add_argument('--latency', action='store_true', help="Simular la latencia original de cada interacción")
+    args = parser.parse_args()
+
+    cassette = Cassette(args.cassette, 'replay', simulate_latency=args.latency)
+    use_cassette(cassette)
+    if not cassette.runs:
+        logger.error(f"{args.cassette} has no recorded runs")
+        sys.exit(1)
+
+    # Importación después de activar el cassette: los módulos sólo lo consultan al llamar
+    from src.utils.pipeline import run_crew_analysis
+
+    timings = {}
+    totals = []
+    failures = 0
+    for _ in range(args.repeat):
+        cassette.rewind()
+        replay_start = time.perf_counter()
+        for run in cassette.runs:
+            arguments = run['arguments']
+            start = time.perf_counter()
+            try:
+                run_crew_analysis(arguments['question'], arguments['selected_table'],
+                                  arguments.get('schema_context'), arguments.get('progressive', False))
+            except CassetteMiss as e:
+                failures += 1
+                logger.error(f"{arguments['question']!r} diverged from the recording: {str(e)}")
+                continue
+            timings.setdefault(arguments['question'], []).append(time.perf_counter() - start)
+        totals.append(time.perf_counter() - replay_start)
+
+    for question, values in timings.items():
+        logger.info(f"{question!r}: median {statistics.median(values) * 1000:.1f} ms "
+                    f"over {len(values)} replays")
+    logger.info(f"{len(cassette.runs)} runs: median {statistics.median(totals) * 1000:.1f} ms "
+                f"per replay of the cassette")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
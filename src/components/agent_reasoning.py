@@ -1,44 +1,58 @@
+import html
+import math
+from functools import lru_cache
+from typing import List, Dict, Tuple
+
 import streamlit as st
-from typing import List, Dict
 
-def display_agent_reasoning_component(reasoning_steps: List[Dict]):
+from config.config import REASONING_PAGE_SIZE
+
+# Estilos en línea: cada paso se emite como un único bloque HTML sin inyectar CSS en cada rerun
+STEP_STYLE = "border-left: 3px solid #0066cc; padding-left: 10px; margin-bottom: 15px;"
+NAME_STYLE = "font-weight: bold; color: #0066cc;"
+THOUGHT_STYLE = "margin-left: 20px; color: #666666;"
+
+
+@lru_cache(maxsize=512)
+def render_step_html(agent: str, thoughts: Tuple[str, ...]) -> str:
+    """
+    HTML escapado de un paso (o una página de un paso), cacheado por contenido
+
+    Args:
+        agent: Nombre del agente
+        thoughts: Líneas de razonamiento no vacías
+    """
+    lines = ''.join(
+        f'<div style="{THOUGHT_STYLE}">• {html.escape(thought)}</div>' for thought in thoughts
+    )
+    return (f'<div style="{STEP_STYLE}"><div style="{NAME_STYLE}">🤖 {html.escape(str(agent))}</div>'
+            f'{lines}</div>')
+
+
+def display_agent_reasoning_component(reasoning_steps: List[Dict], key: str = 'reasoning'):
     """
     Componente de Streamlit para mostrar el razonamiento del agente
-    
+
+    Los pasos con más de REASONING_PAGE_SIZE líneas se paginan: sólo se
+    renderiza la página seleccionada.
+
     Args:
         reasoning_steps: Lista de pasos de razonamiento con formato
         [{'agent': 'nombre', 'thoughts': ['pensamiento1', 'pensamiento2']}]
+        key: Prefijo único para los selectores de página (varias instancias por página)
     """
-    st.markdown("""
-        <style>
-        .agent-step {
-            border-left: 3px solid #0066cc;
-            padding-left: 10px;
-            margin-bottom: 15px;
-        }
-        .agent-name {
-            font-weight: bold;
-            color: #0066cc;
-        }
-        .agent-thought {
-            margin-left: 20px;
-            color: #666666;
-        }
-        </style>
-    """, unsafe_allow_html=True)
-
-    for step in reasoning_steps:
-        with st.container():
-            st.markdown(f"""
-                <div class="agent-step">
-                    <div class="agent-name">🤖 {step['agent']}</div>
-                </div>
-            """, unsafe_allow_html=True)
-            
-            for thought in step['thoughts']:
-                if thought.strip():
-                    st.markdown(f"""
-                        <div class="agent-thought">
-                            • {thought}
-                        </div>
-                    """, unsafe_allow_html=True)
\ No newline at end of file
+    for i, step in enumerate(reasoning_steps):
+        thoughts = tuple(thought for thought in step['thoughts'] if thought.strip())
+        pages = max(1, math.ceil(len(thoughts) / REASONING_PAGE_SIZE))
+        page = 1
+        if pages > 1:
+            page = st.number_input(
+                f"{step['agent']} — page (of {pages})",
+                min_value=1, max_value=pages, value=1,
+                key=f"{key}_step_{i}_page"
+            )
+        start = (page - 1) * REASONING_PAGE_SIZE
+        st.markdown(
+            render_step_html(step['agent'], thoughts[start:start + REASONING_PAGE_SIZE]),
+            unsafe_allow_html=True
+        )
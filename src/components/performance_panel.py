@@ -0,0 +1,32 @@
+import streamlit as st
+from typing import Dict
+
+def display_performance_panel(trace_summary: Dict):
+    """
+    Componente de Streamlit para mostrar el resumen de rendimiento de una pregunta
+
+    Args:
+        trace_summary: Resumen de la traza con formato
+        {'trace_id': ..., 'wall_time': 1.2, 'spans': [{'stage': 'sql', 'wall_time': 0.4, ...}]}
+    """
+    if not trace_summary or not trace_summary.get('spans'):
+        return
+
+    import pandas as pd
+
+    with st.expander(f"⏱️ Performance ({trace_summary['wall_time']:.2f}s total)", expanded=False):
+        df = pd.DataFrame(trace_summary['spans'])
+        columns = ['stage', 'parent', 'wall_time', 'db_time', 'prompt_tokens',
+                   'completion_tokens', 'rows_returned', 'bytes_transferred', 'status']
+        df = df[[col for col in columns if col in df.columns]]
+
+        col1, col2, col3 = st.columns(3)
+        col1.metric("LLM tokens", int(df['prompt_tokens'].sum() + df['completion_tokens'].sum()))
+        col2.metric("DB time", f"{df['db_time'].sum():.3f}s")
+        col3.metric("Rows", int(df['rows_returned'].sum()))
+
+        st.dataframe(
+            df.style.format({'wall_time': '{:.3f}', 'db_time': '{:.3f}'}),
+            use_container_width=True
+        )
+        st.caption(f"Trace ID: {trace_summary['trace_id']}")
@@ -0,0 +1,78 @@
+import logging
+import time
+from typing import Dict, Any, List
+
+import pyarrow.ipc as ipc
+import requests
+
+from config.config import API_BASE_URL, API_JOB_TIMEOUT
+from src.utils.arrow_result import QueryResult
+from src.utils.cancellation import current_token
+
+logger = logging.getLogger(__name__)
+
+
+class APIClient:
+    """Cliente del servicio HTTP (api.py) para usar Streamlit como cliente liviano"""
+
+    def __init__(self, base_url: str = API_BASE_URL, poll_interval: float = 1.0):
+        self.base_url = base_url.rstrip('/')
+        self.poll_interval = poll_interval
+        self.session = requests.Session()
+
+    def get_table_names(self) -> List[str]:
+        response = self.session.get(f"{self.base_url}/tables", timeout=10)
+        response.raise_for_status()
+        return response.json()['tables']
+
+    def cancel(self, job_id: str) -> None:
+        try:
+            self.session.delete(f"{self.base_url}/jobs/{job_id}", timeout=10)
+        except requests.RequestException as e:
+            logger.error(f"Error cancelling job {job_id}: {str(e)}")
+
+    def download(self, job_id: str) -> QueryResult:
+        """Resultados completos de la consulta de un trabajo terminado (Arrow IPC)"""
+        response = self.session.get(f"{self.base_url}/result/{job_id}/arrow", timeout=60)
+        response.raise_for_status()
+        return QueryResult(ipc.open_stream(response.content).read_all())
+
+    def analyze(self, question: str, table: str) -> Dict[str, Any]:
+        """
+        Envía la pregunta al servicio y espera el resultado
+
+        Args:
+            question: Pregunta en lenguaje natural
+            table: Tabla a analizar
+
+        Returns:
+            Dict con la salida formateada del análisis
+        """
+        response = self.session.post(f"{self.base_url}/ask",
+                                     json={'question': question, 'table': table}, timeout=10)
+        if response.status_code == 429:
+            raise RuntimeError("The analysis service is busy, please retry in a few seconds")
+        response.raise_for_status()
+        job_id = response.json()['job_id']
+
+        deadline = time.monotonic() + API_JOB_TIMEOUT
+        while time.monotonic() < deadline:
+            response = self.session.get(f"{self.base_url}/result/{job_id}", timeout=10)
+            if response.status_code == 200:
+                result = response.json()['result']
+                if result.get('truncated'):
+                    # El JSON trae sólo las primeras filas: el resultado completo llega en Arrow
+                    result['execute_query'] = self.download(job_id)
+                return result
+            if response.status_code != 202:
+                raise RuntimeError(response.json().get('error') or f"Job {job_id} failed")
+            token = current_token()
+            if token is None:
+                time.sleep(self.poll_interval)
+            elif token.wait(self.poll_interval):
+                # Pregunta reemplazada o plazo vencido: el servicio deja de procesar el trabajo
+                self.cancel(job_id)
+                token.check()
+
+        self.cancel(job_id)
+        raise TimeoutError(f"Job {job_id} did not finish in {API_JOB_TIMEOUT:.0f}s")
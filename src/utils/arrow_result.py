@@ -0,0 +1,159 @@
+import io
+import logging
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Union
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from config.config import ARROW_BATCH_ROWS
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Formatos de descarga: extensión y tipo MIME
+DOWNLOAD_FORMATS = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream')
+}
+
+
+def normalize_arrow_types(table: pa.Table) -> pa.Table:
+    """
+    Decimales a float64: los SUM/AVG de MySQL llegan como DECIMAL y el resto del
+    pipeline (gráficos, hoja de hechos) los necesita numéricos
+    """
+    columns = [
+        column.cast(pa.float64()) if pa.types.is_decimal(column.type) else column
+        for column in table.columns
+    ]
+    return pa.table(columns, names=table.column_names)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Archivo de sólo escritura que acumula bytes para entregarlos por bloques"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> Iterator[bytes]:
+        chunks, self._chunks = self._chunks, []
+        if chunks:
+            yield b''.join(chunks)
+
+
+class QueryResult:
+    """
+    Resultado de una consulta respaldado por una tabla Arrow.
+
+    Los valores se guardan en columnas Arrow (sin un objeto Python por celda) y el
+    mismo objeto pasa por referencia de SQLAgent a viz, explain, el almacén de
+    resultados y st.dataframe. La conversión a pandas se hace una sola vez, sólo
+    si alguna etapa la pide.
+    """
+
+    def __init__(self, table: pa.Table):
+        self._table = table
+        self._df: Optional['pd.DataFrame'] = None
+
+    @classmethod
+    def from_pandas(cls, df: 'pd.DataFrame') -> 'QueryResult':
+        return cls(normalize_arrow_types(pa.Table.from_pandas(df, preserve_index=False)))
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]], columns: Optional[List[str]] = None) -> 'QueryResult':
+        table = pa.Table.from_pylist(records)
+        if columns and not records:
+            table = pa.table({column: pa.array([], pa.null()) for column in columns})
+        return cls(table)
+
+    @property
+    def table(self) -> pa.Table:
+        return self._table
+
+    @property
+    def columns(self) -> List[str]:
+        return self._table.column_names
+
+    @property
+    def nbytes(self) -> int:
+        return self._table.nbytes
+
+    def __len__(self) -> int:
+        return self._table.num_rows
+
+    def to_pandas(self) -> 'pd.DataFrame':
+        """DataFrame de los resultados (se convierte una vez y se reutiliza)"""
+        if self._df is None:
+            self._df = self._table.to_pandas()
+        return self._df
+
+    def head(self, n: int = 5) -> 'QueryResult':
+        """Primeras n filas, sin copiar los datos"""
+        return QueryResult(self._table.slice(0, n))
+
+    def to_records(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Lista de dicts (para JSON); con limit sólo convierte las primeras filas"""
+        table = self._table if limit is None else self._table.slice(0, limit)
+        return table.to_pylist()
+
+    def iter_bytes(self, fmt: str = 'parquet', batch_rows: int = ARROW_BATCH_ROWS) -> Iterator[bytes]:
+        """
+        Serializa el resultado por lotes de filas, entregando cada bloque apenas se escribe
+
+        Args:
+            fmt: 'parquet' o 'arrow' (formato de streaming IPC)
+            batch_rows: Filas por lote (y por row group en Parquet)
+        """
+        if fmt not in DOWNLOAD_FORMATS:
+            raise ValueError(f"Unsupported download format: {fmt}")
+        sink = _ChunkSink()
+        if fmt == 'parquet':
+            writer = pq.ParquetWriter(sink, self._table.schema)
+        else:
+            writer = ipc.new_stream(sink, self._table.schema)
+        try:
+            for batch in self._table.to_batches(max_chunksize=batch_rows):
+                writer.write_batch(batch)
+                yield from sink.drain()
+        finally:
+            writer.close()
+        yield from sink.drain()
+
+    def to_bytes(self, fmt: str = 'parquet') -> bytes:
+        return b''.join(self.iter_bytes(fmt))
+
+    def write_parquet(self, path) -> None:
+        pq.write_table(self._table, path)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # El DataFrame en caché no se guarda: se reconstruye desde Arrow si se pide
+        return {'_table': self._table, '_df': None}
+
+    def __repr__(self) -> str:
+        return f"QueryResult({self._table.num_rows} rows, columns={self.columns})"
+
+
+def as_query_result(data: Union[QueryResult, 'pd.DataFrame', List[Dict[str, Any]]]) -> QueryResult:
+    """Acepta un QueryResult, un DataFrame o registros JSON (p.ej. la respuesta de api.py)"""
+    if isinstance(data, QueryResult):
+        return data
+    if isinstance(data, list):
+        return QueryResult.from_records(data)
+    return QueryResult.from_pandas(data)
+
+
+def to_json_default(value: Any) -> Any:
+    """default= de json.dumps: los QueryResult se envían como registros"""
+    if isinstance(value, QueryResult):
+        return value.to_records()
+    return str(value)
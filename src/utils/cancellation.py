@@ -0,0 +1,219 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, List, Optional
+
+from config.config import STAGE_TIMEOUT_SECONDS
+from src.utils.profiling import current_profiler, profiled_thread
+
+logger = logging.getLogger(__name__)
+
+
+class OperationCancelled(Exception):
+    """La operación fue cancelada (pregunta reemplazada, cliente canceló o venció el plazo)"""
+
+
+class DeadlineExceeded(OperationCancelled):
+    """Venció el plazo configurado para la etapa o para la pregunta completa"""
+
+
+class CancelToken:
+    """
+    Token de cancelación cooperativa con plazo opcional.
+
+    Las etapas llaman a `check()` entre pasos; las operaciones bloqueantes
+    (consultas, llamadas al LLM) registran callbacks con `on_cancel` para
+    abortarse cuando el token se cancela. Un token hijo se cancela cuando lo
+    hace su padre.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, parent: Optional['CancelToken'] = None):
+        self.parent = parent
+        self.reason: Optional[str] = None
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        if parent is not None:
+            parent.on_cancel(self._cancel_from_parent)
+        if timeout:
+            self._timer = threading.Timer(timeout, self.cancel, args=(f"deadline of {timeout:.0f}s exceeded",))
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def _cancel_from_parent(self) -> None:
+        self.cancel(self.parent.reason)
+
+    def cancel(self, reason: str = 'cancelled') -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        logger.info(f"Operation cancelled: {reason}")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error running cancel callback: {str(e)}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Registra un callback (se ejecuta de inmediato si ya está cancelado); retorna cómo quitarlo"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def remaining(self) -> Optional[float]:
+        """Segundos hasta el plazo más cercano (propio o de un ancestro)"""
+        deadlines = []
+        token = self
+        while token is not None:
+            if token.deadline is not None:
+                deadlines.append(token.deadline - time.monotonic())
+            token = token.parent
+        return max(0.0, min(deadlines)) if deadlines else None
+
+    def check(self) -> None:
+        """Lanza OperationCancelled/DeadlineExceeded si el token fue cancelado"""
+        if self._event.is_set():
+            if self.reason and self.reason.startswith('deadline'):
+                raise DeadlineExceeded(self.reason)
+            raise OperationCancelled(self.reason)
+
+    def wait(self, timeout: float) -> bool:
+        return self._event.wait(timeout)
+
+    def close(self) -> None:
+        """Libera el temporizador del plazo y se desvincula del padre"""
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.parent is not None:
+            self.parent._remove_callback(self._cancel_from_parent)
+
+
+_current_token: ContextVar[Optional[CancelToken]] = ContextVar('current_cancel_token', default=None)
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current_token.get()
+
+
+def check_cancelled() -> None:
+    """Punto de control entre etapas: lanza si la operación actual fue cancelada"""
+    token = _current_token.get()
+    if token is not None:
+        token.check()
+
+
+@contextmanager
+def cancel_scope(token: CancelToken):
+    """Hace de `token` el token activo para el bloque"""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+@contextmanager
+def stage_deadline(stage: str):
+    """
+    Crea un token hijo con el plazo configurado para la etapa (STAGE_TIMEOUT_SECONDS)
+
+    Sin token activo no se aplica ningún plazo.
+    """
+    parent = _current_token.get()
+    if parent is None:
+        yield None
+        return
+    parent.check()
+    token = CancelToken(timeout=STAGE_TIMEOUT_SECONDS.get(stage), parent=parent)
+    try:
+        with cancel_scope(token):
+            yield token
+    finally:
+        token.close()
+    token.check()
+
+
+def run_cancellable(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Ejecuta una llamada bloqueante (p.ej. al LLM) que puede abandonarse al cancelar
+
+    La llamada corre en un hilo auxiliar; si el token activo se cancela, se deja
+    de esperar y se lanza OperationCancelled de inmediato. El hilo auxiliar
+    termina por su cuenta y su resultado se descarta.
+    """
+    token = _current_token.get()
+    if token is None:
+        return fn(*args, **kwargs)
+    return _run_in_helper(token, None, 0.0, fn, args, kwargs)
+
+
+def run_polling(poll: Callable[[], None], interval: float, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Como run_cancellable, pero llama a `poll` cada `interval` segundos mientras espera
+
+    Si `poll` lanza una excepción (p.ej. Streamlit interrumpe la corrida del script
+    porque llegó una pregunta nueva), el token activo se cancela para que la llamada
+    abandonada deje de consultar la base y el LLM, y la excepción se propaga.
+    """
+    return _run_in_helper(_current_token.get(), poll, interval, fn, args, kwargs)
+
+
+def _run_in_helper(token: Optional[CancelToken], poll: Optional[Callable[[], None]], interval: float,
+                   fn: Callable[..., Any], args, kwargs) -> Any:
+    if token is not None:
+        token.check()
+
+    outcome = {}
+    done = threading.Event()
+    context = contextvars.copy_context()
+    profiler = current_profiler()
+
+    def target():
+        try:
+            with profiled_thread(profiler):
+                outcome['result'] = context.run(fn, *args, **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            done.set()
+
+    unregister = token.on_cancel(done.set) if token is not None else None
+    threading.Thread(target=target, name='cancellable-call', daemon=True).start()
+    try:
+        if poll is None:
+            done.wait()
+        else:
+            while not done.wait(interval):
+                poll()
+    except BaseException:
+        if token is not None and not done.is_set():
+            token.cancel('wait interrupted')
+        raise
+    finally:
+        if unregister is not None:
+            unregister()
+    if 'error' in outcome:
+        raise outcome['error']
+    if 'result' not in outcome:
+        token.check()
+    return outcome['result']
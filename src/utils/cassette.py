@@ -0,0 +1,278 @@
+import atexit
+import base64
+import functools
+import gzip
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from config.config import CASSETTE_MODE, CASSETTE_PATH, CASSETTE_REPLAY_LATENCY
+from src.utils.tracing import record_db_call
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = ('record', 'replay')
+
+
+class CassetteMiss(Exception):
+    """La interacción pedida no está en el cassette (la ejecución divergió de la grabada)"""
+
+
+def interaction_key(kind: str, parts: List[Any]) -> str:
+    """Clave estable de una interacción: tipo más los argumentos que determinan su resultado"""
+    payload = json.dumps([kind, *parts], default=str, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:20]
+
+
+def _arrow_bytes(table) -> str:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    # IPC con compresión por buffer si pyarrow la trae; el archivo completo además va en gzip
+    options = ipc.IpcWriteOptions(compression='zstd' if pa.Codec.is_available('zstd') else None)
+    sink = pa.BufferOutputStream()
+    with ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue().to_pybytes()).decode('ascii')
+
+
+def _arrow_table(data: str):
+    import pyarrow.ipc as ipc
+    return ipc.open_stream(base64.b64decode(data)).read_all()
+
+
+def encode_value(value: Any) -> Dict[str, Any]:
+    """Serializa el resultado de una interacción (texto, QueryResult, DataFrame, salida del crew o JSON)"""
+    from src.utils.arrow_result import QueryResult
+
+    if isinstance(value, str):
+        return {'t': 'text', 'v': value}
+    if isinstance(value, QueryResult):
+        return {'t': 'arrow', 'v': _arrow_bytes(value.table)}
+    if type(value).__name__ == 'DataFrame':
+        import pyarrow as pa
+        return {'t': 'pandas', 'v': _arrow_bytes(pa.Table.from_pandas(value, preserve_index=False))}
+    if isinstance(value, tuple):
+        # Salida de crew.kickoff: sólo lo que usa AgentOutputHandler (descripción de la tarea y texto)
+        return {'t': 'crew', 'v': [
+            {'task': output.task.description, 'output': str(output.output)} if hasattr(output, 'task')
+            else {'task': None, 'output': str(output)}
+            for output in value
+        ]}
+    if value is None or isinstance(value, (dict, list, int, float, bool)):
+        return {'t': 'json', 'v': json.loads(json.dumps(value, default=str))}
+    return {'t': 'text', 'v': str(value)}
+
+
+def decode_value(encoded: Dict[str, Any]) -> Any:
+    from src.utils.arrow_result import QueryResult
+
+    kind, value = encoded['t'], encoded['v']
+    if kind == 'arrow':
+        return QueryResult(_arrow_table(value))
+    if kind == 'pandas':
+        return _arrow_table(value).to_pandas()
+    if kind == 'crew':
+        return tuple(
+            SimpleNamespace(task=SimpleNamespace(description=item['task']), output=item['output'])
+            if item['task'] is not None else item['output']
+            for item in value
+        )
+    return value
+
+
+def _record_replayed_db_call(value: Any, elapsed: float) -> None:
+    # Las consultas reproducidas siguen sumando filas y bytes al span activo
+    if hasattr(value, 'nbytes') and hasattr(value, 'columns'):
+        record_db_call(elapsed, len(value), value.nbytes)
+    elif type(value).__name__ == 'DataFrame':
+        record_db_call(elapsed, len(value), int(value.memory_usage(deep=True).sum()))
+
+
+class Cassette:
+    """
+    Grabación de las interacciones con el LLM y la base de datos de corridas reales.
+
+    El archivo es JSON Lines en gzip: una línea por interacción ({'kind', 'key',
+    'elapsed', 'value'}) o por corrida ({'kind': 'run', ...}). Los resultados SQL
+    se guardan como Arrow IPC. Al grabar, las líneas se agregan al final de cada
+    corrida como un miembro gzip nuevo, así que el archivo sólo crece.
+
+    Al reproducir, cada clave entrega sus respuestas en el orden en que se grabaron
+    (la última se repite si se piden más); una clave desconocida lanza CassetteMiss
+    en lugar de salir a la red. Con simulate_latency se espera el tiempo original.
+    """
+
+    def __init__(self, path: str = CASSETTE_PATH, mode: str = 'replay', simulate_latency: bool = False):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unsupported cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.simulate_latency = simulate_latency
+        self.runs: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        self._recorded: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._queues: Dict[str, deque] = {}
+        if mode == 'replay':
+            self._load()
+            self.rewind()
+        else:
+            atexit.register(self.flush)
+
+    def _load(self) -> None:
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['kind'] == 'run':
+                    self.runs.append(entry)
+                else:
+                    self._recorded[entry['key']].append(entry)
+        logger.info(f"Cassette {self.path}: {len(self.runs)} runs, "
+                    f"{sum(len(entries) for entries in self._recorded.values())} interactions")
+
+    def rewind(self) -> None:
+        """Vuelve a servir cada clave desde su primera respuesta (para repetir la reproducción)"""
+        with self._lock:
+            self._queues = {key: deque(entries) for key, entries in self._recorded.items()}
+
+    def _next(self, kind: str, key: str) -> Dict[str, Any]:
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                raise CassetteMiss(f"No recorded {kind} interaction with key {key} in {self.path}")
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._pending.append(entry)
+
+    def call(self, kind: str, parts: List[Any], fn: Callable[[], Any]) -> Any:
+        """Graba o reproduce una interacción cuyo resultado es un solo valor"""
+        key = interaction_key(kind, parts)
+        if self.mode == 'replay':
+            entry = self._next(kind, key)
+            if self.simulate_latency:
+                time.sleep(entry['elapsed'])
+            value = decode_value(entry['value'])
+            if kind == 'sql':
+                _record_replayed_db_call(value, entry['elapsed'])
+            return value
+
+        start = time.perf_counter()
+        value = fn()
+        self._append({'kind': kind, 'key': key, 'elapsed': round(time.perf_counter() - start, 6),
+                      'value': encode_value(value)})
+        return value
+
+    def stream(self, kind: str, parts: List[Any], fn: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+        """Como call, para interacciones que entregan bloques (iter_sql); se graba cada bloque con su tiempo"""
+        key = interaction_key(kind, parts)
+        if self.mode == 'replay':
+            entry = self._next(kind, key)
+            for elapsed, encoded in zip(entry['elapsed'], entry['value']):
+                if self.simulate_latency:
+                    time.sleep(elapsed)
+                chunk = decode_value(encoded)
+                _record_replayed_db_call(chunk, elapsed)
+                yield chunk
+            return
+
+        elapsed, values = [], []
+        iterator = iter(fn())
+        while True:
+            start = time.perf_counter()
+            chunk = next(iterator, None)
+            if chunk is None:
+                break
+            elapsed.append(round(time.perf_counter() - start, 6))
+            values.append(encode_value(chunk))
+            yield chunk
+        self._append({'kind': kind, 'key': key, 'elapsed': elapsed, 'value': values})
+
+    @contextmanager
+    def run(self, **arguments: Any):
+        """Delimita una corrida (p.ej. run_crew_analysis); al grabar, la escribe al terminar"""
+        if self.mode == 'replay':
+            yield
+            return
+        self._append({'kind': 'run', 'arguments': arguments, 'started_at': time.time()})
+        try:
+            yield
+        finally:
+            self.flush()
+
+    def flush(self) -> None:
+        """Agrega al archivo las interacciones grabadas desde la última escritura"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lines = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in pending)
+        with self._lock, gzip.open(self.path, 'at', encoding='utf-8') as f:
+            f.write(lines)
+
+
+_active: Optional[Cassette] = None
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """Cassette activo según CASSETTE_MODE (None con 'off', el caso normal)"""
+    global _active, _configured
+    if not _configured:
+        with _configure_lock:
+            if not _configured:
+                if CASSETTE_MODE in CASSETTE_MODES:
+                    _active = Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_REPLAY_LATENCY)
+                _configured = True
+    return _active
+
+
+def use_cassette(cassette: Optional[Cassette]) -> None:
+    """Activa un cassette para el proceso (p.ej. desde scripts/replay_cassette.py)"""
+    global _active, _configured
+    with _configure_lock:
+        _active = cassette
+        _configured = True
+
+
+def recorded(kind: str, key: Callable[..., List[Any]]):
+    """
+    Decorador: con un cassette activo la llamada se graba o se reproduce
+
+    Args:
+        kind: 'llm', 'sql' o 'db_meta'
+        key: Recibe los argumentos de la función y retorna las partes que determinan
+            el resultado (p.ej. la consulta, no el engine)
+    """
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def stream_wrapper(*args, **kwargs):
+                cassette = get_cassette()
+                if cassette is None:
+                    return fn(*args, **kwargs)
+                return cassette.stream(kind, key(*args, **kwargs), lambda: fn(*args, **kwargs))
+            return stream_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cassette = get_cassette()
+            if cassette is None:
+                return fn(*args, **kwargs)
+            return cassette.call(kind, key(*args, **kwargs), lambda: fn(*args, **kwargs))
+        return wrapper
+    return decorator
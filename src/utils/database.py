@@ -1,23 +1,39 @@
 import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, inspect
-from typing import List
+import re
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
 import logging
+from config.config import (
+    DB_BACKEND, DUCKDB_PATH, DUCKDB_DATA_DIR, SNAPSHOT_WATERMARK_COLUMNS,
+    DB_PRIMARY_URI, DB_REPLICA_URIS, MYSQL_REPLICA_HOSTS, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    SAMPLE_TABLE_SUFFIX, SAMPLE_META_TABLE, ARROW_BATCH_ROWS, DATA_VERSION_TTL_SECONDS
+)
+from src.utils.tracing import record_db_call
+from src.utils.cancellation import OperationCancelled, current_token
+from src.utils.cassette import recorded
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
+if TYPE_CHECKING:
+    import pandas as pd
+    from src.utils.arrow_result import QueryResult
+
+# Las variables de entorno (.env) las carga config.config al importarse
 logger = logging.getLogger(__name__)
 
-# Cargar variables de entorno
-load_dotenv()
+# Versión de datos por (base, tabla): (instante de expiración, versión)
+_data_versions: Dict[tuple, tuple] = {}
 
-def get_mysql_uri() -> str:
-    """Obtener URI de conexión MySQL desde variables de entorno"""
+def get_mysql_uri(host: Optional[str] = None) -> str:
+    """Obtener URI de conexión MySQL desde variables de entorno (host opcional para réplicas)"""
     try:
         # Obtener credenciales de las variables de entorno
         MYSQL_USER = os.getenv('MYSQL_USER')
         MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD')
-        MYSQL_HOST = os.getenv('MYSQL_HOST')
+        MYSQL_HOST = host or os.getenv('MYSQL_HOST')
         MYSQL_DATABASE = os.getenv('MYSQL_DATABASE')
         
         if not all([MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST, MYSQL_DATABASE]):
@@ -30,29 +46,311 @@ def get_mysql_uri() -> str:
         logger.error(f"Error getting MySQL URI: {str(e)}")
         raise
 
+def get_database_uri() -> str:
+    """Obtener URI de conexión del primario según el backend configurado (DB_BACKEND)"""
+    if DB_PRIMARY_URI:
+        return DB_PRIMARY_URI
+    if DB_BACKEND == 'duckdb':
+        return f'duckdb:///{DUCKDB_PATH}'
+    if DB_BACKEND != 'mysql':
+        raise ValueError(f"Unsupported DB_BACKEND: {DB_BACKEND}")
+    return get_mysql_uri()
+
+def get_replica_uris() -> List[str]:
+    """
+    URIs de las réplicas de lectura: DB_REPLICA_URIS más un URI por cada host de
+    MYSQL_REPLICA_HOSTS con las mismas credenciales que el primario
+    """
+    if DB_BACKEND == 'duckdb' and not DB_PRIMARY_URI:
+        # DuckDB embebido no tiene réplicas
+        return []
+    return DB_REPLICA_URIS + [get_mysql_uri(host) for host in MYSQL_REPLICA_HOSTS]
+
+def create_target_engine(uri: str):
+    """Crea un engine con pool propio para un destino (primario o réplica)"""
+    if make_url(uri).get_backend_name() in ('mysql', 'postgresql'):
+        # pre_ping descarta conexiones cortadas por el servidor (p.ej. una réplica reiniciada)
+        engine = create_engine(uri, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True)
+    else:
+        engine = create_engine(uri)
+    if engine.dialect.name == 'duckdb':
+        event.listen(engine, 'connect', _register_duckdb_views)
+    return engine
+
+def get_duckdb_sources(data_dir: str = DUCKDB_DATA_DIR) -> dict:
+    """
+    Descubre archivos Parquet/CSV a exponer como vistas en DuckDB
+
+    Cada archivo `nombre.parquet`/`nombre.csv` y cada subdirectorio con archivos
+    Parquet (p.ej. particiones `ventas/anio=2024/*.parquet`) se convierte en una vista.
+
+    Returns:
+        Dict {nombre_vista: expresión de lectura de DuckDB}
+    """
+    sources = {}
+    root = Path(data_dir)
+    if not root.exists():
+        logger.warning(f"DuckDB data directory {data_dir} does not exist")
+        return sources
+
+    for path in sorted(root.iterdir()):
+        name = re.sub(r'\W', '_', path.stem).lower()
+        location = path.as_posix().replace("'", "''")
+        if path.is_dir() and any(path.rglob('*.parquet')):
+            sources[name] = f"read_parquet('{location}/**/*.parquet', hive_partitioning = true)"
+        elif path.suffix.lower() == '.parquet':
+            # El Parquet tiene prioridad sobre un CSV con el mismo nombre
+            sources[name] = f"read_parquet('{location}')"
+        elif path.suffix.lower() == '.csv':
+            sources.setdefault(name, f"read_csv_auto('{location}')")
+    return sources
+
+def _register_duckdb_views(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, source in get_duckdb_sources().items():
+            cursor.execute(f'CREATE OR REPLACE VIEW "{name}" AS SELECT * FROM {source}')
+    finally:
+        cursor.close()
+
+@lru_cache(maxsize=None)
+def get_engine():
+    """
+    Engine compartido (con pool de conexiones) del primario del backend configurado
+
+    Con DB_BACKEND=duckdb cada conexión registra vistas sobre los archivos de DUCKDB_DATA_DIR,
+    por lo que las consultas leen directamente los Parquet/CSV sin servidor. Las consultas
+    analíticas de sólo lectura usan db_router.get_read_engine(), que prefiere las réplicas.
+    """
+    try:
+        engine = create_target_engine(get_database_uri())
+        logger.info(f"Database engine initialized for backend {engine.dialect.name}")
+        return engine
+    except Exception as e:
+        logger.error(f"Error initializing database engine: {str(e)}")
+        raise
+
+def get_sql_dialect(engine) -> str:
+    """Nombre legible del dialecto SQL del engine, para los prompts del LLM"""
+    return {
+        'mysql': 'MySQL',
+        'duckdb': 'DuckDB',
+        'sqlite': 'SQLite',
+        'postgresql': 'PostgreSQL'
+    }.get(engine.dialect.name, engine.dialect.name)
+
 def get_table_names(engine) -> List[str]:
     """Obtener lista de tablas de la base de datos"""
     try:
         inspector = inspect(engine)
         tables = inspector.get_table_names()
-        return tables
+        if engine.dialect.name == 'duckdb':
+            # En DuckDB los datos se exponen como vistas sobre archivos
+            tables = sorted(set(tables) | set(inspector.get_view_names()))
+        # Las muestras del modo progresivo y sus metadatos no se analizan directamente
+        return [t for t in tables if not t.endswith(SAMPLE_TABLE_SUFFIX) and t != SAMPLE_META_TABLE]
     except Exception as e:
         logger.error(f"Error getting table names: {str(e)}")
         return []
 
+@recorded('db_meta', key=lambda engine, table_name: ['schema', table_name])
 def get_table_schema(engine, table_name: str) -> dict:
     """Obtener esquema de una tabla específica"""
     try:
         inspector = inspect(engine)
+        try:
+            comment = inspector.get_table_comment(table_name).get('text')
+        except NotImplementedError:
+            comment = None
         return {
             'columns': inspector.get_columns(table_name),
-            'primary_key': inspector.get_primary_keys(table_name),
-            'foreign_keys': inspector.get_foreign_keys(table_name)
+            'primary_key': inspector.get_pk_constraint(table_name).get('constrained_columns', []),
+            'foreign_keys': inspector.get_foreign_keys(table_name),
+            'comment': comment
         }
     except Exception as e:
         logger.error(f"Error getting schema for table {table_name}: {str(e)}")
         return {}
 
+@recorded('db_meta', key=lambda engine, table_name: ['data_version', table_name])
+def get_data_version(engine, table_name: str) -> str:
+    """
+    Versión de los datos de una tabla: conteo de filas y máximo de la columna watermark
+
+    Cambia cuando los loaders agregan o eliminan filas, sin leer la tabla completa.
+    El resultado se reutiliza durante DATA_VERSION_TTL_SECONDS: cada rerun de la app
+    la consulta y el COUNT(*) puede recorrer toda la tabla.
+    """
+    # Cada destino (primario o réplica) tiene su propia versión según su retraso
+    cache_key = (engine.url.render_as_string(hide_password=True), table_name)
+    cached = _data_versions.get(cache_key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    try:
+        columns = [col['name'] for col in inspect(engine).get_columns(table_name)]
+        watermark = next((col for col in SNAPSHOT_WATERMARK_COLUMNS if col in columns), None)
+        select = f"COUNT(*), MAX({watermark})" if watermark else "COUNT(*), NULL"
+        with engine.connect() as connection:
+            row_count, max_value = connection.execute(text(f"SELECT {select} FROM {table_name}")).one()
+        version = f"{row_count}:{max_value}"
+        _data_versions[cache_key] = (time.monotonic() + DATA_VERSION_TTL_SECONDS, version)
+        return version
+    except Exception as e:
+        logger.error(f"Error getting data version for table {table_name}: {str(e)}")
+        raise
+
+def _server_side_kill(engine, connection, token):
+    # Prepara cómo abortar en el servidor la consulta en curso de esta conexión
+    if engine.dialect.name == 'mysql':
+        # El id de la conexión se guarda en la conexión DBAPI para no consultarlo en cada query
+        connection_id = connection.info.get('mysql_connection_id')
+        if connection_id is None:
+            connection_id = connection.exec_driver_sql("SELECT CONNECTION_ID()").scalar()
+            connection.info['mysql_connection_id'] = connection_id
+        remaining = token.remaining()
+        if remaining is not None:
+            # El servidor también corta los SELECT que superen el plazo restante
+            connection.exec_driver_sql(f"SET SESSION MAX_EXECUTION_TIME = {max(1, int(remaining * 1000))}")
+            connection.info['max_execution_time_set'] = True
+
+        def kill():
+            with engine.connect() as killer:
+                killer.exec_driver_sql(f"KILL QUERY {int(connection_id)}")
+        return kill
+
+    if engine.dialect.name == 'duckdb':
+        return getattr(connection.connection.driver_connection, 'interrupt', None)
+    return None
+
+@contextmanager
+def cancellable_connection(engine):
+    """
+    Conexión cuya consulta en curso se aborta en el servidor si se cancela el token activo
+
+    En MySQL se ejecuta KILL QUERY desde otra conexión del pool y se fija MAX_EXECUTION_TIME
+    con el plazo restante; en DuckDB se interrumpe la conexión.
+    """
+    token = current_token()
+    with engine.connect() as connection:
+        if token is None:
+            yield connection
+            return
+
+        token.check()
+        kill = _server_side_kill(engine, connection, token)
+        unregister = token.on_cancel(kill) if kill else (lambda: None)
+        try:
+            yield connection
+        except Exception as e:
+            if token.cancelled:
+                raise OperationCancelled(token.reason) from e
+            raise
+        finally:
+            unregister()
+            if connection.info.pop('max_execution_time_set', False):
+                # La conexión vuelve al pool sin el límite de esta consulta
+                try:
+                    connection.exec_driver_sql("SET SESSION MAX_EXECUTION_TIME = 0")
+                except Exception:
+                    connection.invalidate()
+
+@recorded('sql', key=lambda query, engine, **kwargs: [query, kwargs])
+def read_sql(query: str, engine, **kwargs) -> 'pd.DataFrame':
+    """
+    Ejecuta una consulta con pandas y registra tiempo, filas y bytes en el span activo
+
+    Args:
+        query: Consulta SQL a ejecutar
+        engine: Engine de SQLAlchemy
+        **kwargs: Argumentos adicionales para pd.read_sql
+
+    Returns:
+        DataFrame con los resultados
+    """
+    import pandas as pd
+
+    start = time.perf_counter()
+    with cancellable_connection(engine) as connection:
+        df = pd.read_sql(query, connection, **kwargs)
+    record_db_call(time.perf_counter() - start, len(df), int(df.memory_usage(deep=True).sum()))
+    return df
+
+def _fetch_arrow(connection, query: str, batch_rows: int):
+    import pyarrow as pa
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(query)
+        # Drivers con salida Arrow nativa (DuckDB, ADBC): sin pasar por objetos Python
+        fetch_arrow_table = getattr(cursor, 'fetch_arrow_table', None)
+        if fetch_arrow_table is not None:
+            return fetch_arrow_table()
+
+        # Resto de drivers: cada lote de tuplas se convierte en columnas Arrow
+        columns = [description[0] for description in cursor.description or []]
+        tables = []
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                break
+            values = list(zip(*rows))
+            tables.append(pa.table([pa.array(column) for column in values], names=columns))
+        if not tables:
+            return pa.table({column: pa.array([], pa.null()) for column in columns})
+        # Un lote con sólo NULL en una columna se unifica con el tipo de los demás
+        return pa.concat_tables(tables, promote_options='permissive')
+    finally:
+        cursor.close()
+
+@recorded('sql', key=lambda query, engine, batch_rows=None: [query])
+def read_arrow(query: str, engine, batch_rows: Optional[int] = None) -> 'QueryResult':
+    """
+    Ejecuta una consulta y retorna el resultado como tabla Arrow (QueryResult)
+
+    Usa la salida Arrow del driver cuando existe (DuckDB, ADBC); con los demás
+    drivers lee por lotes de `batch_rows` filas y arma columnas Arrow, sin
+    construir un DataFrame intermedio. Registra tiempo, filas y bytes en el span activo.
+
+    Args:
+        query: Consulta SQL a ejecutar
+        engine: Engine de SQLAlchemy
+        batch_rows: Filas por lote (por defecto ARROW_BATCH_ROWS)
+    """
+    from src.utils.arrow_result import QueryResult, normalize_arrow_types
+
+    start = time.perf_counter()
+    with cancellable_connection(engine) as connection:
+        table = _fetch_arrow(connection, query, batch_rows or ARROW_BATCH_ROWS)
+    table = normalize_arrow_types(table)
+    record_db_call(time.perf_counter() - start, table.num_rows, table.nbytes)
+    return QueryResult(table)
+
+@recorded('sql', key=lambda query, engine, chunksize, params=None: [query, chunksize, params])
+def iter_sql(query: str, engine, chunksize: int, params: Optional[Dict] = None) -> Iterator['pd.DataFrame']:
+    """
+    Ejecuta una consulta por bloques registrando cada bloque en el span activo
+
+    Args:
+        query: Consulta SQL (puede usar parámetros :nombre)
+        engine: Engine de SQLAlchemy
+        chunksize: Filas por bloque
+        params: Parámetros de la consulta
+
+    Yields:
+        DataFrames de hasta `chunksize` filas
+    """
+    import pandas as pd
+
+    with cancellable_connection(engine) as connection:
+        chunks = pd.read_sql(text(query), connection, params=params, chunksize=chunksize)
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            record_db_call(time.perf_counter() - start, len(chunk), int(chunk.memory_usage(deep=True).sum()))
+            yield chunk
+
 def execute_query(engine, query: str) -> List[tuple]:
     """Ejecutar una consulta SQL y retornar resultados"""
     try:
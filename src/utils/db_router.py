@@ -0,0 +1,173 @@
+import itertools
+import logging
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from config.config import (
+    DB_READ_BALANCING, DB_REPLICA_MAX_LAG_SECONDS, DB_REPLICA_CHECK_SECONDS, DB_REPLICA_LAG_QUERY
+)
+from src.utils.database import create_target_engine, get_engine, get_replica_uris
+from src.utils.tracing import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# Peso de la última medición en la latencia suavizada (EWMA) de cada destino
+LATENCY_ALPHA = 0.3
+
+
+def _replication_lag(connection) -> Optional[float]:
+    """
+    Retraso de replicación en segundos; None si la replicación está detenida
+
+    En MySQL se lee SHOW REPLICA STATUS (o SHOW SLAVE STATUS en versiones anteriores a 8.0.22).
+    En otros motores (p.ej. SQLite como réplica de prueba) se usa DB_REPLICA_LAG_QUERY si está definida.
+    """
+    if DB_REPLICA_LAG_QUERY:
+        value = connection.execute(text(DB_REPLICA_LAG_QUERY)).scalar()
+        return float(value) if value is not None else None
+    if connection.dialect.name != 'mysql':
+        return 0.0
+
+    try:
+        row = connection.exec_driver_sql("SHOW REPLICA STATUS").mappings().first()
+    except Exception:
+        row = connection.exec_driver_sql("SHOW SLAVE STATUS").mappings().first()
+    if row is None:
+        # El servidor no es réplica de nadie: no tiene retraso
+        return 0.0
+    lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+    return float(lag) if lag is not None else None
+
+
+class DatabaseTarget:
+    """Un destino de base de datos con su engine, estado de salud y latencia medida"""
+
+    def __init__(self, name: str, role: str, engine):
+        self.name = name
+        self.role = role
+        self.engine = engine
+        self.healthy = role == 'primary'
+        self.lag: Optional[float] = 0.0 if role == 'primary' else None
+        self.latency: Optional[float] = None
+        self.reads = 0
+        self.error: Optional[str] = None
+
+    def check(self, max_lag: float) -> None:
+        """Mide la latencia con un ping y, en réplicas, el retraso de replicación"""
+        start = time.perf_counter()
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                elapsed = time.perf_counter() - start
+                self.lag = _replication_lag(connection) if self.role == 'replica' else 0.0
+        except Exception as e:
+            self.healthy = False
+            self.error = str(e)[:200]
+            logger.warning(f"Database target {self.name} failed health check: {self.error}")
+            return
+
+        self.latency = elapsed if self.latency is None else LATENCY_ALPHA * elapsed + (1 - LATENCY_ALPHA) * self.latency
+        self.error = None
+        self.healthy = self.lag is not None and self.lag <= max_lag
+        if not self.healthy:
+            logger.warning(f"Replica {self.name} excluded from reads: lag {self.lag}s > {max_lag}s")
+
+    def to_dict(self) -> Dict:
+        return {
+            'role': self.role,
+            'dialect': self.engine.dialect.name,
+            'healthy': self.healthy,
+            'lag_seconds': self.lag,
+            'latency_ms': round(self.latency * 1000, 2) if self.latency is not None else None,
+            'reads': self.reads,
+            'error': self.error
+        }
+
+
+class ReadRouter:
+    """
+    Elige el destino de cada consulta analítica de sólo lectura.
+
+    - Sólo se usan réplicas sanas: que respondan y con retraso <= DB_REPLICA_MAX_LAG_SECONDS.
+    - 'round_robin' reparte las lecturas en turno; 'latency' elige la de menor latencia suavizada.
+    - Si no hay réplicas sanas (o no hay réplicas configuradas) se lee del primario.
+    - El estado se revisa como máximo cada DB_REPLICA_CHECK_SECONDS, en el hilo que hace la lectura.
+    """
+
+    def __init__(self, primary: DatabaseTarget, replicas: List[DatabaseTarget],
+                 balancing: str = DB_READ_BALANCING, max_lag: float = DB_REPLICA_MAX_LAG_SECONDS,
+                 check_interval: float = DB_REPLICA_CHECK_SECONDS):
+        if balancing not in ('round_robin', 'latency'):
+            raise ValueError(f"Unsupported DB_READ_BALANCING: {balancing}")
+        self.primary = primary
+        self.replicas = replicas
+        self.balancing = balancing
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._turn = itertools.count()
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+
+    def refresh(self, force: bool = False) -> None:
+        """Revisa la salud de las réplicas si la última revisión es más antigua que check_interval"""
+        if not self.replicas:
+            return
+        if not force and time.monotonic() - self._checked_at < self.check_interval:
+            return
+        # Un solo hilo revisa; los demás siguen usando el estado anterior
+        if not self._check_lock.acquire(blocking=force):
+            return
+        try:
+            for replica in self.replicas:
+                replica.check(self.max_lag)
+            self._checked_at = time.monotonic()
+        finally:
+            self._check_lock.release()
+
+    def choose(self) -> DatabaseTarget:
+        """Destino para la próxima lectura"""
+        self.refresh()
+        eligible = [replica for replica in self.replicas if replica.healthy]
+        if not eligible:
+            if self.replicas:
+                logger.warning("No healthy replica available, reading from primary")
+            target = self.primary
+        elif self.balancing == 'latency':
+            target = min(eligible, key=lambda r: r.latency if r.latency is not None else float('inf'))
+        else:
+            target = eligible[next(self._turn) % len(eligible)]
+
+        with self._lock:
+            target.reads += 1
+        metrics_registry.increment('sqlcrew_db_reads_total', 'Read queries routed per database target',
+                                   target=target.name, role=target.role)
+        return target
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Estado de cada destino (para /health)"""
+        return {target.name: target.to_dict() for target in [self.primary] + self.replicas}
+
+
+@lru_cache(maxsize=None)
+def get_read_router() -> ReadRouter:
+    """Router compartido por el proceso; cada destino mantiene su propio pool de conexiones"""
+    replicas = [DatabaseTarget(f"replica-{i}", 'replica', create_target_engine(uri))
+                for i, uri in enumerate(get_replica_uris(), start=1)]
+    router = ReadRouter(DatabaseTarget('primary', 'primary', get_engine()), replicas)
+    if replicas:
+        logger.info(f"Read routing across {len(replicas)} replicas ({router.balancing})")
+    return router
+
+
+def get_read_engine():
+    """
+    Engine para una consulta analítica de sólo lectura (réplica sana o, si no hay, el primario)
+
+    Las escrituras (loaders, índices locales) deben usar database.get_engine(), que siempre es el primario.
+    """
+    return get_read_router().choose().engine
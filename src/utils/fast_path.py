@@ -0,0 +1,449 @@
+import difflib
+import logging
+import re
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.config import (
+    FAST_PATH_ENABLED, FAST_PATH_MIN_CONFIDENCE, FAST_PATH_SCHEMA_TTL, FAST_PATH_MAX_ROWS, USE_SNAPSHOTS
+)
+from src.utils.cassette import CassetteMiss
+from src.utils.database import get_table_schema, read_arrow
+from src.utils.db_router import get_read_engine
+from src.utils.progressive import try_progressive_query
+from src.utils.snapshot import get_snapshot
+from src.utils.tracing import metrics_registry, span
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_TYPES = ('INT', 'DECIMAL', 'NUMERIC', 'FLOAT', 'DOUBLE', 'REAL')
+DATE_TYPES = ('DATE', 'TIME')
+
+AGGREGATES = {
+    'total': 'SUM', 'sum': 'SUM', 'suma': 'SUM',
+    'average': 'AVG', 'avg': 'AVG', 'mean': 'AVG', 'promedio': 'AVG', 'media': 'AVG',
+    'count': 'COUNT', 'number': 'COUNT', 'cantidad': 'COUNT', 'numero': 'COUNT'
+}
+AGGREGATE_LABELS = {'SUM': 'Total', 'AVG': 'Average', 'COUNT': 'Count'}
+
+# Sin palabra de agregación ("precio unitario by producto") sólo se suma una columna claramente aditiva
+ADDITIVE_NAME_HINTS = {'total', 'subtotal', 'monto', 'importe', 'amount', 'sales', 'venta', 'ventas', 'revenue',
+                       'ingreso', 'ingresos', 'cantidad', 'quantity', 'qty', 'units', 'unidades', 'cost', 'costo'}
+NON_ADDITIVE_NAME_HINTS = {'precio', 'price', 'unit', 'unitario', 'rate', 'tasa', 'pct', 'percent', 'porcentaje',
+                           'ratio', 'avg', 'promedio', 'margin', 'margen', 'score', 'edad', 'age'}
+
+# Sustantivos que cuentan filas sin importar la tabla ("how many records by region")
+ROW_NOUNS = {'row', 'record', 'entry', 'fila', 'registro', 'transaction', 'transaccion'}
+# Colas de "how many X are there" que no forman parte del sustantivo contado
+COUNT_TAIL = re.compile(r"\s+(?:are there|were there|there are|hay|existen)$")
+
+PERIODS = {
+    'day': 'day', 'dia': 'day', 'daily': 'day', 'diario': 'day',
+    'week': 'week', 'semana': 'week', 'weekly': 'week', 'semanal': 'week',
+    'month': 'month', 'mes': 'month', 'monthly': 'month', 'mensual': 'month',
+    'year': 'year', 'ano': 'year', 'anio': 'year', 'yearly': 'year', 'anual': 'year'
+}
+
+# Frases de cortesía al inicio de la pregunta que no aportan a la intención
+LEADING_FILLER = re.compile(
+    r"^(?:what (?:is|are|were) (?:the )?|show (?:me )?(?:the )?|give me (?:the )?|list (?:the )?|"
+    r"cual(?:es)? (?:es|son|fue|fueron) (?:el |la |los |las )?|muestra(?:me)? (?:el |la |los |las )?|"
+    r"dame (?:el |la |los |las )?)"
+)
+ARTICLES = re.compile(r"^(?:the|el|la|los|las|de|of)\s+")
+
+_PERIOD_WORDS = '|'.join(sorted(PERIODS, key=len, reverse=True))
+TOP_PATTERN = re.compile(r"^top (?P<n>\d+) (?P<dim>.+?) (?:by|por) (?P<metric>.+)$")
+PERIOD_PATTERN = re.compile(rf"^(?P<metric>.+?) (?:per|by|each|por|cada|al|a la) (?P<period>{_PERIOD_WORDS})$")
+PERIOD_PREFIX_PATTERN = re.compile(rf"^(?P<period>{_PERIOD_WORDS}) (?P<metric>.+)$")
+GROUP_PATTERN = re.compile(r"^(?P<metric>.+?) (?:by|per|for each|por|para cada) (?P<dim>.+)$")
+HOW_MANY_PATTERN = re.compile(r"^(?:how many|cuantos|cuantas) (?P<rest>.+)$")
+AGGREGATE_PATTERN = re.compile(
+    rf"^(?P<agg>{'|'.join(AGGREGATES)})(?: of| de)? (?P<rest>.+)$"
+)
+
+
+@dataclass
+class Intent:
+    """Intención reconocida con sus columnas resueltas"""
+    kind: str  # 'group', 'top' o 'period'
+    aggregate: str
+    metric: Optional[str]  # None para COUNT(*); con COUNT, columna de COUNT(DISTINCT ...)
+    dimension: str
+    confidence: float
+    period: Optional[str] = None
+    limit: Optional[int] = None
+
+
+def normalize_question(question: str) -> str:
+    """Minúsculas, sin acentos, sin signos finales ni frases de cortesía iniciales"""
+    text = unicodedata.normalize('NFKD', question.lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[¿?¡!.]", ' ', text)
+    text = ' '.join(text.split())
+    return LEADING_FILLER.sub('', text)
+
+
+def _strip_articles(phrase: str) -> str:
+    previous = None
+    while previous != phrase:
+        previous, phrase = phrase, ARTICLES.sub('', phrase).strip()
+    return phrase
+
+
+def _singular(token: str) -> str:
+    return token[:-1] if len(token) > 3 and token.endswith('s') else token
+
+
+def _column_score(phrase: str, column: str) -> float:
+    name = normalize_question(column.replace('_', ' '))
+    if phrase == name:
+        return 1.0
+    phrase_tokens = {_singular(t) for t in phrase.split()}
+    column_tokens = {_singular(t) for t in name.split()}
+    if phrase_tokens == column_tokens:
+        return 0.95
+    score = difflib.SequenceMatcher(None, phrase, name).ratio()
+    if phrase_tokens and phrase_tokens <= column_tokens:
+        # 'sales' -> 'sales_amount': la frase nombra parte de la columna
+        score = max(score, 0.85)
+    return score
+
+
+def match_column(phrase: str, columns: List[Dict]) -> Tuple[Optional[str], float]:
+    """Columna que mejor corresponde a la frase y la confianza de la correspondencia"""
+    phrase = _strip_articles(phrase.replace('_', ' '))
+    scored = sorted(((_column_score(phrase, col['name']), col['name']) for col in columns), reverse=True)
+    if not scored:
+        return None, 0.0
+    best_score, best = scored[0]
+    if len(scored) > 1 and best_score < 1.0 and best_score - scored[1][0] < 0.05:
+        # Dos columnas igual de plausibles: no se adivina
+        best_score -= 0.2
+    return best, best_score
+
+
+def _is_type(column: Dict, kinds: Tuple[str, ...]) -> bool:
+    return any(kind in str(column['type']).upper() for kind in kinds)
+
+
+def _is_identifier(column: str) -> bool:
+    name = column.lower()
+    return name == 'id' or name.endswith('_id') or name.startswith('id_')
+
+
+def _entity_name(column: str) -> str:
+    # 'customer_id' / 'id_cliente' -> entidad que identifica la columna ('' para la clave 'id')
+    name = column.lower()
+    if name.endswith('_id'):
+        name = name[:-3]
+    elif name.startswith('id_'):
+        name = name[3:]
+    return '' if name == 'id' else name
+
+
+def _resolve_count(noun: str, columns: List[Dict], table_name: str) -> Tuple[str, Optional[str], float]:
+    """
+    Qué cuenta "how many X" / "number of X": filas si X nombra la tabla o una fila,
+    COUNT(DISTINCT col) si X nombra una entidad (customer -> customer_id) y, si no, confianza 0
+    """
+    noun = _strip_articles(COUNT_TAIL.sub('', noun))
+    noun_tokens = {_singular(token) for token in noun.split()}
+    table_tokens = {_singular(token) for token in normalize_question(table_name.replace('_', ' ')).split()}
+    if noun_tokens and (noun_tokens <= ROW_NOUNS or noun_tokens <= table_tokens):
+        return 'COUNT', None, 1.0
+    # Entidades: identificadores y columnas de texto; las numéricas son medidas
+    entities = [dict(col, name=_entity_name(col['name']), column=col['name']) for col in columns
+                if _entity_name(col['name']) and (_is_identifier(col['name']) or not _is_type(col, NUMERIC_TYPES))]
+    entity, confidence = match_column(noun, entities)
+    if entity is None:
+        return 'COUNT', None, 0.0
+    column = next(col['column'] for col in entities if col['name'] == entity)
+    return 'COUNT', column, confidence
+
+
+def _is_additive(column: str) -> bool:
+    words = set(re.split(r'[^a-z0-9]+', column.lower()))
+    # 'precio_total' es aditiva; 'precio_unitario' no
+    if words & {'total', 'subtotal'}:
+        return True
+    return bool(words & ADDITIVE_NAME_HINTS) and not words & NON_ADDITIVE_NAME_HINTS
+
+
+def _resolve_metric(phrase: str, columns: List[Dict], table_name: str) -> Tuple[str, Optional[str], float]:
+    # Retorna (agregación, columna o None para COUNT(*), confianza)
+    phrase = _strip_articles(phrase)
+    how_many = HOW_MANY_PATTERN.match(phrase)
+    if how_many:
+        return _resolve_count(how_many.group('rest'), columns, table_name)
+    aggregate = 'SUM'
+    match = AGGREGATE_PATTERN.match(phrase)
+    if match:
+        aggregate = AGGREGATES[match.group('agg')]
+        phrase = match.group('rest')
+    if aggregate == 'COUNT':
+        # "number of orders": filas sólo si el sustantivo nombra la tabla
+        return _resolve_count(phrase, columns, table_name)
+    numeric = [col for col in columns if _is_type(col, NUMERIC_TYPES)]
+    column, confidence = match_column(phrase, numeric)
+    if not match and column and not _is_additive(column):
+        # Agregación implícita sobre una columna no aditiva: ambigua, la resuelve el LLM
+        confidence = min(confidence, FAST_PATH_MIN_CONFIDENCE / 2)
+    return aggregate, column, confidence
+
+
+def match_intent(question: str, columns: List[Dict], table_name: str = '') -> Optional[Intent]:
+    """
+    Reconoce preguntas del tipo "total X by Y", "top N Y by X" y "X per month"
+
+    Args:
+        question: Pregunta del usuario
+        columns: Columnas de la tabla ('name', 'type')
+        table_name: Tabla consultada (para saber cuándo "number of X" cuenta filas)
+
+    Returns:
+        La intención con su confianza, o None si la pregunta no sigue ninguna plantilla
+    """
+    text = normalize_question(question)
+    dimensions = [col for col in columns if not _is_type(col, NUMERIC_TYPES)] or columns
+    dates = [col for col in columns if _is_type(col, DATE_TYPES)]
+
+    top = TOP_PATTERN.match(text)
+    if top:
+        aggregate, metric, metric_conf = _resolve_metric(top.group('metric'), columns, table_name)
+        dimension, dim_conf = match_column(top.group('dim'), dimensions)
+        return Intent('top', aggregate, metric, dimension, min(metric_conf, dim_conf),
+                      limit=int(top.group('n')))
+
+    period = PERIOD_PATTERN.match(text) or PERIOD_PREFIX_PATTERN.match(text)
+    if period:
+        aggregate, metric, metric_conf = _resolve_metric(period.group('metric'), columns, table_name)
+        # Con varias columnas de fecha no se sabe cuál usar
+        date_conf = 1.0 if len(dates) == 1 else 0.0
+        return Intent('period', aggregate, metric, dates[0]['name'] if dates else None,
+                      min(metric_conf, date_conf), period=PERIODS[period.group('period')])
+
+    group = GROUP_PATTERN.match(text)
+    if group:
+        aggregate, metric, metric_conf = _resolve_metric(group.group('metric'), columns, table_name)
+        dimension, dim_conf = match_column(group.group('dim'), dimensions)
+        return Intent('group', aggregate, metric, dimension, min(metric_conf, dim_conf))
+    return None
+
+
+def _quote(name: str, dialect: str) -> str:
+    return f"`{name}`" if dialect == 'mysql' else f'"{name}"'
+
+
+def _period_expression(column: str, period: str, dialect: str) -> Optional[str]:
+    if dialect == 'mysql':
+        return {
+            'day': f"DATE({column})",
+            'week': f"DATE_FORMAT({column}, '%x-W%v')",
+            'month': f"DATE_FORMAT({column}, '%Y-%m')",
+            'year': f"YEAR({column})"
+        }[period]
+    if dialect in ('duckdb', 'postgresql'):
+        return f"date_trunc('{period}', {column})"
+    return None
+
+
+def build_query(intent: Intent, table_name: str, dialect: str) -> Optional[Tuple[str, str, str]]:
+    """
+    SQL parametrizado para la intención
+
+    Returns:
+        (consulta, columna de la dimensión en el resultado, columna del valor), o None si
+        el dialecto no está soportado
+    """
+    table = _quote(table_name, dialect)
+    if intent.aggregate == 'COUNT' and intent.metric is None:
+        value_sql, value_alias = 'COUNT(*)', 'row_count'
+    elif intent.aggregate == 'COUNT':
+        value_sql = f"COUNT(DISTINCT {_quote(intent.metric, dialect)})"
+        value_alias = f"distinct_{intent.metric}"
+    else:
+        value_sql = f"{intent.aggregate}({_quote(intent.metric, dialect)})"
+        value_alias = f"{intent.aggregate.lower()}_{intent.metric}"
+
+    if intent.kind == 'period':
+        expression = _period_expression(_quote(intent.dimension, dialect), intent.period, dialect)
+        if expression is None:
+            return None
+        query = (f"SELECT {expression} AS {_quote(intent.period, dialect)}, {value_sql} AS {_quote(value_alias, dialect)} "
+                 f"FROM {table} WHERE {_quote(intent.dimension, dialect)} IS NOT NULL "
+                 f"GROUP BY 1 ORDER BY 1 LIMIT {FAST_PATH_MAX_ROWS}")
+        return query, intent.period, value_alias
+
+    dimension = _quote(intent.dimension, dialect)
+    limit = min(intent.limit, FAST_PATH_MAX_ROWS) if intent.limit else FAST_PATH_MAX_ROWS
+    query = (f"SELECT {dimension}, {value_sql} AS {_quote(value_alias, dialect)} FROM {table} "
+             f"GROUP BY {dimension} ORDER BY 2 DESC LIMIT {limit}")
+    return query, intent.dimension, value_alias
+
+
+def build_chart_spec(intent: Intent, dimension: str, value: str) -> Dict[str, Any]:
+    """Especificación Vega-Lite del gráfico (barras por categoría o línea por periodo)"""
+    if intent.kind == 'period':
+        x_type = 'temporal' if intent.period in ('day', 'month') else 'ordinal'
+        return {
+            'mark': {'type': 'line', 'point': True},
+            'encoding': {
+                'x': {'field': dimension, 'type': x_type},
+                'y': {'field': value, 'type': 'quantitative'}
+            }
+        }
+    return {
+        'mark': 'bar',
+        'encoding': {
+            'x': {'field': dimension, 'type': 'nominal', 'sort': '-y'},
+            'y': {'field': value, 'type': 'quantitative'}
+        }
+    }
+
+
+def _format_number(value: float) -> str:
+    return f"{value:,.0f}" if float(value).is_integer() else f"{value:,.2f}"
+
+
+def _format_period(value: Any, period: str) -> str:
+    if hasattr(value, 'strftime'):
+        return value.strftime({'year': '%Y', 'month': '%Y-%m'}.get(period, '%Y-%m-%d'))
+    return str(value)
+
+
+def build_explanation(intent: Intent, results, dimension: str, value: str) -> str:
+    """Explicación con plantilla a partir del resultado completo"""
+    distinct = intent.aggregate == 'COUNT' and intent.metric is not None
+    label = 'Distinct count' if distinct else AGGREGATE_LABELS[intent.aggregate]
+    subject = intent.metric or 'rows'
+    if results.empty:
+        return f"No data found for {label.lower()} of {subject}."
+
+    values = results[value].astype(float)
+    if intent.kind == 'period':
+        periods = [_format_period(value, intent.period) for value in results[dimension]]
+        lines = [f"{label} of {subject} per {intent.period}: {len(results)} periods, "
+                 f"from {periods[0]} to {periods[-1]}."]
+        latest = values.iloc[-1]
+        lines.append(f"Latest value: {_format_number(latest)}.")
+        if len(values) > 1 and values.iloc[-2]:
+            change = latest / values.iloc[-2] - 1
+            lines.append(f"Change vs previous {intent.period}: {change:+.1%}.")
+        peak = int(values.values.argmax())
+        lines.append(f"Peak: {periods[peak]} ({_format_number(values.iloc[peak])}).")
+        return ' '.join(lines)
+
+    top_label = results[dimension].iloc[0]
+    top_value = values.iloc[0]
+    groups = f"top {len(results)}" if intent.kind == 'top' else f"{len(results)} groups"
+    lines = [f"{label} of {subject} by {intent.dimension} ({groups})."]
+    lines.append(f"The highest is {top_label} with {_format_number(top_value)}.")
+    # Los conteos distintos no se suman entre grupos (un cliente puede estar en varios)
+    if intent.aggregate in ('SUM', 'COUNT') and not distinct and intent.kind == 'group' and values.sum():
+        lines.append(f"It accounts for {top_value / values.sum():.1%} of the total ({_format_number(values.sum())}).")
+    if len(results) > 1:
+        lines.append(f"The lowest shown is {results[dimension].iloc[-1]} with {_format_number(values.iloc[-1])}.")
+    return ' '.join(lines)
+
+
+_schema_cache: Dict[str, Tuple[float, List[Dict]]] = {}
+_schema_lock = threading.Lock()
+
+
+def get_cached_columns(table_name: str) -> List[Dict]:
+    """Columnas de la tabla, cacheadas FAST_PATH_SCHEMA_TTL segundos"""
+    with _schema_lock:
+        cached = _schema_cache.get(table_name)
+        if cached and time.monotonic() - cached[0] < FAST_PATH_SCHEMA_TTL:
+            return cached[1]
+    columns = get_table_schema(get_read_engine(), table_name).get('columns', [])
+    with _schema_lock:
+        _schema_cache[table_name] = (time.monotonic(), columns)
+    return columns
+
+
+def try_fast_path(question: str, table_name: str, progressive: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Responde preguntas frecuentes con SQL de plantilla, sin llamar al LLM
+
+    Si la pregunta no sigue una plantilla, la confianza es menor a
+    FAST_PATH_MIN_CONFIDENCE o la consulta falla, retorna None y el análisis
+    continúa con el crew completo. Aciertos y fallos se cuentan en
+    sqlcrew_fast_path_total; la latencia queda en el span 'fast_path'.
+    Con progressive=True se responde con estimaciones sobre la muestra de la
+    tabla (si existe) y la consulta exacta queda en segundo plano.
+
+    Returns:
+        Dict con el formato de AgentOutputHandler.format_agent_output más
+        'execute_query' (resultados) y 'chart_spec' (Vega-Lite), o None.
+        Las vistas previas agregan 'approximate', 'margins', 'sample_fraction' y 'exact_job'
+    """
+    if not FAST_PATH_ENABLED:
+        return None
+
+    with span('fast_path'):
+        outcome = 'miss'
+        try:
+            intent = match_intent(question, get_cached_columns(table_name), table_name)
+            if intent is None or intent.confidence < FAST_PATH_MIN_CONFIDENCE:
+                return None
+
+            snapshot = get_snapshot(table_name) if USE_SNAPSHOTS else None
+            engine = None if snapshot else get_read_engine()
+            dialect = 'duckdb' if snapshot else engine.dialect.name
+            built = build_query(intent, table_name, dialect)
+            if built is None:
+                return None
+            query, dimension, value = built
+            preview = try_progressive_query(query, table_name, engine) if progressive and engine else None
+            if preview:
+                results = preview['results']
+            else:
+                results = snapshot.query(query) if snapshot else read_arrow(query, engine)
+            outcome = 'hit'
+        except CassetteMiss:
+            # Al reproducir, una interacción no grabada es divergencia, no un fallo del fast path
+            outcome = 'error'
+            raise
+        except Exception as e:
+            # Cualquier error se resuelve con el crew completo
+            outcome = 'error'
+            logger.warning(f"Fast path failed, falling back to the crew: {str(e)}")
+            return None
+        finally:
+            metrics_registry.increment('sqlcrew_fast_path_total',
+                                       'Questions answered by the template fast path, by outcome',
+                                       outcome=outcome)
+
+        explanation = build_explanation(intent, results.to_pandas(), dimension, value)
+        logger.info(f"Fast path answered '{question}' with intent {intent.kind} "
+                    f"(confidence {intent.confidence:.2f})")
+        counted = f"DISTINCT {intent.metric}" if intent.aggregate == 'COUNT' and intent.metric else intent.metric
+        output = {
+            'question': question,
+            'reasoning': [{
+                'agent': 'Template fast path',
+                'thoughts': [
+                    f"Matched intent '{intent.kind}' with confidence {intent.confidence:.2f}",
+                    f"Aggregate: {intent.aggregate}({counted or '*'})",
+                    f"Grouped by: {intent.period + ' of ' if intent.period else ''}{intent.dimension}"
+                ]
+            }],
+            'query': query,
+            'visualization': None,
+            'chart_spec': build_chart_spec(intent, dimension, value),
+            'insights': explanation,
+            'execute_query': results
+        }
+        if preview:
+            output.update({
+                'approximate': True,
+                'margins': preview['margins'],
+                'sample_fraction': preview['fraction'],
+                'exact_job': preview['exact_job']
+            })
+        return output
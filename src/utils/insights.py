@@ -0,0 +1,279 @@
+import logging
+import re
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from config.config import INSIGHT_TOP_K, INSIGHT_MAX_MEASURES, INSIGHT_MAX_GROUPS, INSIGHT_MAX_COLUMNS
+from src.utils.arrow_result import QueryResult
+
+logger = logging.getLogger(__name__)
+
+# Nombres de columnas de texto que se intentan interpretar como fechas
+DATE_NAME_HINTS = ('fecha', 'date', 'mes', 'month', 'dia', 'day', 'periodo', 'period', 'time')
+# Enteros que son periodos (salidas de YEAR()/MONTH()...), no medidas: se comparan por palabra
+PERIOD_NAME_HINTS = DATE_NAME_HINTS + ('year', 'anio', 'ano', 'quarter', 'trimestre', 'week', 'semana')
+# |z| robusto (basado en la MAD) a partir del cual un valor se considera atípico
+OUTLIER_Z = 3.5
+# Rezago de estacionalidad por granularidad del periodo
+SEASONAL_LAGS = {'D': 7, 'W': 52, 'M': 12}
+
+
+def _round(value: Any, digits: int = 4) -> Any:
+    if value is None or (isinstance(value, float) and not np.isfinite(value)):
+        return None
+    if isinstance(value, (np.integer, int)):
+        return int(value)
+    if isinstance(value, (np.floating, float)):
+        return round(float(value), digits)
+    return str(value)[:60]
+
+
+def _is_identifier(col: Any) -> bool:
+    name = str(col).lower()
+    return name == 'id' or name.endswith('_id') or name.startswith('id_')
+
+
+def _is_period_integer(col: Any, series: pd.Series) -> bool:
+    words = re.split(r'[^a-z0-9]+', str(col).lower())
+    return pd.api.types.is_integer_dtype(series) and any(word in PERIOD_NAME_HINTS for word in words)
+
+
+def _classify_columns(df: pd.DataFrame) -> Dict[str, List[str]]:
+    measures, dimensions, dates = [], [], []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series):
+            dimensions.append(col)
+        elif _is_identifier(col) or _is_period_integer(col, series):
+            # Claves (id, *_id, id_*) y periodos enteros (year, mes) agrupan, no se suman
+            dimensions.append(col)
+        elif pd.api.types.is_numeric_dtype(series):
+            measures.append(col)
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            dates.append(col)
+        elif any(hint in str(col).lower() for hint in DATE_NAME_HINTS):
+            parsed = pd.to_datetime(series, errors='coerce')
+            if parsed.notna().mean() > 0.9:
+                df[col] = parsed
+                dates.append(col)
+            else:
+                dimensions.append(col)
+        else:
+            dimensions.append(col)
+    # El límite se aplica después de descartar claves y periodos
+    return {'measures': measures[:INSIGHT_MAX_MEASURES], 'dimensions': dimensions, 'dates': dates}
+
+
+def _pick_dimension(df: pd.DataFrame, dimensions: List[str]) -> Optional[str]:
+    # La dimensión con menos grupos (más de uno y hasta INSIGHT_MAX_GROUPS); las claves no agrupan
+    cardinalities = {col: df[col].nunique() for col in dimensions if not _is_identifier(col)}
+    candidates = [col for col, n in cardinalities.items() if 1 < n <= INSIGHT_MAX_GROUPS]
+    return min(candidates, key=cardinalities.get) if candidates else None
+
+
+def _measure_summary(series: pd.Series) -> Dict[str, Any]:
+    values = series.dropna().to_numpy(dtype=float)
+    if values.size == 0:
+        return {'count': 0}
+    return {
+        'count': int(values.size),
+        'total': _round(values.sum()),
+        'mean': _round(values.mean()),
+        'median': _round(np.median(values)),
+        'min': _round(values.min()),
+        'max': _round(values.max())
+    }
+
+
+def _shares(df: pd.DataFrame, dimension: str, measure: str) -> Dict[str, Any]:
+    grouped = df.groupby(dimension, dropna=False, observed=True)[measure].sum().sort_values(ascending=False)
+    total = grouped.sum()
+    if not total:
+        return {}
+    shares = grouped / total
+    top = [{'group': _round(idx), 'value': _round(val), 'share': _round(share)}
+           for idx, val, share in zip(grouped.index[:INSIGHT_TOP_K], grouped.values[:INSIGHT_TOP_K],
+                                      shares.values[:INSIGHT_TOP_K])]
+    return {
+        'groups': int(len(grouped)),
+        'top': top,
+        'bottom': {'group': _round(grouped.index[-1]), 'value': _round(grouped.values[-1])},
+        # Concentración: participación acumulada de los grupos mostrados
+        'top_share': _round(shares.values[:INSIGHT_TOP_K].sum())
+    }
+
+
+def _period_frequency(dates: pd.Series) -> str:
+    span_days = (dates.max() - dates.min()).days
+    if span_days > 730:
+        return 'M'
+    if span_days > 120:
+        return 'W' if span_days < 365 else 'M'
+    return 'D'
+
+
+def _time_series(df: pd.DataFrame, date_col: str, measure: str) -> Optional[Dict[str, Any]]:
+    data = df[[date_col, measure]].dropna()
+    if data[date_col].nunique() < 3:
+        return None
+    freq = _period_frequency(data[date_col])
+    grouped = data.groupby(data[date_col].dt.to_period(freq))[measure]
+    series = grouped.sum().sort_index()
+    values = series.to_numpy(dtype=float)
+    row_counts = grouped.size().sort_index().to_numpy()
+    facts: Dict[str, Any] = {
+        'granularity': {'D': 'day', 'W': 'week', 'M': 'month'}[freq],
+        'periods': int(values.size),
+        'first_period': str(series.index[0]),
+        'last_period': str(series.index[-1]),
+        'last_value': _round(values[-1]),
+        # Un último periodo con muchas menos filas que la mediana suele estar incompleto
+        'last_period_partial': bool(row_counts.size > 2 and row_counts[-1] < 0.5 * np.median(row_counts[:-1]))
+    }
+    if values.size >= 2 and values[-2]:
+        facts['change_vs_previous'] = _round(values[-1] / values[-2] - 1)
+
+    # Tendencia lineal por mínimos cuadrados sobre el índice del periodo
+    x = np.arange(values.size, dtype=float)
+    slope, intercept = np.polyfit(x, values, 1)
+    fitted = slope * x + intercept
+    total_var = ((values - values.mean()) ** 2).sum()
+    r2 = 1 - ((values - fitted) ** 2).sum() / total_var if total_var else 0.0
+    facts['trend'] = {
+        'slope_per_period': _round(slope),
+        'slope_pct_of_mean': _round(slope / values.mean()) if values.mean() else None,
+        'r2': _round(r2)
+    }
+
+    lag = SEASONAL_LAGS[freq]
+    if values.size >= 2 * lag:
+        centered = values - values.mean()
+        denominator = (centered ** 2).sum()
+        if denominator:
+            autocorrelation = (centered[lag:] * centered[:-lag]).sum() / denominator
+            facts['seasonal_autocorrelation'] = {'lag': lag, 'value': _round(autocorrelation)}
+
+    peak = int(values.argmax())
+    trough = int(values.argmin())
+    facts['peak'] = {'period': str(series.index[peak]), 'value': _round(values[peak])}
+    facts['trough'] = {'period': str(series.index[trough]), 'value': _round(values[trough])}
+    return facts
+
+
+def _top_movers(df: pd.DataFrame, date_col: str, dimension: str, measure: str) -> Optional[Dict[str, Any]]:
+    data = df[[date_col, dimension, measure]].dropna()
+    if data[date_col].nunique() < 2:
+        return None
+    periods = data[date_col].dt.to_period(_period_frequency(data[date_col]))
+    pivot = data.groupby([periods, dimension], observed=True)[measure].sum().unstack(fill_value=0).sort_index()
+    if len(pivot) < 2:
+        return None
+    delta = (pivot.iloc[-1] - pivot.iloc[-2]).sort_values()
+    return {
+        'from_period': str(pivot.index[-2]),
+        'to_period': str(pivot.index[-1]),
+        'gainers': [{'group': _round(idx), 'change': _round(val)}
+                    for idx, val in delta[::-1].head(INSIGHT_TOP_K).items() if val > 0],
+        'decliners': [{'group': _round(idx), 'change': _round(val)}
+                      for idx, val in delta.head(INSIGHT_TOP_K).items() if val < 0]
+    }
+
+
+def _outliers(df: pd.DataFrame, measure: str, label: Optional[str]) -> Dict[str, Any]:
+    values = df[measure].to_numpy(dtype=float)
+    finite = values[np.isfinite(values)]
+    if finite.size < 5:
+        return {'count': 0}
+    median = np.median(finite)
+    mad = np.median(np.abs(finite - median))
+    if not mad:
+        return {'count': 0}
+    z = 0.6745 * (values - median) / mad
+    mask = np.abs(np.nan_to_num(z)) > OUTLIER_Z
+    order = np.argsort(-np.abs(np.nan_to_num(z[mask])))[:INSIGHT_TOP_K]
+    rows = df.loc[mask].iloc[order]
+    return {
+        'count': int(mask.sum()),
+        'examples': [{'label': _round(row[label]) if label else None, 'value': _round(row[measure]),
+                      'robust_z': _round(score, 2)}
+                     for (_, row), score in zip(rows.iterrows(), z[mask][order])]
+    }
+
+
+def build_fact_sheet(results: Union['QueryResult', pd.DataFrame, List[Dict]]) -> Dict[str, Any]:
+    """
+    Calcula sobre el resultado completo los hechos que el LLM necesita para explicarlo
+
+    Totales, participaciones, principales cambios, variación contra el periodo
+    anterior, tendencia lineal y estacionalidad en columnas de fecha, y valores
+    atípicos. El tamaño del resultado es fijo (limitado por INSIGHT_TOP_K,
+    INSIGHT_MAX_MEASURES, INSIGHT_MAX_GROUPS e INSIGHT_MAX_COLUMNS) sin importar
+    cuántas filas o columnas tenga la consulta.
+
+    Args:
+        results: QueryResult del SQLAgent, DataFrame o lista de registros
+
+    Returns:
+        Dict serializable con los hechos por medida
+    """
+    if isinstance(results, QueryResult):
+        results = results.to_pandas()
+    # Copia superficial: las columnas de fecha convertidas no alteran el resultado compartido
+    df = results.copy(deep=False) if isinstance(results, pd.DataFrame) else pd.DataFrame(results)
+    if df.empty:
+        return {'rows': 0}
+
+    columns = _classify_columns(df)
+    dimension = _pick_dimension(df, columns['dimensions'])
+    date_col = columns['dates'][0] if columns['dates'] else None
+    listed = {k: [str(c) for c in v[:INSIGHT_MAX_COLUMNS]] for k, v in columns.items()}
+    if len(df.columns) > INSIGHT_MAX_COLUMNS:
+        # Tablas anchas: sólo las primeras columnas de cada tipo, más el total
+        listed['total'] = len(df.columns)
+    facts: Dict[str, Any] = {'rows': int(len(df)), 'columns': listed}
+
+    measures = {}
+    for measure in columns['measures']:
+        measure_facts: Dict[str, Any] = {'summary': _measure_summary(df[measure])}
+        if dimension:
+            measure_facts['by_' + str(dimension)] = _shares(df, dimension, measure)
+        if date_col:
+            series = _time_series(df, date_col, measure)
+            if series:
+                measure_facts['over_time'] = series
+            if dimension:
+                movers = _top_movers(df, date_col, dimension, measure)
+                if movers:
+                    measure_facts['top_movers'] = movers
+        measure_facts['outliers'] = _outliers(df, measure, dimension or date_col)
+        measures[str(measure)] = measure_facts
+    facts['measures'] = measures
+
+    if not measures and dimension:
+        # Sin medidas numéricas: frecuencia de cada categoría
+        counts = df[dimension].value_counts()
+        facts['value_counts'] = {str(dimension): [{'group': _round(k), 'count': int(v)}
+                                                  for k, v in counts.head(INSIGHT_TOP_K).items()]}
+    return facts
+
+
+def format_fact_sheet(facts: Dict[str, Any]) -> str:
+    """Representación compacta (una línea por hecho) para el prompt"""
+    lines = [f"rows: {facts.get('rows', 0)}"]
+
+    def walk(prefix: str, value: Any) -> None:
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(f"{prefix}.{key}" if prefix else str(key), item)
+        elif isinstance(value, list) and value and isinstance(value[0], dict):
+            rendered = '; '.join(', '.join(f"{k}={v}" for k, v in item.items()) for item in value)
+            lines.append(f"{prefix}: {rendered}")
+        else:
+            lines.append(f"{prefix}: {value}")
+
+    for key in ('columns', 'measures', 'value_counts'):
+        if key in facts:
+            walk(key, facts[key])
+    return '\n'.join(lines)
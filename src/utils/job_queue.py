@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from src.utils.cancellation import CancelToken, DeadlineExceeded, OperationCancelled, cancel_scope
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Se lanza cuando la cola de trabajos está saturada"""
+
+
+class Job:
+    """Pregunta encolada para ejecutarse en el pool de trabajadores"""
+
+    def __init__(self, question: str, table: str, key: str):
+        self.id = uuid.uuid4().hex
+        self.question = question
+        self.table = table
+        self.key = key
+        self.status = 'queued'
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.token = CancelToken()
+        self.future: Optional[Future] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed', 'cancelled', 'timeout')
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.id,
+            'question': self.question,
+            'table': self.table,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobManager:
+    """
+    Pool de trabajadores con cola acotada, deduplicación y timeouts.
+
+    - Preguntas idénticas (misma tabla y texto) en curso comparten el mismo Job.
+    - Si los trabajos en ejecución o en espera superan workers + max_queue,
+      `submit` lanza QueueFullError para que el llamador responda 429.
+    - Cada trabajo corre con un CancelToken: cancelarlo o superar `timeout`
+      aborta sus llamadas al LLM y consultas en curso; los resultados
+      finalizados se conservan `result_ttl` segundos.
+    """
+
+    def __init__(self,
+                 handler: Callable[[Job], Any],
+                 workers: int,
+                 max_queue: int,
+                 timeout: float,
+                 result_ttl: float):
+        self.handler = handler
+        self.capacity = workers + max_queue
+        self.timeout = timeout
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api-worker')
+        self._jobs: Dict[str, Job] = {}
+        self._inflight: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(question: str, table: str) -> str:
+        normalized = ' '.join(question.lower().split())
+        return hashlib.sha1(f"{table}|{normalized}".encode('utf-8')).hexdigest()
+
+    def submit(self, question: str, table: str) -> Job:
+        """Encola una pregunta o retorna el Job en curso para la misma pregunta"""
+        key = self.make_key(question, table)
+        with self._lock:
+            self._housekeeping()
+            existing = self._inflight.get(key)
+            if existing is not None:
+                return existing
+
+            # La carga real incluye trabajos marcados como timeout cuyo hilo aún no termina
+            pending = sum(1 for job in self._jobs.values() if job.future and not job.future.done())
+            if pending >= self.capacity:
+                raise QueueFullError(f"Job queue is full ({pending} pending)")
+
+            job = Job(question, table, key)
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+            job.future = self._executor.submit(self._run, job)
+            return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._housekeeping()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancela un trabajo en espera o solicita la cancelación de uno en ejecución"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            job.token.cancel('cancelled by client')
+            if job.future.cancel():
+                logger.info(f"Job {job.id} cancelled before starting")
+            self._finish(job, 'cancelled', error='Cancelled by client')
+            return job
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.future and not job.future.done())
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job) -> None:
+        with self._lock:
+            if job.finished:
+                return
+            job.status = 'running'
+            job.started_at = time.time()
+        # El plazo del trabajo corre desde que empieza a ejecutarse
+        token = CancelToken(timeout=self.timeout, parent=job.token)
+        try:
+            with cancel_scope(token):
+                result = self.handler(job)
+            with self._lock:
+                if not job.finished:
+                    job.result = result
+                    self._finish(job, 'done')
+        except OperationCancelled as e:
+            status = 'timeout' if isinstance(e, DeadlineExceeded) else 'cancelled'
+            with self._lock:
+                if not job.finished:
+                    self._finish(job, status, error=str(e))
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            with self._lock:
+                if not job.finished:
+                    self._finish(job, 'failed', error=str(e))
+        finally:
+            token.close()
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None) -> None:
+        # Debe llamarse con el lock tomado
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        if self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+
+    def _housekeeping(self) -> None:
+        # Debe llamarse con el lock tomado: marca timeouts y elimina resultados vencidos
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.status == 'running' and now - job.started_at > self.timeout:
+                job.token.cancel('deadline exceeded')
+                self._finish(job, 'timeout', error=f"Timed out after {self.timeout:.0f}s")
+            elif job.finished and now - job.finished_at > self.result_ttl:
+                del self._jobs[job_id]
@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, OLLAMA_BASE_URL, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE,
+    LLM_MAX_CONCURRENCY, OLLAMA_MAX_CONCURRENCY, OLLAMA_REQUESTS_PER_MINUTE, LLM_POOL_SIZE,
+    LLM_COMPLETION_TOKENS_ESTIMATE, ROUTER_CALL_TIMEOUT
+)
+from src.utils.rate_limit import RateLimiter
+from src.utils.tracing import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class LLMHTTPError(Exception):
+    """Respuesta de error de un proveedor de LLM"""
+
+    def __init__(self, provider: str, status_code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{provider} returned HTTP {status_code}: {message}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class ProviderChannel:
+    """
+    Acceso compartido a un proveedor: pool de conexiones keep-alive, límite de
+    concurrencia, límite de solicitudes y tokens por minuto, y backoff ante 429.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, requests_per_minute: float,
+                 tokens_per_minute: Optional[float] = None):
+        self.name = name
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.requests = RateLimiter(requests_per_minute)
+        self.tokens = RateLimiter(tokens_per_minute) if tokens_per_minute else None
+
+    def post(self, url: str, payload: Dict, prompt_tokens: int, headers: Optional[Dict] = None) -> Dict:
+        self.requests.acquire()
+        if self.tokens is not None:
+            self.tokens.acquire(prompt_tokens + LLM_COMPLETION_TOKENS_ESTIMATE)
+        with self.semaphore:
+            response = self.session.post(url, json=payload, headers=headers, timeout=ROUTER_CALL_TIMEOUT)
+
+        if response.status_code == 429:
+            retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+            # Backoff adaptativo: cada pausa seguida duplica la anterior (una vez por ventana, con tope)
+            wait = self.requests.penalize(retry_after=retry_after)
+            logger.warning(f"{self.name} rate limited, pausing new requests for {wait:.1f}s")
+            raise LLMHTTPError(self.name, 429, response.text[:200], retry_after)
+        if response.status_code >= 400:
+            raise LLMHTTPError(self.name, response.status_code, response.text[:200])
+
+        self.requests.record_success()
+        return response.json()
+
+
+class LLMGateway:
+    """
+    Cliente de LLM único por proceso, usado por todos los agentes a través del router.
+
+    Las solicitudes idénticas (mismo proveedor, modelo y prompt) que llegan mientras
+    otra está en curso esperan su resultado en lugar de enviarse de nuevo.
+    """
+
+    def __init__(self):
+        self.channels = {
+            'openai': ProviderChannel('openai', LLM_MAX_CONCURRENCY, LLM_REQUESTS_PER_MINUTE,
+                                      LLM_TOKENS_PER_MINUTE),
+            # Ollama es local: sin límite de tokens, con concurrencia acotada por la GPU/CPU
+            'ollama': ProviderChannel('ollama', OLLAMA_MAX_CONCURRENCY, OLLAMA_REQUESTS_PER_MINUTE)
+        }
+        self._inflight: Dict[Tuple[str, str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def complete(self, provider: str, model: str, prompt: str) -> str:
+        """
+        Envía el prompt al modelo y retorna el texto de la respuesta
+
+        Args:
+            provider: 'openai' u 'ollama'
+            model: Nombre del modelo
+            prompt: Prompt completo
+        """
+        key = (provider, model, hashlib.sha1(prompt.encode('utf-8')).hexdigest())
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            logger.debug(f"Coalesced identical prompt for {provider}/{model}")
+            return future.result()
+
+        try:
+            future.set_result(self._send(provider, model, prompt))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return future.result()
+
+    def _send(self, provider: str, model: str, prompt: str) -> str:
+        channel = self.channels[provider]
+        messages = [{'role': 'user', 'content': prompt}]
+        prompt_tokens = count_tokens(prompt)
+        if provider == 'openai':
+            data = channel.post(
+                f"{OPENAI_BASE_URL.rstrip('/')}/chat/completions",
+                {'model': model, 'messages': messages},
+                prompt_tokens,
+                headers={'Authorization': f"Bearer {OPENAI_API_KEY}"}
+            )
+            return data['choices'][0]['message']['content']
+
+        data = channel.post(
+            f"{OLLAMA_BASE_URL.rstrip('/')}/api/chat",
+            {'model': model, 'messages': messages, 'stream': False},
+            prompt_tokens
+        )
+        return data['message']['content']
+
+
+@lru_cache(maxsize=None)
+def get_gateway() -> LLMGateway:
+    """Gateway compartido por todos los agentes y sesiones del proceso"""
+    return LLMGateway()
@@ -0,0 +1,240 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Deque, Dict, List, Optional, Tuple
+
+from config.config import (
+    STAGE_ROUTING, ROUTER_ENABLED, ROUTER_CALL_TIMEOUT,
+    ROUTER_HEDGE_MIN_DELAY, ROUTER_HEDGE_MAX_DELAY, ROUTER_COOLDOWN_SECONDS, ROUTER_STATS_WINDOW, ROUTER_PROBE_RATE,
+    get_agent_model, get_stage_candidates
+)
+from src.utils.cancellation import current_token, run_cancellable
+from src.utils.cassette import recorded
+from src.utils.llm_gateway import get_gateway
+from src.utils.profiling import SamplingProfiler, current_profiler, profiled_thread
+from src.utils.rate_limit import is_rate_limit_error
+
+logger = logging.getLogger(__name__)
+
+# Errores consecutivos que sacan a un modelo de rotación durante ROUTER_COOLDOWN_SECONDS
+MAX_CONSECUTIVE_ERRORS = 3
+# Intervalo con el que la espera revisa cancelaciones
+POLL_INTERVAL = 0.2
+
+
+class ModelStats:
+    """Latencias recientes y errores de un modelo (ventana móvil)"""
+
+    def __init__(self, window: int = ROUTER_STATS_WINDOW):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rate_limited = 0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def to_dict(self) -> Dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'rate_limited': self.rate_limited,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'available': self.available
+        }
+
+
+class AttemptTimeout(TimeoutError):
+    """Un intento superó ROUTER_CALL_TIMEOUT"""
+
+
+def invoke_model(provider: str, model: str, prompt: str) -> str:
+    """Llamada directa a un modelo, sin failover, a través del gateway compartido"""
+    return get_gateway().complete(provider, model, prompt)
+
+
+class ModelRouter:
+    """
+    Enruta cada llamada al LLM según la etapa y el estado reciente de cada modelo.
+
+    - Etapas 'latency' (schema, viz): candidatos disponibles ordenados por p50,
+      empezando por el modelo local pequeño mientras no haya datos. Una fracción
+      ROUTER_PROBE_RATE de las llamadas prueba primero un candidato sin mediciones.
+    - Etapas 'quality' (sql, explain): el primer candidato disponible en orden de fuerza.
+    - Timeout o límite de tasa: el modelo entra en enfriamiento y se pasa al siguiente.
+    - Hedging: si el intento en curso supera el p95 del modelo (acotado entre
+      ROUTER_HEDGE_MIN_DELAY y ROUTER_HEDGE_MAX_DELAY), se lanza el siguiente
+      candidato en paralelo y gana la primera respuesta exitosa.
+    """
+
+    def __init__(self, max_workers: int = 16):
+        self._stats: Dict[Tuple[str, str], ModelStats] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-router')
+
+    def _get_stats(self, candidate: Dict[str, str]) -> ModelStats:
+        key = (candidate['provider'], candidate['model'])
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = ModelStats()
+            return self._stats[key]
+
+    def rank(self, stage: str) -> List[Dict[str, str]]:
+        """Candidatos de la etapa en el orden en que se intentarán"""
+        candidates = get_stage_candidates(stage)
+        available = [c for c in candidates if self._get_stats(c).available]
+        if not available:
+            # Todos en enfriamiento: se intenta primero el que sale antes
+            return sorted(candidates, key=lambda c: self._get_stats(c).cooldown_until)
+
+        if STAGE_ROUTING.get(stage) == 'latency':
+            def expected_latency(indexed):
+                position, candidate = indexed
+                p50 = self._get_stats(candidate).percentile(0.5)
+                # Los modelos sin mediciones van después, en el orden configurado
+                return (p50 if p50 is not None else float('inf'), position)
+            ranked = [c for _, c in sorted(enumerate(available), key=expected_latency)]
+            unmeasured = [c for c in ranked if self._get_stats(c).percentile(0.5) is None]
+            if unmeasured and unmeasured[0] is not ranked[0] and random.random() < ROUTER_PROBE_RATE:
+                # Sondeo: si el primero nunca falla los demás no se medirían y nunca se elegirían
+                probe = unmeasured[0]
+                ranked = [probe] + [c for c in ranked if c is not probe]
+            return ranked
+        return available
+
+    def hedge_delay(self, candidate: Dict[str, str]) -> float:
+        p95 = self._get_stats(candidate).percentile(0.95)
+        if p95 is None:
+            return ROUTER_HEDGE_MAX_DELAY
+        return min(ROUTER_HEDGE_MAX_DELAY, max(ROUTER_HEDGE_MIN_DELAY, p95))
+
+    def _attempt(self, candidate: Dict[str, str], prompt: str,
+                 profiler: Optional[SamplingProfiler] = None) -> str:
+        stats = self._get_stats(candidate)
+        start = time.perf_counter()
+        try:
+            with profiled_thread(profiler):
+                completion = invoke_model(candidate['provider'], candidate['model'], prompt)
+        except Exception as e:
+            self._record_failure(candidate, e)
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats.calls += 1
+            stats.latencies.append(elapsed)
+            stats.consecutive_errors = 0
+        return completion
+
+    def _record_failure(self, candidate: Dict[str, str], error: Exception) -> None:
+        stats = self._get_stats(candidate)
+        with self._lock:
+            stats.calls += 1
+            stats.errors += 1
+            stats.consecutive_errors += 1
+            cooldown = False
+            if isinstance(error, AttemptTimeout):
+                stats.timeouts += 1
+                # El intento abandonado cuenta como una latencia igual al timeout
+                stats.latencies.append(ROUTER_CALL_TIMEOUT)
+                cooldown = True
+            elif is_rate_limit_error(error):
+                stats.rate_limited += 1
+                cooldown = True
+            if cooldown or stats.consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                stats.cooldown_until = time.monotonic() + ROUTER_COOLDOWN_SECONDS
+        logger.warning(f"LLM call to {candidate['provider']}/{candidate['model']} failed: {str(error)}")
+
+    def generate(self, stage: str, prompt: str) -> str:
+        """
+        Genera una respuesta para la etapa con failover y hedging
+
+        Respeta el token de cancelación activo: si se cancela, se deja de
+        esperar y los intentos en curso se descartan.
+
+        Args:
+            stage: Etapa del pipeline ('schema', 'sql', 'viz', 'explain')
+            prompt: Prompt completo
+
+        Returns:
+            Texto de la respuesta del primer intento exitoso
+        """
+        token = current_token()
+        if token is not None:
+            token.check()
+
+        if not ROUTER_ENABLED:
+            model = get_agent_model(stage)
+            return run_cancellable(invoke_model, model['provider'], model['model'], prompt)
+
+        queue = self.rank(stage)
+        profiler = current_profiler()
+        running: Dict[Future, Tuple[Dict[str, str], float]] = {}
+        last_error: Optional[Exception] = None
+        hedge_at = 0.0
+
+        while queue or running:
+            now = time.monotonic()
+            # Lanzar el siguiente candidato si no hay intentos en curso o venció el plazo de hedging
+            if queue and (not running or now >= hedge_at):
+                candidate = queue.pop(0)
+                if running:
+                    logger.info(f"Hedging {stage} call with {candidate['provider']}/{candidate['model']}")
+                running[self._executor.submit(self._attempt, candidate, prompt, profiler)] = (candidate, now)
+                hedge_at = now + self.hedge_delay(candidate)
+
+            done, _ = wait(list(running), timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            if token is not None:
+                token.check()
+
+            for future in done:
+                running.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    last_error = e
+                    # Failover inmediato: no se espera al plazo de hedging
+                    hedge_at = 0.0
+
+            now = time.monotonic()
+            for future, (candidate, started) in list(running.items()):
+                if now - started > ROUTER_CALL_TIMEOUT:
+                    # El hilo sigue en segundo plano; su resultado se descarta
+                    running.pop(future)
+                    last_error = AttemptTimeout(f"{candidate['model']} exceeded {ROUTER_CALL_TIMEOUT:.0f}s")
+                    self._record_failure(candidate, last_error)
+                    hedge_at = 0.0
+
+        raise last_error or RuntimeError(f"No model available for stage {stage}")
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Estadísticas por proveedor/modelo, para diagnóstico"""
+        with self._lock:
+            return {f"{provider}/{model}": stats.to_dict() for (provider, model), stats in self._stats.items()}
+
+
+@lru_cache(maxsize=None)
+def get_router() -> ModelRouter:
+    """Router compartido por todos los agentes del proceso"""
+    return ModelRouter()
+
+
+@recorded('llm', key=lambda stage, prompt: [stage, prompt])
+def generate_text(stage: str, prompt: str) -> str:
+    """Atajo para get_router().generate (grabado/reproducido si hay un cassette activo)"""
+    return get_router().generate(stage, prompt)
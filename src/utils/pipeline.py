@@ -0,0 +1,128 @@
+from typing import Dict, Any, Optional
+import logging
+from src.utils.tracing import span
+from src.utils.rate_limit import RateLimiter
+from src.utils.cancellation import check_cancelled
+from src.utils.cassette import get_cassette
+from src.utils.fast_path import try_fast_path
+from config.config import USE_SNAPSHOTS
+# Los agentes se resuelven desde el registro en el primer uso
+from agents.registry import AGENT_CLASSES, create_agent
+
+logger = logging.getLogger(__name__)
+
+def create_agents() -> Dict[str, Any]:
+    """Create instances of all agents"""
+    return {agent_type: create_agent(agent_type) for agent_type in AGENT_CLASSES}
+
+def run_crew_analysis(question: str, selected_table: str, schema_context: Optional[str] = None,
+                      progressive: bool = False) -> Dict[str, Any]:
+    """
+    Ejecuta el análisis completo (vía rápida o las etapas de los agentes) y retorna la salida formateada
+
+    Args:
+        question: Pregunta en lenguaje natural
+        selected_table: Tabla a analizar
+        schema_context: Contexto multi-tabla recuperado del índice de esquema
+        progressive: Permitir vistas previas sobre la muestra con la consulta exacta en segundo plano
+
+    Returns:
+        Dict con el formato de AgentOutputHandler.format_agent_output más 'execute_query'
+        (resultados) y 'chart_spec' (Vega-Lite)
+    """
+    cassette = get_cassette()
+    if cassette is not None:
+        # Cada corrida queda registrada para reproducirla con scripts/replay_cassette.py
+        with cassette.run(question=question, selected_table=selected_table, schema_context=schema_context,
+                          progressive=progressive):
+            return _run_crew_analysis(question, selected_table, schema_context, progressive)
+    return _run_crew_analysis(question, selected_table, schema_context, progressive)
+
+def _run_crew_analysis(question: str, selected_table: str, schema_context: Optional[str],
+                       progressive: bool) -> Dict[str, Any]:
+    # Preguntas de plantilla ("total X by Y", "top N Y by X", "X per month") se responden sin LLM
+    if not schema_context:
+        fast_output = try_fast_path(question, selected_table, progressive)
+        if fast_output:
+            return fast_output
+
+    # Las etapas se llaman directamente (no con crew.kickoff) para que cada llamada al LLM pase
+    # por generate_text: router, validación y reparación del SQL, fact sheet, modo progresivo y cassette
+    with span('create_agents'):
+        agents = create_agents()
+    schema_info = None
+    if schema_context:
+        # Multi-tabla: el contexto recuperado reemplaza al análisis de una sola tabla
+        schema_info = {'table_name': None, 'analysis': schema_context, 'columns': []}
+    result = run_stages(question, selected_table, agents, schema_info=schema_info, progressive=progressive)
+
+    with span('format_output'):
+        return format_stage_output(question, result)
+
+def format_stage_output(question: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """Convierte la salida de run_stages al formato que muestran la app y el API"""
+    sql_results, viz_info = result['sql_results'], result['viz_info']
+    schema_analysis = str(result['schema_info'].get('analysis', ''))
+    output = {
+        'question': question,
+        'reasoning': [
+            {'agent': 'Schema analysis', 'thoughts': schema_analysis.split('\n')},
+            {'agent': 'SQL generation', 'thoughts': [
+                f"Executed on: {sql_results['source']}",
+                f"Rows returned: {sql_results['row_count']}",
+                f"Repair attempts: {sql_results['repair_attempts']}"
+            ]},
+            {'agent': 'Visualization', 'thoughts': [
+                f"Chart: {viz_info['visualization_type']} of {viz_info['y_column']} by {viz_info['x_column']}"
+                if viz_info.get('chart_spec') else "No chart: the result has no numeric column"
+            ]}
+        ],
+        'query': sql_results['query'],
+        'visualization': None,
+        'chart_spec': viz_info['chart_spec'],
+        'insights': result['explanation']['explanation'],
+        'execute_query': sql_results['results']
+    }
+    # Vista previa sobre la muestra: la app reemplaza el resultado cuando termina la consulta exacta
+    for key in ('approximate', 'margins', 'sample_fraction', 'exact_job'):
+        if key in sql_results:
+            output[key] = sql_results[key]
+    return output
+
+def run_stages(question: str,
+               selected_table: str,
+               agents: Dict[str, Any],
+               schema_info: Optional[Dict] = None,
+               limiter: Optional[RateLimiter] = None,
+               progressive: bool = False) -> Dict[str, Any]:
+    """
+    Ejecuta el pipeline schema→sql→viz→explain llamando directamente a cada agente
+
+    Args:
+        question: Pregunta en lenguaje natural
+        selected_table: Tabla a analizar
+        agents: Agentes creados con create_agents()
+        schema_info: Análisis de esquema ya calculado (se reutiliza si se provee)
+        limiter: Limitador de tasa aplicado a cada etapa que llama al LLM
+        progressive: SQLAgent responde con estimaciones sobre la muestra (consulta exacta en segundo plano)
+
+    Returns:
+        Dict con schema_info, sql_results, viz_info y explanation
+    """
+    def call(fn, *args):
+        # Punto de control de cancelación entre etapas
+        check_cancelled()
+        return limiter.call(fn, *args) if limiter else fn(*args)
+
+    if schema_info is None:
+        schema_info = call(agents['schema'].analyze_table, selected_table)
+    sql_results = call(agents['sql'].generate_and_execute, question, schema_info, USE_SNAPSHOTS, progressive)
+    viz_info = call(agents['viz'].create_visualization, sql_results, question)
+    explanation = call(agents['explain'].generate_explanation, question, sql_results, viz_info)
+
+    return {
+        'schema_info': schema_info,
+        'sql_results': sql_results,
+        'viz_info': viz_info,
+        'explanation': explanation
+    }
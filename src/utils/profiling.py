@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Set
+
+from config.config import PROFILES_DIR, PROFILE_SAMPLE_INTERVAL_MS, PROFILE_TOP_ALLOCATIONS
+
+logger = logging.getLogger(__name__)
+
+# Profiler del análisis en curso en este contexto (None si no se está perfilando)
+# tracemalloc es global al proceso: se perfila una pregunta a la vez
+_profile_lock = threading.Lock()
+_active_profiler: ContextVar[Optional['SamplingProfiler']] = ContextVar('active_profiler', default=None)
+
+
+def get_question_id(question: str, table: str) -> str:
+    """Identificador estable de una pregunta sobre una tabla"""
+    return hashlib.sha1(f"{table}|{question.strip().lower()}".encode('utf-8')).hexdigest()[:12]
+
+
+class SamplingProfiler:
+    """
+    Profiler de muestreo basado en sys._current_frames.
+
+    Un hilo en segundo plano toma una muestra de la pila de los hilos registrados
+    con `add_thread` cada `interval` segundos y acumula las pilas en formato
+    "folded" (una línea por pila: frames separados por ';' y el número de
+    muestras), compatible con flamegraph.pl y speedscope. Los hilos de otras
+    sesiones o del servidor no se muestrean.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._threads: Set[int] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_thread(self, thread_id: int) -> None:
+        self._threads.add(thread_id)
+
+    def remove_thread(self, thread_id: int) -> None:
+        self._threads.discard(thread_id)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self) -> None:
+        thread_names = {}
+        while not self._stop.wait(self.interval):
+            threads = frozenset(self._threads)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in threads:
+                    continue
+                if thread_id not in thread_names:
+                    thread_names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write_folded(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def current_profiler() -> Optional[SamplingProfiler]:
+    """Profiler activo en el contexto actual, para pasarlo a los hilos auxiliares que se lancen"""
+    return _active_profiler.get()
+
+
+@contextmanager
+def profiled_thread(profiler: Optional[SamplingProfiler]):
+    """
+    Incluye el hilo actual en el perfil mientras dura el bloque
+
+    Lo usan los hilos auxiliares del análisis (run_cancellable, intentos del router)
+    con el profiler que obtuvo `current_profiler()` el hilo que los lanzó.
+    """
+    if profiler is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    profiler.add_thread(thread_id)
+    try:
+        yield
+    finally:
+        # Los hilos de un pool se reutilizan para otras sesiones
+        profiler.remove_thread(thread_id)
+
+
+def _write_allocations(snapshot: tracemalloc.Snapshot, peak: int, path: str, limit: int) -> None:
+    stats = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    )).statistics('lineno')
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"Peak traced memory: {peak / 1024 / 1024:.2f} MiB\n")
+        f.write(f"Top {limit} allocations by line:\n\n")
+        for index, stat in enumerate(stats[:limit], 1):
+            frame = stat.traceback[0]
+            f.write(f"#{index}: {frame.filename}:{frame.lineno} "
+                    f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+
+
+@contextmanager
+def profile_run(question: str, table: str, enabled: bool):
+    """
+    Captura un perfil de CPU (muestreo) y de memoria (tracemalloc) del bloque envuelto
+
+    Los resultados se guardan en PROFILES_DIR/<question_id>/<timestamp>.folded y
+    <timestamp>_allocations.txt. Si no está habilitado no agrega ningún costo.
+    tracemalloc es global al proceso, así que sólo se perfila una pregunta a la vez:
+    si otra sesión ya está perfilando, el bloque corre sin perfil y se entrega None.
+
+    Args:
+        question: Pregunta del usuario
+        table: Tabla analizada
+        enabled: Si se debe capturar el perfil para esta ejecución
+    """
+    if not enabled:
+        yield None
+        return
+    if not _profile_lock.acquire(blocking=False):
+        logger.warning("Another question is being profiled; running this one without a profile")
+        yield None
+        return
+    try:
+        with _profile_session(question, table) as question_id:
+            yield question_id
+    finally:
+        _profile_lock.release()
+
+
+@contextmanager
+def _profile_session(question: str, table: str):
+    question_id = get_question_id(question, table)
+    output_dir = os.path.join(PROFILES_DIR, question_id)
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = os.path.join(output_dir, time.strftime('%Y%m%d-%H%M%S'))
+
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start(25)
+    profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL_MS / 1000)
+    # Sólo el hilo del análisis y los hilos auxiliares que lance (ver profiled_thread)
+    profiler.add_thread(threading.get_ident())
+    context_token = _active_profiler.set(profiler)
+    profiler.start()
+    try:
+        yield question_id
+    finally:
+        profiler.stop()
+        _active_profiler.reset(context_token)
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if not already_tracing:
+            tracemalloc.stop()
+
+        try:
+            profiler.write_folded(f"{prefix}.folded")
+            _write_allocations(snapshot, peak, f"{prefix}_allocations.txt", PROFILE_TOP_ALLOCATIONS)
+            logger.info(f"Profile for question {question_id} saved to {output_dir}")
+        except OSError as e:
+            logger.error(f"Error saving profile for question {question_id}: {str(e)}")
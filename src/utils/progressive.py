@@ -0,0 +1,386 @@
+import logging
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import text
+
+from config.config import (
+    SAMPLE_FRACTION, SAMPLE_MIN_BASE_ROWS, SAMPLE_TABLE_SUFFIX, SAMPLE_META_TABLE,
+    PROGRESSIVE_EXACT_WORKERS, PROGRESSIVE_EXACT_TIMEOUT, PROGRESSIVE_RESULT_TTL
+)
+from src.utils.cancellation import CancelToken, OperationCancelled, cancel_scope, current_token
+from src.utils.arrow_result import QueryResult
+from src.utils.cassette import CassetteMiss, recorded
+from src.utils.database import get_sql_dialect, read_arrow, read_sql
+from src.utils.sql_validator import SQLGLOT_DIALECTS
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# z de los intervalos de confianza del 95% mostrados junto a las estimaciones
+CONFIDENCE_Z = 1.96
+# Expresión de número aleatorio uniforme en [0, 1) por dialecto
+RANDOM_EXPRESSIONS = {
+    'mysql': 'RAND()',
+    'sqlite': '(ABS(RANDOM()) % 1000000) / 1000000.0',
+}
+
+
+def _quote(engine, name: str) -> str:
+    return f"`{name}`" if engine.dialect.name == 'mysql' else f'"{name}"'
+
+
+def refresh_sample(engine, table_name: str, fraction: float = SAMPLE_FRACTION) -> Optional[Dict[str, Any]]:
+    """
+    Recrea la muestra aleatoria (Bernoulli) de una tabla y registra su fracción real
+
+    La muestra se construye en una tabla temporal y luego reemplaza a la anterior,
+    así las consultas de vista previa nunca ven una muestra a medio cargar. Tablas
+    con menos de SAMPLE_MIN_BASE_ROWS filas no se muestrean.
+
+    Args:
+        engine: Engine del primario (la muestra es una escritura)
+        table_name: Tabla base
+        fraction: Probabilidad de inclusión de cada fila
+
+    Returns:
+        Dict con la información de la muestra, o None si la tabla es pequeña
+    """
+    sample_table = f"{table_name}{SAMPLE_TABLE_SUFFIX}"
+    staging_table = f"{sample_table}_new"
+    random_expression = RANDOM_EXPRESSIONS.get(engine.dialect.name, 'random()')
+    base, sample, staging, meta = (_quote(engine, name) for name in
+                                   (table_name, sample_table, staging_table, SAMPLE_META_TABLE))
+
+    with engine.begin() as connection:
+        base_rows = connection.execute(text(f"SELECT COUNT(*) FROM {base}")).scalar()
+        if base_rows < SAMPLE_MIN_BASE_ROWS:
+            logger.info(f"Skipping sample for {table_name}: {base_rows} rows < {SAMPLE_MIN_BASE_ROWS}")
+            return None
+
+        connection.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+        connection.execute(text(f"CREATE TABLE {staging} AS SELECT * FROM {base} "
+                                f"WHERE {random_expression} < {float(fraction)}"))
+        sample_rows = connection.execute(text(f"SELECT COUNT(*) FROM {staging}")).scalar()
+        connection.execute(text(f"DROP TABLE IF EXISTS {sample}"))
+        connection.execute(text(f"ALTER TABLE {staging} RENAME TO {sample}"))
+
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {meta} (table_name VARCHAR(255) PRIMARY KEY, "
+            f"sample_table VARCHAR(255), fraction DOUBLE PRECISION, base_rows BIGINT, refreshed_at VARCHAR(32))"
+        ))
+        connection.execute(text(f"DELETE FROM {meta} WHERE table_name = :table_name"), {'table_name': table_name})
+        info = {
+            'table_name': table_name,
+            'sample_table': sample_table,
+            # Fracción realizada: las estimaciones escalan por la muestra que efectivamente se obtuvo
+            'fraction': sample_rows / base_rows if base_rows else 0.0,
+            'base_rows': base_rows,
+            'refreshed_at': datetime.now().isoformat(timespec='seconds')
+        }
+        connection.execute(text(
+            f"INSERT INTO {meta} VALUES (:table_name, :sample_table, :fraction, :base_rows, :refreshed_at)"
+        ), info)
+    logger.info(f"Sample {sample_table} refreshed: {sample_rows} of {base_rows} rows")
+    return info
+
+
+@recorded('db_meta', key=lambda engine, table_name: ['sample_info', table_name])
+def get_sample_info(engine, table_name: str) -> Optional[Dict[str, Any]]:
+    """Información de la muestra de una tabla, o None si no existe"""
+    try:
+        with engine.connect() as connection:
+            row = connection.execute(text(
+                f"SELECT sample_table, fraction, base_rows, refreshed_at FROM {_quote(engine, SAMPLE_META_TABLE)} "
+                f"WHERE table_name = :table_name"
+            ), {'table_name': table_name}).mappings().first()
+    except Exception as e:
+        # Sin tabla de metadatos: ninguna tabla tiene muestra
+        logger.debug(f"No sample metadata for {table_name}: {str(e)}")
+        return None
+    if row is None or not row['fraction'] or row['base_rows'] < SAMPLE_MIN_BASE_ROWS:
+        return None
+    # Tipos JSON (el driver puede entregar Decimal): el resultado también se graba en el cassette
+    return {
+        'sample_table': row['sample_table'],
+        'fraction': float(row['fraction']),
+        'base_rows': int(row['base_rows']),
+        'refreshed_at': str(row['refreshed_at'])
+    }
+
+
+def plan_sample_query(query: str, table_name: str, sample_table: str,
+                      dialect: str) -> Optional[Tuple[str, List[Optional[Dict[str, Any]]]]]:
+    """
+    Reescribe una consulta de agregación para ejecutarla sobre la muestra
+
+    Sólo se admiten SELECT de una tabla, sin subconsultas, CTE, UNION, HAVING ni
+    funciones de ventana, cuyas columnas agregadas sean SUM, COUNT (no DISTINCT),
+    AVG, MIN o MAX directamente. Por cada SUM/AVG se agregan al final columnas
+    ocultas con la suma de cuadrados (y el conteo) para calcular el error.
+
+    Args:
+        query: Consulta exacta generada
+        table_name: Tabla base
+        sample_table: Tabla con la muestra
+        dialect: Dialecto de sqlglot
+
+    Returns:
+        (consulta sobre la muestra, plan por columna) o None si la consulta no se puede estimar.
+        Cada elemento del plan es None para columnas de agrupación o un dict con
+        'kind' y los índices de sus columnas ocultas.
+    """
+    try:
+        tree = sqlglot.parse_one(query, read=dialect)
+    except sqlglot.errors.SqlglotError:
+        return None
+
+    if (not isinstance(tree, exp.Select) or tree.args.get('with') or tree.args.get('having')
+            or tree.find(exp.Subquery) or tree.find(exp.Window)):
+        return None
+    tables = list(tree.find_all(exp.Table))
+    if not tables or any(table.name.lower() != table_name.lower() for table in tables):
+        return None
+
+    projections = list(tree.expressions)
+    plan: List[Optional[Dict[str, Any]]] = []
+    hidden: List[exp.Expression] = []
+    for projection in projections:
+        inner = projection.this if isinstance(projection, exp.Alias) else projection
+        if not any(True for _ in inner.find_all(exp.AggFunc)):
+            plan.append(None)
+            continue
+        if isinstance(inner, exp.Count) and not isinstance(inner.this, exp.Distinct):
+            plan.append({'kind': 'count'})
+        elif isinstance(inner, (exp.Sum, exp.Avg)):
+            argument = inner.this
+            item = {'kind': 'sum' if isinstance(inner, exp.Sum) else 'avg',
+                    'squares': len(projections) + len(hidden)}
+            hidden.append(exp.Sum(this=exp.Mul(this=exp.Paren(this=argument.copy()),
+                                                expression=exp.Paren(this=argument.copy()))))
+            if item['kind'] == 'avg':
+                item['count'] = len(projections) + len(hidden)
+                hidden.append(exp.Count(this=argument.copy()))
+            plan.append(item)
+        elif isinstance(inner, (exp.Min, exp.Max)):
+            # El mínimo/máximo de la muestra acota al real, pero no tiene un error calculable
+            plan.append({'kind': 'extreme'})
+        else:
+            return None
+    if all(item is None for item in plan):
+        # Sin agregaciones las filas de la muestra no estiman nada
+        return None
+
+    for table in tables:
+        if not table.alias:
+            # Las columnas calificadas con el nombre de la tabla siguen resolviendo
+            table.set('alias', exp.TableAlias(this=exp.to_identifier(table.name)))
+        table.set('this', exp.to_identifier(sample_table))
+    for i, expression in enumerate(hidden):
+        tree.select(exp.alias_(expression, f"__sample_aux_{i}"), copy=False)
+    return tree.sql(dialect=dialect), plan
+
+
+def estimate_from_sample(df: 'pd.DataFrame', plan: List[Optional[Dict[str, Any]]],
+                         fraction: float) -> Tuple['pd.DataFrame', Dict[str, List[Optional[float]]]]:
+    """
+    Escala los agregados de la muestra a la tabla completa y calcula márgenes de error del 95%
+
+    SUM y COUNT se escalan por 1/fraction (estimador de Horvitz-Thompson para muestreo
+    de Bernoulli, varianza (1-p)/p² · Σy²). AVG no se escala; su margen usa la varianza
+    muestral del grupo. MIN/MAX se muestran sin margen.
+
+    Returns:
+        (DataFrame con las columnas de la consulta original, {columna: márgenes por fila})
+    """
+    import numpy as np
+
+    estimates = df.iloc[:, :len(plan)].copy()
+    margins: Dict[str, List[Optional[float]]] = {}
+    variance_factor = (1 - fraction) / fraction ** 2
+    for i, item in enumerate(plan):
+        if item is None or item['kind'] == 'extreme':
+            continue
+        column = estimates.columns[i]
+        values = df.iloc[:, i].astype(float)
+        if item['kind'] == 'count':
+            estimates[column] = (values / fraction).round().astype('int64')
+            margin = CONFIDENCE_Z * np.sqrt(variance_factor * values)
+        elif item['kind'] == 'sum':
+            estimates[column] = values / fraction
+            margin = CONFIDENCE_Z * np.sqrt(variance_factor * df.iloc[:, item['squares']].astype(float))
+        else:
+            counts = df.iloc[:, item['count']].astype(float)
+            mean_squares = df.iloc[:, item['squares']].astype(float) / counts
+            margin = CONFIDENCE_Z * np.sqrt(((mean_squares - values ** 2) / counts).clip(lower=0))
+        margins[str(column)] = [round(float(m), 4) if math.isfinite(m) else None for m in margin]
+    return estimates, margins
+
+
+@dataclass
+class ExactJob:
+    """Consulta exacta en segundo plano compartida por las vistas previas que la esperan"""
+    key: Tuple[str, str]
+    future: Future
+    token: CancelToken
+    created: float = field(default_factory=time.monotonic)
+    subscribers: int = 1
+
+
+class ExactQueryRunner:
+    """
+    Ejecuta en segundo plano las consultas exactas de las vistas previas
+
+    Cada consulta corre con su propio plazo (PROGRESSIVE_EXACT_TIMEOUT), independiente de
+    la pregunta que la originó, para que el usuario pueda seguir trabajando mientras termina.
+    Una consulta idéntica que ya está en curso se comparte en lugar de encolarse otra vez;
+    se aborta cuando todas las vistas previas que la esperan la cancelan.
+    Los resultados se conservan PROGRESSIVE_RESULT_TTL segundos.
+    """
+
+    def __init__(self, max_workers: int = PROGRESSIVE_EXACT_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='exact-query')
+        self._jobs: Dict[str, ExactJob] = {}
+        self._inflight: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    def _run(self, query: str, engine, token: CancelToken) -> QueryResult:
+        try:
+            with cancel_scope(token):
+                return read_arrow(query, engine)
+        finally:
+            token.close()
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.future.done() and now - job.created > PROGRESSIVE_RESULT_TTL]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def submit(self, query: str, engine) -> str:
+        """Encola la consulta exacta (o se suma a una idéntica en curso) y retorna el id para consultarla"""
+        self._prune()
+        key = (engine.url.render_as_string(hide_password=True), query)
+        with self._lock:
+            job_id = self._inflight.get(key)
+            job = self._jobs.get(job_id) if job_id else None
+            if job is not None and not job.future.done():
+                job.subscribers += 1
+                return job_id
+
+            job_id = uuid.uuid4().hex
+            token = CancelToken(timeout=PROGRESSIVE_EXACT_TIMEOUT)
+            future = self._executor.submit(self._run, query, engine, token)
+            self._jobs[job_id] = ExactJob(key, future, token)
+            self._inflight[key] = job_id
+            future.add_done_callback(lambda _: self._release_inflight(key, job_id))
+        return job_id
+
+    def _release_inflight(self, key: Tuple[str, str], job_id: str) -> None:
+        with self._lock:
+            if self._inflight.get(key) == job_id:
+                del self._inflight[key]
+
+    def poll(self, job_id: str) -> Optional[QueryResult]:
+        """
+        Resultado exacto si ya terminó, None si sigue en curso
+
+        Raises:
+            KeyError: Si el id no existe o su resultado expiró
+            Exception: El error de la consulta exacta, si falló
+        """
+        with self._lock:
+            future = self._jobs[job_id].future
+        return future.result() if future.done() else None
+
+    def cancel(self, job_id: str) -> None:
+        """Deja de esperar la consulta exacta; se aborta (también en el servidor) si nadie más la espera"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.subscribers -= 1
+            if job.subscribers > 0:
+                return
+            del self._jobs[job_id]
+            if self._inflight.get(job.key) == job_id:
+                del self._inflight[job.key]
+        job.token.cancel('exact result no longer needed')
+
+
+@lru_cache(maxsize=None)
+def get_exact_runner() -> ExactQueryRunner:
+    """Ejecutor de consultas exactas compartido por las sesiones del proceso"""
+    return ExactQueryRunner()
+
+
+def start_progressive_query(query: str, table_name: str, engine) -> Optional[Dict[str, Any]]:
+    """
+    Vista previa estimada sobre la muestra y consulta exacta en segundo plano
+
+    Args:
+        query: Consulta exacta ya validada
+        table_name: Tabla base de la consulta
+        engine: Engine de lectura donde se ejecutan vista previa y consulta exacta
+
+    Returns:
+        Dict con 'results' (QueryResult estimado), 'margins', 'fraction', 'refreshed_at'
+        y 'exact_job', o None si la tabla no tiene muestra o la consulta no se puede estimar
+    """
+    info = get_sample_info(engine, table_name)
+    if info is None:
+        return None
+    dialect = SQLGLOT_DIALECTS.get(get_sql_dialect(engine), engine.dialect.name)
+    planned = plan_sample_query(query, table_name, info['sample_table'], dialect)
+    if planned is None:
+        return None
+
+    sample_query, plan = planned
+    sample = read_sql(sample_query, engine)
+    estimates, margins = estimate_from_sample(sample, plan, info['fraction'])
+    logger.info(f"Preview from {info['sample_table']} ({info['fraction']:.2%} of {info['base_rows']} rows); "
+                f"exact query running in background")
+    return {
+        'results': QueryResult.from_pandas(estimates),
+        'margins': margins,
+        'fraction': info['fraction'],
+        'refreshed_at': info['refreshed_at'],
+        'exact_job': _submit_exact(query, engine)
+    }
+
+
+def _submit_exact(query: str, engine) -> str:
+    runner = get_exact_runner()
+    job_id = runner.submit(query, engine)
+    token = current_token()
+    # El token de la etapa se desvincula al terminarla: se usa el de la pregunta completa
+    while token is not None and token.parent is not None:
+        token = token.parent
+    if token is not None:
+        # Si la pregunta se cancela antes de terminar, nadie mostrará la vista previa
+        token.on_cancel(lambda: runner.cancel(job_id))
+    return job_id
+
+
+def try_progressive_query(query: str, table_name: str, engine) -> Optional[Dict[str, Any]]:
+    """Como start_progressive_query, pero si la vista previa falla retorna None para ejecutar la consulta exacta"""
+    try:
+        return start_progressive_query(query, table_name, engine)
+    except (OperationCancelled, CassetteMiss):
+        raise
+    except Exception as e:
+        logger.warning(f"Sample preview failed, running the exact query: {str(e)}")
+        return None
@@ -0,0 +1,121 @@
+import logging
+import random
+import re
+import threading
+import time
+from typing import Callable, Any, Optional
+
+from config.config import LLM_MAX_BACKOFF_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Texto de error de límite de tasa: "rate limit"/"rate_limit" o un 429 como código HTTP
+# (palabra aislada junto a "HTTP"/"status"/"too many requests", no parte de un id o un conteo)
+RATE_LIMIT_PATTERN = re.compile(
+    r"rate[ _-]?limit|too many requests|(?:http|status|code)\W{0,3}429\b|\b429\W{0,3}too many",
+    re.IGNORECASE
+)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Detecta errores de límite de tasa de los proveedores de LLM (HTTP 429)"""
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status_code is not None:
+        return status_code == 429
+    # Excepciones de SDKs que no exponen el código (p.ej. openai.RateLimitError)
+    if type(error).__name__ == 'RateLimitError':
+        return True
+    return bool(RATE_LIMIT_PATTERN.search(str(error)))
+
+
+class RateLimiter:
+    """
+    Limitador de solicitudes (o tokens) por minuto (token bucket) compartido entre hilos.
+
+    Cuando un proveedor responde con un límite de tasa, `penalize` pausa a
+    todos los llamadores durante el tiempo de espera con backoff exponencial
+    (con tope en max_backoff). Las respuestas 429 que llegan durante una pausa
+    ya vigente no la alargan: el nivel de backoff sube una vez por ventana.
+    """
+
+    def __init__(self, requests_per_minute: float, max_retries: int = 5, base_backoff: float = 2.0,
+                 max_backoff: float = LLM_MAX_BACKOFF_SECONDS):
+        if requests_per_minute <= 0:
+            raise ValueError(f"requests_per_minute must be positive, got {requests_per_minute}")
+        self.capacity = max(1.0, requests_per_minute)
+        self.refill_rate = requests_per_minute / 60.0
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._backoff_level = 0
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, cost: float = 1.0) -> None:
+        """Bloquea hasta que haya cupo para una solicitud de `cost` unidades (p.ej. tokens)"""
+        # Una solicitud mayor que el bucket completo espera a que esté lleno
+        cost = min(cost, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.refill_rate)
+                self._last_refill = now
+                if now >= self._paused_until and self._tokens >= cost:
+                    self._tokens -= cost
+                    return
+                wait = max(self._paused_until - now, (cost - self._tokens) / self.refill_rate)
+            time.sleep(wait)
+
+    def penalize(self, attempt: Optional[int] = None, retry_after: Optional[float] = None) -> float:
+        """
+        Pausa a todos los llamadores tras un error de límite de tasa y retorna la espera aplicada
+
+        Si el proveedor indicó Retry-After se respeta como espera mínima (hasta max_backoff).
+        Sin `attempt` se usa el nivel compartido, que sube una vez por pausa y vuelve a cero
+        con la primera respuesta correcta tras la pausa (`record_success`).
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                # Otra respuesta de la misma ráfaga: la pausa vigente ya la cubre
+                return self._paused_until - now
+            level = self._backoff_level if attempt is None else attempt
+            # El exponente se limita para no calcular potencias enormes antes del tope
+            wait = self.base_backoff * (2 ** min(level, 16)) * (1 + random.random() * 0.25)
+            if retry_after is not None:
+                wait = max(wait, retry_after)
+            wait = min(wait, self.max_backoff)
+            self._backoff_level = level + 1
+            self._paused_until = now + wait
+        return wait
+
+    def record_success(self) -> None:
+        """Reinicia el nivel de backoff cuando el proveedor vuelve a responder tras la pausa"""
+        with self._lock:
+            if self._backoff_level and time.monotonic() >= self._paused_until:
+                self._backoff_level = 0
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Ejecuta una función que realiza una llamada al LLM respetando el límite
+
+        Args:
+            fn: Función a ejecutar
+            *args, **kwargs: Argumentos de la función
+
+        Returns:
+            El resultado de la función
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                wait = self.penalize(attempt)
+                logger.warning(f"Rate limited, retrying in {wait:.1f}s (attempt {attempt + 1})")
@@ -0,0 +1,81 @@
+import hashlib
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Optional
+
+from config.config import RESULT_STORE_PATH, RESULT_STORE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def make_result_key(question: str, table: str, data_version: Optional[str]) -> str:
+    """Clave de memoización: tabla(s), pregunta normalizada y versión de los datos"""
+    normalized = ' '.join(question.lower().split())
+    return hashlib.sha1(f"{table}|{normalized}|{data_version}".encode('utf-8')).hexdigest()
+
+
+class ResultStore:
+    """
+    Almacén local (SQLite) de resultados de análisis ya calculados.
+
+    El historial de la sesión guarda sólo las claves; las salidas completas
+    (razonamiento, consulta, resultados, figura) viven aquí y se cargan cuando
+    se necesitan. Las entradas con más de `ttl` segundos se eliminan al abrir el almacén.
+    """
+
+    def __init__(self, path: str = RESULT_STORE_PATH, ttl: float = RESULT_STORE_TTL_SECONDS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, question TEXT, table_name TEXT, data_version TEXT, "
+                "created_at REAL, payload BLOB)"
+            )
+            deleted = conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - ttl,)).rowcount
+        if deleted:
+            logger.info(f"Pruned {deleted} expired results from {self.path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Una conexión por operación: Streamlit ejecuta cada rerun en un hilo distinto
+        return sqlite3.connect(self.path, timeout=10)
+
+    def put(self, key: str, question: str, table: str, data_version: Optional[str], payload: Any) -> None:
+        """Guarda (o reemplaza) la salida de un análisis"""
+        blob = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, question, table, data_version, time.time(), blob)
+            )
+
+    def update_payload(self, key: str, payload: Any) -> None:
+        """Reemplaza la salida de una entrada existente (p.ej. al llegar el resultado exacto)"""
+        blob = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE results SET payload = ? WHERE key = ?", (blob, key))
+
+    def get(self, key: str) -> Optional[Any]:
+        """Retorna la salida guardada para la clave, o None si no existe"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT payload FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception as e:
+            logger.error(f"Error loading stored result {key}: {str(e)}")
+            return None
+
+
+@lru_cache(maxsize=None)
+def get_result_store() -> ResultStore:
+    """Almacén de resultados compartido por las sesiones del proceso"""
+    return ResultStore()
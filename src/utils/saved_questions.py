@@ -0,0 +1,333 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from datetime import date, datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import inspect, text
+
+from config.config import SAVED_QUESTIONS_PATH, SNAPSHOT_WATERMARK_COLUMNS
+from src.utils.arrow_result import QueryResult
+from src.utils.database import get_sql_dialect, read_arrow
+from src.utils.db_router import get_read_engine
+from src.utils.sql_validator import SQLGLOT_DIALECTS
+from src.utils.tracing import metrics_registry, span
+
+logger = logging.getLogger(__name__)
+
+# Cómo se combina cada agregado del resultado guardado con el del delta
+MERGE_FUNCTIONS = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+
+# Expresiones cuyo valor cambia entre refrescos (ventanas relativas como "últimos 30 días",
+# muestras aleatorias): el delta no puede restar las filas que salen de la ventana
+NONDETERMINISTIC_EXPRESSIONS = tuple(
+    getattr(exp, name) for name in (
+        'CurrentDate', 'CurrentDatetime', 'CurrentTime', 'CurrentTimestamp', 'Localtime', 'Localtimestamp',
+        'UtcDate', 'UtcTime', 'UtcTimestamp', 'Rand', 'Randn', 'Uuid'
+    ) if hasattr(exp, name)
+)
+NONDETERMINISTIC_FUNCTIONS = {
+    'NOW', 'CURDATE', 'CURTIME', 'SYSDATE', 'SYSDATETIME', 'GETDATE', 'UNIX_TIMESTAMP', 'UTC_DATE',
+    'UTC_TIME', 'UTC_TIMESTAMP', 'RAND', 'RANDOM', 'UUID', 'TODAY', 'CURRENT_DATE', 'CURRENT_TIMESTAMP'
+}
+
+
+def _is_nondeterministic(tree: exp.Expression) -> bool:
+    for node in tree.walk():
+        if isinstance(node, NONDETERMINISTIC_EXPRESSIONS):
+            return True
+        if isinstance(node, exp.Anonymous) and str(node.name).upper() in NONDETERMINISTIC_FUNCTIONS:
+            return True
+    return False
+
+
+def plan_incremental(query: str, table_name: str, dialect: str) -> Optional[Dict[str, List]]:
+    """
+    Determina si una consulta se puede refrescar sumando sólo las filas nuevas
+
+    Son descomponibles los SELECT de una sola tabla, sin subconsultas, CTE, HAVING,
+    DISTINCT, LIMIT, funciones de ventana ni funciones no deterministas (NOW,
+    CURDATE, RAND...: una ventana relativa pierde filas que el delta no resta),
+    cuyas columnas son agregados SUM, COUNT (no DISTINCT), MIN o MAX, o columnas
+    del GROUP BY, y cuyo ORDER BY usa columnas del resultado. AVG y el resto
+    requieren recálculo completo.
+
+    Returns:
+        {'columns': plan por columna ({'role': 'group'} o {'role': 'aggregate', 'merge': ...}),
+         'order': [[posición, ascendente], ...]}, o None si la consulta no es descomponible
+    """
+    try:
+        tree = sqlglot.parse_one(query, read=dialect)
+    except sqlglot.errors.SqlglotError:
+        return None
+
+    if (not isinstance(tree, exp.Select) or tree.args.get('with') or tree.args.get('having')
+            or tree.args.get('distinct') or tree.args.get('limit')
+            or tree.find(exp.Subquery) or tree.find(exp.Window) or _is_nondeterministic(tree)):
+        return None
+    if any(table.name.lower() != table_name.lower() for table in tree.find_all(exp.Table)):
+        return None
+
+    group = tree.args.get('group')
+    group_keys = {key.sql(dialect=dialect).lower() for key in group.expressions} if group else set()
+    plan = []
+    # Nombres con los que una columna del resultado puede aparecer en GROUP BY / ORDER BY
+    names_by_position = []
+    for position, projection in enumerate(tree.expressions, start=1):
+        inner = projection.this if isinstance(projection, exp.Alias) else projection
+        names = {inner.sql(dialect=dialect).lower(), projection.alias_or_name.lower(), str(position)}
+        names_by_position.append(names)
+        if not any(True for _ in inner.find_all(exp.AggFunc)):
+            # Una columna no agregada debe ser clave de agrupación (por expresión, alias o posición)
+            if not names & group_keys:
+                return None
+            plan.append({'role': 'group'})
+        elif isinstance(inner, exp.Count) and not isinstance(inner.this, exp.Distinct):
+            plan.append({'role': 'aggregate', 'merge': MERGE_FUNCTIONS['count']})
+        elif isinstance(inner, exp.Sum):
+            plan.append({'role': 'aggregate', 'merge': MERGE_FUNCTIONS['sum']})
+        elif isinstance(inner, exp.Min):
+            plan.append({'role': 'aggregate', 'merge': MERGE_FUNCTIONS['min']})
+        elif isinstance(inner, exp.Max):
+            plan.append({'role': 'aggregate', 'merge': MERGE_FUNCTIONS['max']})
+        else:
+            return None
+
+    order = []
+    for ordered in (tree.args['order'].expressions if tree.args.get('order') else []):
+        key = ordered.this.sql(dialect=dialect).lower()
+        position = next((i for i, names in enumerate(names_by_position) if key in names), None)
+        if position is None:
+            return None
+        order.append([position, not ordered.args.get('desc')])
+    return {'columns': plan, 'order': order}
+
+
+def _literal(value: Any) -> exp.Expression:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return exp.Literal.string(str(value))
+    return exp.Literal.number(value)
+
+
+def bound_query(query: str, dialect: str, watermark: str, lower: Any = None, upper: Any = None) -> str:
+    """Agrega al WHERE de la consulta el rango (lower, upper] de la columna watermark"""
+    tree = sqlglot.parse_one(query, read=dialect)
+    column = exp.column(watermark)
+    if lower is not None:
+        tree = tree.where(exp.GT(this=column.copy(), expression=_literal(lower)), copy=False)
+    if upper is not None:
+        tree = tree.where(exp.LTE(this=column.copy(), expression=_literal(upper)), copy=False)
+    return tree.sql(dialect=dialect)
+
+
+def merge_results(stored: QueryResult, delta: QueryResult, incremental_plan: Dict[str, List]) -> QueryResult:
+    """Combina el resultado guardado con el agregado de las filas nuevas, grupo por grupo"""
+    import pandas as pd
+
+    if not len(delta):
+        return stored
+    plan = incremental_plan['columns']
+    previous, new = stored.to_pandas(), delta.to_pandas()
+    # Las columnas se alinean por posición: los nombres que asigna el driver pueden variar
+    positions = [str(i) for i in range(len(plan))]
+    combined = pd.concat([frame.set_axis(positions, axis=1) for frame in (previous, new)], ignore_index=True)
+    keys = [positions[i] for i, item in enumerate(plan) if item['role'] == 'group']
+    aggregations = {positions[i]: item['merge'] for i, item in enumerate(plan) if item['role'] == 'aggregate'}
+    if keys:
+        merged = combined.groupby(keys, dropna=False, sort=False).agg(aggregations).reset_index()
+        merged = merged[positions]
+    else:
+        merged = combined.agg(aggregations).to_frame().T[positions]
+    if incremental_plan['order']:
+        merged = merged.sort_values([positions[i] for i, _ in incremental_plan['order']],
+                                    ascending=[ascending for _, ascending in incremental_plan['order']],
+                                    ignore_index=True)
+    return QueryResult.from_pandas(merged.set_axis(list(previous.columns), axis=1))
+
+
+class SavedQuestionStore:
+    """
+    Preguntas guardadas (SQLite): consulta, resultado (Arrow IPC) y el watermark
+    hasta el que el resultado está calculado.
+    """
+
+    def __init__(self, path: str = SAVED_QUESTIONS_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS saved_questions ("
+                "id TEXT PRIMARY KEY, question TEXT, table_name TEXT, query TEXT, dialect TEXT, "
+                "watermark_column TEXT, state TEXT, result BLOB, created_at REAL, refreshed_at REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def put(self, item: Dict[str, Any], result: QueryResult) -> None:
+        blob = result.to_bytes('arrow')
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO saved_questions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (item['id'], item['question'], item['table_name'], item['query'], item['dialect'],
+                 item['watermark_column'], json.dumps(item['state'], default=str), blob,
+                 item['created_at'], item['refreshed_at'])
+            )
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Preguntas guardadas sin sus resultados"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, question, table_name, query, dialect, watermark_column, state, created_at, refreshed_at "
+                "FROM saved_questions ORDER BY created_at"
+            ).fetchall()
+        return [self._to_item(row) for row in rows]
+
+    def get(self, saved_id: str) -> Optional[Tuple[Dict[str, Any], QueryResult]]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT id, question, table_name, query, dialect, watermark_column, state, created_at, refreshed_at, "
+                "result FROM saved_questions WHERE id = ?", (saved_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return self._to_item(row[:-1]), QueryResult(ipc.open_stream(pa.py_buffer(row[-1])).read_all())
+
+    def delete(self, saved_id: str) -> None:
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM saved_questions WHERE id = ?", (saved_id,))
+
+    @staticmethod
+    def _to_item(row) -> Dict[str, Any]:
+        keys = ('id', 'question', 'table_name', 'query', 'dialect', 'watermark_column', 'state',
+                'created_at', 'refreshed_at')
+        item = dict(zip(keys, row))
+        item['state'] = json.loads(item['state'])
+        return item
+
+
+@lru_cache(maxsize=None)
+def get_saved_question_store() -> SavedQuestionStore:
+    """Almacén de preguntas guardadas compartido por el proceso"""
+    return SavedQuestionStore()
+
+
+def _watermark_state(engine, table_name: str, watermark: str) -> Dict[str, Any]:
+    # Máximo actual del watermark y cuántas filas hay hasta él
+    with engine.connect() as connection:
+        max_value = connection.execute(text(f"SELECT MAX({watermark}) FROM {table_name}")).scalar()
+        if isinstance(max_value, (datetime, date)):
+            max_value = max_value.isoformat(sep=' ') if isinstance(max_value, datetime) else max_value.isoformat()
+        rows = connection.execute(text(f"SELECT COUNT(*) FROM {table_name} WHERE {watermark} <= :value"),
+                                  {'value': max_value}).scalar() if max_value is not None else 0
+    return {'max': max_value, 'rows': rows}
+
+
+def _rows_up_to(engine, table_name: str, watermark: str, value: Any) -> int:
+    with engine.connect() as connection:
+        return connection.execute(text(f"SELECT COUNT(*) FROM {table_name} WHERE {watermark} <= :value"),
+                                  {'value': value}).scalar()
+
+
+def save_question(question: str, table_name: str, query: str) -> Dict[str, Any]:
+    """
+    Guarda una pregunta y calcula su resultado hasta el watermark actual
+
+    La columna watermark es la primera de SNAPSHOT_WATERMARK_COLUMNS presente en la tabla.
+    Sin watermark la pregunta se guarda igual, pero cada refresco la recalcula completa.
+
+    Returns:
+        La pregunta guardada (sin el resultado)
+    """
+    engine = get_read_engine()
+    dialect = SQLGLOT_DIALECTS.get(get_sql_dialect(engine), engine.dialect.name)
+    columns = [col['name'] for col in inspect(engine).get_columns(table_name)]
+    watermark = next((col for col in SNAPSHOT_WATERMARK_COLUMNS if col in columns), None)
+
+    state = _watermark_state(engine, table_name, watermark) if watermark else {'max': None, 'rows': None}
+    # El resultado se acota al watermark leído, así las filas que lleguen después entran en el delta
+    if watermark and state['max'] is not None:
+        query_to_run = bound_query(query, dialect, watermark, upper=state['max'])
+    else:
+        query_to_run = query
+    with span('saved_question_save'):
+        result = read_arrow(query_to_run, engine)
+
+    now = time.time()
+    item = {
+        'id': uuid.uuid4().hex[:12],
+        'question': question,
+        'table_name': table_name,
+        'query': query,
+        'dialect': dialect,
+        'watermark_column': watermark,
+        'state': {**state, 'incremental': plan_incremental(query, table_name, dialect) is not None,
+                  'last_refresh': 'full'},
+        'created_at': now,
+        'refreshed_at': now
+    }
+    get_saved_question_store().put(item, result)
+    logger.info(f"Saved question {item['id']} on {table_name} (watermark {watermark}={state['max']})")
+    return item
+
+
+def refresh_question(saved_id: str) -> Dict[str, Any]:
+    """
+    Actualiza el resultado de una pregunta guardada con los datos nuevos
+
+    - Sin filas nuevas (mismo máximo y mismo conteo hasta él): no se consulta nada más.
+    - Consulta descomponible y tabla sólo crecida: se agregan las filas con
+      watermark en (anterior, actual] y se combinan con el resultado guardado.
+    - Consulta no descomponible, sin watermark, o filas ya contadas que cambiaron
+      (conteo distinto hasta el watermark anterior): recálculo completo.
+
+    Returns:
+        La pregunta actualizada, con state['last_refresh'] en 'unchanged', 'incremental' o 'full'
+    """
+    stored = get_saved_question_store().get(saved_id)
+    if stored is None:
+        raise KeyError(f"Saved question {saved_id} not found")
+    item, result = stored
+    engine = get_read_engine()
+    table_name, watermark, previous = item['table_name'], item['watermark_column'], item['state']
+
+    with span('saved_question_refresh'):
+        mode = 'full'
+        if watermark:
+            current = _watermark_state(engine, table_name, watermark)
+            plan = plan_incremental(item['query'], table_name, item['dialect'])
+            unchanged_history = (previous['max'] is not None and
+                                 _rows_up_to(engine, table_name, watermark, previous['max']) == previous['rows'])
+            if unchanged_history and current['max'] == previous['max']:
+                mode = 'unchanged'
+            elif unchanged_history and plan is not None:
+                mode = 'incremental'
+                delta = read_arrow(bound_query(item['query'], item['dialect'], watermark,
+                                               lower=previous['max'], upper=current['max']), engine)
+                result = merge_results(result, delta, plan)
+                logger.info(f"Saved question {saved_id}: merged {len(delta)} delta rows")
+            if mode == 'full':
+                query = item['query']
+                if current['max'] is not None:
+                    query = bound_query(query, item['dialect'], watermark, upper=current['max'])
+                result = read_arrow(query, engine)
+        else:
+            current = previous
+            result = read_arrow(item['query'], engine)
+
+    metrics_registry.increment('sqlcrew_saved_question_refresh_total', 'Saved question refreshes, by mode', mode=mode)
+    item['state'] = {**current, 'incremental': item['state'].get('incremental', False), 'last_refresh': mode}
+    item['refreshed_at'] = time.time()
+    get_saved_question_store().put(item, result)
+    return item
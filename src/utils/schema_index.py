@@ -0,0 +1,342 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from sqlalchemy import text
+
+from config.config import (
+    SCHEMA_INDEX_DIR, SCHEMA_EMBEDDINGS, SCHEMA_EMBEDDING_MODEL, SCHEMA_INDEX_REFRESH_SECONDS,
+    SCHEMA_PROMPT_MAX_CHARS
+)
+from src.utils.database import get_table_names, get_table_schema
+
+logger = logging.getLogger(__name__)
+
+HASH_DIM = 512
+SAMPLE_ROWS = 50
+SAMPLE_VALUES_PER_COLUMN = 5
+
+
+def _hash_embed(texts: List[str]) -> np.ndarray:
+    # Embedding local sin red: n-gramas de caracteres y palabras proyectados con hashing
+    vectors = np.zeros((len(texts), HASH_DIM), dtype='float32')
+    for row, value in enumerate(texts):
+        words = re.findall(r'\w+', value.lower().replace('_', ' '))
+        features = list(words)
+        for word in words:
+            padded = f"#{word}#"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        for feature in features:
+            digest = hashlib.md5(feature.encode('utf-8')).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % HASH_DIM
+            vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+    return vectors
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """
+    Calcula embeddings normalizados (producto interno = similitud coseno)
+
+    Args:
+        texts: Textos a embeber
+
+    Returns:
+        Matriz float32 de forma (len(texts), dim)
+    """
+    if SCHEMA_EMBEDDINGS == 'openai':
+        from langchain_openai import OpenAIEmbeddings
+        vectors = np.array(OpenAIEmbeddings(model=SCHEMA_EMBEDDING_MODEL).embed_documents(texts), dtype='float32')
+    elif SCHEMA_EMBEDDINGS == 'ollama':
+        from langchain_ollama import OllamaEmbeddings
+        from config.config import OLLAMA_BASE_URL
+        vectors = np.array(OllamaEmbeddings(model=SCHEMA_EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
+                           .embed_documents(texts), dtype='float32')
+    else:
+        vectors = _hash_embed(texts)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _fingerprint(schema: Dict) -> str:
+    payload = {
+        'columns': [(col['name'], str(col['type']), col.get('comment')) for col in schema.get('columns', [])],
+        'primary_key': schema.get('primary_key'),
+        'foreign_keys': [(fk.get('constrained_columns'), fk.get('referred_table'), fk.get('referred_columns'))
+                         for fk in schema.get('foreign_keys', [])],
+        'comment': schema.get('comment')
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class SchemaIndex:
+    """
+    Índice vectorial (faiss) de tablas y columnas para recuperar el esquema relevante.
+
+    Cada tabla aporta un vector con su nombre, comentario y columnas, y cada
+    columna un vector con su nombre, tipo, comentario y valores de muestra.
+    `sync` reindexa sólo las tablas cuya huella de esquema cambió, y
+    `build_context` arma un contexto de tamaño acotado con las top-k tablas y
+    las rutas de join derivadas de las claves foráneas.
+    """
+
+    def __init__(self, index_dir: str = SCHEMA_INDEX_DIR):
+        self.index_dir = Path(index_dir)
+        self.index: Optional[faiss.Index] = None
+        self.tables: Dict[str, Dict] = {}
+        self.vectors: Dict[str, Tuple[str, Optional[str]]] = {}
+        self.next_id = 0
+        self.last_sync = 0.0
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self) -> None:
+        index_path = self.index_dir / 'index.faiss'
+        meta_path = self.index_dir / 'meta.json'
+        if not (index_path.exists() and meta_path.exists()):
+            return
+        try:
+            self.index = faiss.read_index(str(index_path))
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            self.tables = meta['tables']
+            self.vectors = {vector_id: tuple(target) for vector_id, target in meta['vectors'].items()}
+            self.next_id = meta['next_id']
+        except Exception as e:
+            logger.error(f"Error loading schema index, it will be rebuilt: {str(e)}")
+            self.index, self.tables, self.vectors, self.next_id = None, {}, {}, 0
+
+    def _save(self) -> None:
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        faiss.write_index(self.index, str(self.index_dir / 'index.faiss'))
+        tmp_path = self.index_dir / 'meta.json.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'tables': self.tables, 'vectors': self.vectors, 'next_id': self.next_id},
+                      f, default=str, ensure_ascii=False)
+        os.replace(tmp_path, self.index_dir / 'meta.json')
+
+    def _sample_values(self, engine, table_name: str, columns: List[Dict]) -> Dict[str, List[str]]:
+        text_columns = [col['name'] for col in columns
+                        if any(t in str(col['type']).upper() for t in ('CHAR', 'TEXT', 'VARCHAR', 'ENUM'))]
+        if not text_columns:
+            return {}
+        try:
+            with engine.connect() as connection:
+                rows = connection.execute(text(f"SELECT * FROM {table_name} LIMIT {SAMPLE_ROWS}")).mappings().all()
+        except Exception as e:
+            logger.warning(f"Could not sample values from {table_name}: {str(e)}")
+            return {}
+        samples = {}
+        for col in text_columns:
+            values = list(dict.fromkeys(str(row[col]) for row in rows if row.get(col) is not None))
+            samples[col] = values[:SAMPLE_VALUES_PER_COLUMN]
+        return samples
+
+    def _remove_table(self, table_name: str) -> None:
+        ids = [int(vector_id) for vector_id, (table, _) in self.vectors.items() if table == table_name]
+        if ids and self.index is not None:
+            self.index.remove_ids(np.array(ids, dtype='int64'))
+        for vector_id in ids:
+            del self.vectors[str(vector_id)]
+        self.tables.pop(table_name, None)
+
+    def _add_table(self, engine, table_name: str, schema: Dict, fingerprint: str) -> None:
+        columns = schema.get('columns', [])
+        samples = self._sample_values(engine, table_name, columns)
+        column_info = [{
+            'name': col['name'],
+            'type': str(col['type']),
+            'comment': col.get('comment'),
+            'samples': samples.get(col['name'], [])
+        } for col in columns]
+
+        documents = [(None, f"table {table_name}. {schema.get('comment') or ''} columns: "
+                            + ', '.join(col['name'] for col in column_info))]
+        for col in column_info:
+            documents.append((col['name'], f"{table_name}.{col['name']} {col['type']} {col['comment'] or ''} "
+                                           f"values: {', '.join(col['samples'])}"))
+
+        vectors = embed_texts([doc for _, doc in documents])
+        if self.index is None:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+        ids = np.arange(self.next_id, self.next_id + len(documents), dtype='int64')
+        self.index.add_with_ids(vectors, ids)
+        for vector_id, (column, _) in zip(ids, documents):
+            self.vectors[str(int(vector_id))] = (table_name, column)
+        self.next_id += len(documents)
+
+        self.tables[table_name] = {
+            'fingerprint': fingerprint,
+            'comment': schema.get('comment'),
+            'columns': column_info,
+            'primary_key': schema.get('primary_key', []),
+            'foreign_keys': [{
+                'columns': fk.get('constrained_columns', []),
+                'referred_table': fk.get('referred_table'),
+                'referred_columns': fk.get('referred_columns', [])
+            } for fk in schema.get('foreign_keys', [])]
+        }
+
+    def sync(self, engine, force: bool = False) -> int:
+        """
+        Actualiza el índice con las tablas nuevas, modificadas o eliminadas
+
+        Args:
+            engine: Engine de SQLAlchemy
+            force: Ignorar SCHEMA_INDEX_REFRESH_SECONDS y sincronizar ya
+
+        Returns:
+            Número de tablas reindexadas o eliminadas
+        """
+        with self._lock:
+            if not force and self.tables and time.time() - self.last_sync < SCHEMA_INDEX_REFRESH_SECONDS:
+                return 0
+            try:
+                current = set(get_table_names(engine))
+                changes = 0
+                for table_name in set(self.tables) - current:
+                    self._remove_table(table_name)
+                    changes += 1
+                for table_name in sorted(current):
+                    schema = get_table_schema(engine, table_name)
+                    if not schema:
+                        continue
+                    fingerprint = _fingerprint(schema)
+                    if self.tables.get(table_name, {}).get('fingerprint') == fingerprint:
+                        continue
+                    self._remove_table(table_name)
+                    self._add_table(engine, table_name, schema, fingerprint)
+                    changes += 1
+
+                self.last_sync = time.time()
+                if changes:
+                    self._save()
+                    logger.info(f"Schema index updated: {changes} tables changed, {len(self.tables)} indexed")
+                return changes
+            except Exception as e:
+                logger.error(f"Error syncing schema index: {str(e)}")
+                raise
+
+    def search(self, question: str, k: int = 5) -> List[Tuple[str, float]]:
+        """
+        Recupera las k tablas más relevantes para la pregunta
+
+        Returns:
+            Lista de (tabla, puntaje) ordenada por relevancia
+        """
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                return []
+            # Se buscan más vectores que k porque varias columnas pueden apuntar a la misma tabla
+            scores, ids = self.index.search(embed_texts([question]), min(self.index.ntotal, k * 10))
+
+        table_scores: Dict[str, float] = {}
+        for score, vector_id in zip(scores[0], ids[0]):
+            if vector_id < 0:
+                continue
+            table_name, _ = self.vectors[str(int(vector_id))]
+            table_scores[table_name] = max(table_scores.get(table_name, -1.0), float(score))
+        return sorted(table_scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def join_paths(self, tables: List[str]) -> List[List[Tuple[str, str, str, str]]]:
+        """
+        Rutas de join más cortas entre pares de tablas según las claves foráneas
+
+        Returns:
+            Lista de rutas; cada ruta es una lista de aristas (tabla, columnas, tabla_ref, columnas_ref)
+        """
+        graph: Dict[str, List[Tuple[str, Tuple[str, str, str, str]]]] = {}
+        for table_name, info in self.tables.items():
+            for fk in info['foreign_keys']:
+                edge = (table_name, ','.join(fk['columns']), fk['referred_table'], ','.join(fk['referred_columns']))
+                graph.setdefault(table_name, []).append((fk['referred_table'], edge))
+                graph.setdefault(fk['referred_table'], []).append((table_name, edge))
+
+        paths = []
+        for i, source in enumerate(tables):
+            for target in tables[i + 1:]:
+                # BFS desde source hasta target
+                previous = {source: None}
+                queue = deque([source])
+                while queue and target not in previous:
+                    node = queue.popleft()
+                    for neighbor, edge in graph.get(node, []):
+                        if neighbor not in previous:
+                            previous[neighbor] = (node, edge)
+                            queue.append(neighbor)
+                if target in previous:
+                    path, node = [], target
+                    while previous[node] is not None:
+                        node, edge = previous[node]
+                        path.append(edge)
+                    paths.append(list(reversed(path)))
+        return paths
+
+    def _describe_table(self, table_name: str, with_samples: bool) -> str:
+        info = self.tables[table_name]
+        columns = []
+        for col in info['columns']:
+            description = f"{col['name']} {col['type']}"
+            if with_samples and col['samples']:
+                description += f" e.g. {'/'.join(col['samples'][:3])}"
+            columns.append(description)
+        line = f"- {table_name}({', '.join(columns)})"
+        if info['primary_key']:
+            line += f" PK({', '.join(info['primary_key'])})"
+        if info['comment']:
+            line += f" -- {info['comment']}"
+        return line
+
+    def build_context(self, question: str, k: int = 5, max_chars: int = SCHEMA_PROMPT_MAX_CHARS) -> Dict:
+        """
+        Arma el contexto de esquema para el prompt SQL con tamaño acotado
+
+        Args:
+            question: Pregunta del usuario
+            k: Número máximo de tablas a recuperar
+            max_chars: Límite de caracteres del contexto
+
+        Returns:
+            Dict con 'tables' (seleccionadas) y 'context' (texto para el prompt)
+        """
+        ranked = [table for table, _ in self.search(question, k)]
+        selected: List[str] = []
+        for table_name in ranked:
+            # Agregar tablas intermedias necesarias para unir las seleccionadas
+            for path in self.join_paths(selected + [table_name]):
+                for edge in path:
+                    for node in (edge[0], edge[2]):
+                        if node not in selected and node in self.tables:
+                            selected.append(node)
+            if table_name not in selected:
+                selected.append(table_name)
+
+        while selected:
+            joins = [f"- {a}.{a_cols} = {b}.{b_cols}"
+                     for path in self.join_paths(selected) for a, a_cols, b, b_cols in path]
+            for with_samples in (True, False):
+                lines = ["Relevant tables:"] + [self._describe_table(t, with_samples) for t in selected]
+                if joins:
+                    lines += ["Join paths:"] + list(dict.fromkeys(joins))
+                context = '\n'.join(lines)
+                if len(context) <= max_chars:
+                    return {'tables': selected, 'context': context}
+            # Si no cabe, se descarta la tabla menos relevante
+            selected = selected[:-1]
+
+        return {'tables': [], 'context': ''}
+
+
+@lru_cache(maxsize=1)
+def get_schema_index() -> SchemaIndex:
+    """Índice de esquema compartido por el proceso"""
+    return SchemaIndex()
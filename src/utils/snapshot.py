@@ -0,0 +1,315 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import inspect
+
+from config.config import SNAPSHOT_DIR, SNAPSHOT_CHUNK_ROWS, SNAPSHOT_WATERMARK_COLUMNS
+from src.utils.arrow_result import QueryResult, normalize_arrow_types
+from src.utils.cassette import recorded
+from src.utils.database import iter_sql
+from src.utils.db_router import get_read_engine
+from src.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _table_lock(table_name: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(table_name, threading.Lock())
+
+
+def _to_json_scalar(value):
+    # Convierte escalares de pandas/numpy a tipos serializables en JSON
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat(sep=' ')
+    return value.item() if hasattr(value, 'item') else value
+
+
+class _PartWriter:
+    """Escribe DataFrames en partes Parquet temporales (.tmp); una parte nueva si cambia el esquema"""
+
+    def __init__(self, path: Path, next_index: int):
+        self.path = path
+        self.next_index = next_index
+        self.tmp_paths: List[Path] = []
+        self._writer = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        if df.empty:
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is not None and not table.schema.equals(self._writer.schema):
+            try:
+                table = table.cast(self._writer.schema)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, ValueError):
+                # Cambió el tipo de alguna columna: se cierra la parte y se abre otra
+                self.close()
+        if self._writer is None:
+            tmp_path = self.path / f"part-{self.next_index:05d}.parquet.tmp"
+            self.next_index += 1
+            self.tmp_paths.append(tmp_path)
+            self._writer = pq.ParquetWriter(tmp_path, table.schema, compression='zstd')
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def discard(self) -> None:
+        self.close()
+        for tmp_path in self.tmp_paths:
+            tmp_path.unlink(missing_ok=True)
+
+    def promote(self) -> List[str]:
+        """Renombra las partes temporales a su nombre final y retorna esos nombres"""
+        names = []
+        for tmp_path in self.tmp_paths:
+            final_path = tmp_path.with_suffix('')
+            os.replace(tmp_path, final_path)
+            names.append(final_path.name)
+        return names
+
+
+class TableSnapshot:
+    """
+    Copia local en Parquet de una tabla para análisis repetidos.
+
+    La copia vive en SNAPSHOT_DIR/<tabla>/ como archivos part-NNNNN.parquet más
+    un _meta.json con la marca de agua (watermark) y las partes confirmadas. Cada
+    refresco sólo trae las filas desde el último watermark exportado y las agrega
+    como partes nuevas. Las consultas se ejecutan con DuckDB sobre la tabla Arrow leída con
+    memory-map, sin copiar los datos.
+    """
+
+    def __init__(self, table_name: str, engine=None, snapshot_dir: str = SNAPSHOT_DIR):
+        self.table_name = table_name
+        self.engine = engine or get_read_engine()
+        self.path = Path(snapshot_dir) / re.sub(r'\W', '_', table_name)
+        self.meta_path = self.path / '_meta.json'
+
+    @property
+    def meta(self) -> Optional[Dict]:
+        if not self.meta_path.exists():
+            return None
+        with open(self.meta_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def exists(self) -> bool:
+        return self.meta is not None
+
+    def staleness(self) -> Optional[float]:
+        """Segundos desde el último refresco, o None si no hay snapshot"""
+        meta = self.meta
+        return time.time() - meta['refreshed_at'] if meta else None
+
+    def _detect_watermark_column(self) -> Optional[str]:
+        columns = [col['name'] for col in inspect(self.engine).get_columns(self.table_name)]
+        for candidate in SNAPSHOT_WATERMARK_COLUMNS:
+            if candidate in columns:
+                return candidate
+        return None
+
+    def _part_files(self) -> List[Path]:
+        """Partes confirmadas en _meta.json (los archivos que no figuran ahí no se leen)"""
+        meta = self.meta
+        if meta is None:
+            return []
+        if 'parts' not in meta:
+            # Snapshots anteriores a la lista de partes en los metadatos
+            return sorted(self.path.glob('part-*.parquet'))
+        return [self.path / name for name in meta['parts']]
+
+    def _remove_orphans(self) -> None:
+        # Partes de exportaciones fallidas (.tmp) o ya reemplazadas, que no figuran en _meta.json
+        committed = {part.name for part in self._part_files()}
+        for path in self.path.glob('part-*'):
+            if path.name not in committed:
+                path.unlink()
+
+    def _next_part_index(self) -> int:
+        indexes = [int(match.group(1)) for path in self.path.glob('part-*')
+                   if (match := re.match(r'part-(\d+)', path.name))]
+        return max(indexes, default=-1) + 1
+
+    def _write_meta(self, meta: Dict) -> None:
+        tmp_path = self.meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, default=str, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def refresh(self) -> Dict:
+        """
+        Crea o actualiza el snapshot de forma incremental
+
+        Las filas con el último valor de la watermark quedan en una parte "cola" que se
+        vuelve a exportar (WHERE watermark >= último valor) en el siguiente refresco: así
+        una columna DATE no pierde las filas que llegan después con la misma fecha.
+        _meta.json es el punto de confirmación: una exportación fallida no deja partes leídas.
+
+        Returns:
+            Metadatos del snapshot (watermark, filas, fecha de refresco)
+        """
+        with _table_lock(self.table_name), span('snapshot_refresh'):
+            try:
+                self.path.mkdir(parents=True, exist_ok=True)
+                self._remove_orphans()
+                meta = self.meta
+                if meta is None or meta.get('watermark_column') is None:
+                    # Sin watermark no se puede refrescar incrementalmente: exportación completa
+                    meta = {
+                        'table_name': self.table_name,
+                        'watermark_column': self._detect_watermark_column(),
+                        'watermark': None,
+                        'row_count': 0,
+                        'parts': [],
+                        'tail': None,
+                        'tail_rows': 0
+                    }
+                    committed = []
+                else:
+                    committed = [part.name for part in self._part_files()]
+
+                wm_col = meta['watermark_column']
+                query = f"SELECT * FROM {self.table_name}"
+                params = None
+                # Snapshots sin 'tail' ya confirmaron las filas del último valor: se sigue con '>'
+                reexport_tail = 'tail' in meta
+                if wm_col and meta['watermark'] is not None:
+                    query += f" WHERE {wm_col} {'>=' if reexport_tail else '>'} :watermark"
+                    params = {'watermark': meta['watermark']}
+                if wm_col:
+                    query += f" ORDER BY {wm_col}"
+
+                export = self._export(query, params, wm_col)
+                # La cola anterior se reemplaza por las filas >= watermark recién exportadas
+                old_tail = meta.get('tail') if reexport_tail else None
+                parts = [name for name in committed if name != old_tail] + export['parts']
+                if export['tail']:
+                    parts.append(export['tail'])
+                if export['watermark'] is not None:
+                    meta['watermark'] = export['watermark']
+                meta.update({
+                    'row_count': meta['row_count'] - meta.get('tail_rows', 0) + export['rows'],
+                    'parts': parts,
+                    'tail': export['tail'],
+                    'tail_rows': export['tail_rows'],
+                    'refreshed_at': time.time()
+                })
+                self._write_meta(meta)
+                self._remove_orphans()
+                logger.info(f"Snapshot of {self.table_name} refreshed: {export['rows']} rows exported, "
+                            f"{meta['row_count']} total")
+                return meta
+
+            except Exception as e:
+                logger.error(f"Error refreshing snapshot of {self.table_name}: {str(e)}")
+                raise
+
+    def _export(self, query: str, params: Optional[Dict], wm_col: Optional[str]) -> Dict:
+        """
+        Exporta las filas de la consulta a partes nuevas, sin confirmarlas en _meta.json
+
+        Con watermark, las filas con el valor máximo se retienen y se escriben en una
+        parte cola aparte. Si la consulta falla o se cancela, las partes escritas se borran.
+        """
+        parts = _PartWriter(self.path, self._next_part_index())
+        tail = None
+        boundary = None
+        rows = 0
+        try:
+            for chunk in iter_sql(query, self.engine, SNAPSHOT_CHUNK_ROWS, params):
+                if chunk.empty:
+                    continue
+                rows += len(chunk)
+                if not wm_col:
+                    parts.write(chunk)
+                    continue
+                # Los bloques llegan ordenados por watermark: sólo el valor máximo puede seguir llegando
+                if boundary is not None:
+                    chunk = pd.concat([boundary, chunk], ignore_index=True)
+                at_max = chunk[wm_col] == chunk[wm_col].max()
+                parts.write(chunk[~at_max])
+                boundary = chunk[at_max]
+            parts.close()
+            if boundary is not None and not boundary.empty:
+                tail = _PartWriter(self.path, parts.next_index)
+                tail.write(boundary)
+                tail.close()
+        except BaseException:
+            parts.discard()
+            if tail is not None:
+                tail.discard()
+            raise
+
+        return {
+            'parts': parts.promote(),
+            'tail': tail.promote()[0] if tail is not None else None,
+            'tail_rows': len(boundary) if tail is not None else 0,
+            'watermark': _to_json_scalar(boundary[wm_col].iloc[0]) if tail is not None else None,
+            'rows': rows
+        }
+
+    def read_table(self) -> pa.Table:
+        """Lee el snapshot como tabla Arrow usando memory-map (sin copias)"""
+        parts = [pq.read_table(part, memory_map=True) for part in self._part_files()]
+        if not parts:
+            raise FileNotFoundError(f"No snapshot found for table {self.table_name}")
+        return pa.concat_tables(parts, promote_options='default')
+
+    @recorded('sql', key=lambda self, sql: ['snapshot', self.table_name, sql])
+    def query(self, sql: str) -> QueryResult:
+        """
+        Ejecuta una consulta (dialecto DuckDB) sobre el snapshot
+
+        Args:
+            sql: Consulta que referencia la tabla por su nombre original
+
+        Returns:
+            QueryResult con los resultados (Arrow nativo de DuckDB)
+        """
+        with span('snapshot_query'):
+            conn = duckdb.connect()
+            try:
+                conn.register(self.table_name, self.read_table())
+                return QueryResult(normalize_arrow_types(conn.execute(sql).fetch_arrow_table()))
+            finally:
+                conn.close()
+
+
+def get_snapshot(table_name: str) -> Optional[TableSnapshot]:
+    """Retorna el snapshot de la tabla si ya fue creado"""
+    snapshot = TableSnapshot(table_name)
+    return snapshot if snapshot.exists() else None
+
+
+def format_staleness(seconds: float) -> str:
+    """Texto legible para la antigüedad de un snapshot"""
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 86400:.1f} days"
+
+
+if __name__ == "__main__":
+    # Uso: python -m src.utils.snapshot tabla1 [tabla2 ...]
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    for name in sys.argv[1:]:
+        TableSnapshot(name).refresh()
@@ -0,0 +1,115 @@
+import logging
+import re
+from typing import Dict, List, Optional
+
+import duckdb
+import pandas as pd
+import sqlglot
+from sqlglot import exp
+
+logger = logging.getLogger(__name__)
+
+# Dialecto legible (get_sql_dialect) -> dialecto de sqlglot
+SQLGLOT_DIALECTS = {
+    'MySQL': 'mysql',
+    'DuckDB': 'duckdb',
+    'SQLite': 'sqlite',
+    'PostgreSQL': 'postgres'
+}
+
+
+class SQLValidationError(ValueError):
+    """Consulta generada inválida aún después de los reintentos de reparación"""
+
+
+def clean_sql(llm_output: str) -> str:
+    """Extrae la consulta de la respuesta del LLM (quita bloques ```sql y ';' final)"""
+    text = str(llm_output).strip()
+    match = re.search(r"```(?:sql)?\s*(.*?)\s*```", text, re.DOTALL | re.IGNORECASE)
+    if match:
+        text = match.group(1)
+    return text.strip().rstrip(';').strip()
+
+
+def _check_identifiers(tree: exp.Expression, known_tables: List[str], known_columns: List[str]) -> Optional[str]:
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    tables = {table.name.lower() for table in tree.find_all(exp.Table)}
+    unknown_tables = tables - {t.lower() for t in known_tables} - ctes
+    if known_tables and unknown_tables:
+        return f"Unknown table(s): {', '.join(sorted(unknown_tables))}. Available: {', '.join(known_tables)}"
+
+    if not known_columns:
+        return None
+    # Los alias del SELECT y de subconsultas pueden usarse en ORDER BY / HAVING
+    aliases = {alias.alias.lower() for alias in tree.find_all(exp.Alias)}
+    aliases |= {sub.alias_or_name.lower() for sub in tree.find_all(exp.Subquery)}
+    columns = {col.name.lower() for col in tree.find_all(exp.Column) if col.name}
+    unknown_columns = columns - {c.lower() for c in known_columns} - aliases
+    if unknown_columns:
+        return f"Unknown column(s): {', '.join(sorted(unknown_columns))}. Available: {', '.join(known_columns)}"
+    return None
+
+
+def _dry_run(query: str, dialect: str, table_name: str, sample_rows: List[Dict]) -> Optional[str]:
+    # Ejecuta la consulta sobre una muestra en memoria con DuckDB
+    try:
+        duck_sql = sqlglot.transpile(query, read=dialect, write='duckdb')[0]
+    except sqlglot.errors.SqlglotError:
+        return None
+
+    conn = duckdb.connect()
+    try:
+        conn.register(table_name, pd.DataFrame(sample_rows))
+        conn.execute(duck_sql).fetchmany(1)
+        return None
+    except (duckdb.BinderException, duckdb.ParserException) as e:
+        return f"Dry run failed: {str(e).splitlines()[0]}"
+    except duckdb.Error as e:
+        # Funciones propias del dialecto o diferencias de tipos no se consideran errores de la consulta
+        logger.debug(f"Dry run inconclusive: {str(e)}")
+        return None
+    finally:
+        conn.close()
+
+
+def validate_sql(query: str, schema_info: Dict, dialect: str) -> Optional[str]:
+    """
+    Valida localmente una consulta antes de enviarla a la base de datos
+
+    1. La consulta se parsea con sqlglot y debe ser de solo lectura (SELECT/WITH/UNION).
+    2. Tablas y columnas se comparan con el esquema en caché de SchemaAgent.
+    3. Se ejecuta en DuckDB sobre la muestra de filas de la tabla (dry run).
+
+    Args:
+        query: Consulta generada
+        schema_info: Información de SchemaAgent ('table_name', 'columns', 'validation_sample')
+        dialect: Dialecto legible ('MySQL', 'DuckDB', ...)
+
+    Returns:
+        None si es válida, o el mensaje de error para pedir la reparación al LLM
+    """
+    read_dialect = SQLGLOT_DIALECTS.get(dialect)
+    try:
+        statements = sqlglot.parse(query, read=read_dialect)
+    except sqlglot.errors.ParseError as e:
+        return f"Syntax error: {str(e).splitlines()[0]}"
+
+    statements = [statement for statement in statements if statement is not None]
+    if len(statements) != 1:
+        return "Return exactly one SQL statement"
+    tree = statements[0]
+    if isinstance(tree, (exp.Insert, exp.Update, exp.Delete, exp.Drop, exp.Create, exp.Alter)) \
+            or not tree.find(exp.Select):
+        return "Only read-only SELECT queries are allowed"
+
+    table_name = schema_info.get('table_name')
+    known_tables = [table_name] if table_name else []
+    known_columns = [col['name'] for col in schema_info.get('columns', [])]
+    error = _check_identifiers(tree, known_tables, known_columns)
+    if error:
+        return error
+
+    sample = schema_info.get('validation_sample')
+    if table_name and sample:
+        return _dry_run(query, read_dialect, table_name, sample)
+    return None
@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from config.config import TRACING_ENABLED, TRACE_LOG_FILE, METRICS_FILE
+
+logger = logging.getLogger(__name__)
+
+# Traza y span activos en el contexto de ejecución actual
+_current_trace: ContextVar[Optional['Trace']] = ContextVar('current_trace', default=None)
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+@dataclass
+class Span:
+    """Medición de una etapa del pipeline"""
+    trace_id: str
+    stage: str
+    parent: Optional[str] = None
+    start_ts: float = 0.0
+    wall_time: float = 0.0
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    db_calls: int = 0
+    db_time: float = 0.0
+    rows_returned: int = 0
+    bytes_transferred: int = 0
+    status: str = 'ok'
+    error: Optional[str] = None
+
+
+@dataclass
+class Trace:
+    """Conjunto de spans asociados a una pregunta"""
+    question: str
+    table: str
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    spans: List[Span] = field(default_factory=list)
+    start_ts: float = field(default_factory=time.time)
+    wall_time: float = 0.0
+
+    def summary(self) -> Dict:
+        """Resumen de la traza listo para mostrar en la UI"""
+        return {
+            'trace_id': self.trace_id,
+            'question': self.question,
+            'table': self.table,
+            'wall_time': round(self.wall_time, 4),
+            'spans': [asdict(span) for span in self.spans]
+        }
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Cuenta tokens con tiktoken, o estima ~4 caracteres por token si no está disponible"""
+    text = str(text or '')
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+class _MetricsRegistry:
+    """Acumula métricas agregadas por etapa en formato Prometheus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, float]] = {}
+        # Contadores adicionales: {nombre: (ayuda, {etiquetas: valor})}
+        self._counters: Dict[str, Tuple[str, Dict[Tuple[Tuple[str, str], ...], float]]] = {}
+
+    def observe(self, span: Span) -> None:
+        with self._lock:
+            stats = self._stages.setdefault(span.stage, {
+                'count': 0, 'errors': 0, 'wall_time': 0.0, 'db_time': 0.0,
+                'prompt_tokens': 0, 'completion_tokens': 0,
+                'rows': 0, 'bytes': 0
+            })
+            stats['count'] += 1
+            stats['errors'] += 1 if span.status != 'ok' else 0
+            stats['wall_time'] += span.wall_time
+            stats['db_time'] += span.db_time
+            stats['prompt_tokens'] += span.prompt_tokens
+            stats['completion_tokens'] += span.completion_tokens
+            stats['rows'] += span.rows_returned
+            stats['bytes'] += span.bytes_transferred
+
+    def increment(self, name: str, help_text: str, value: float = 1.0, **labels: str) -> None:
+        """Incrementa un contador con etiquetas (p.ej. aciertos de la vía rápida)"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            _, series = self._counters.setdefault(name, (help_text, {}))
+            series[key] = series.get(key, 0.0) + value
+
+    def render(self) -> str:
+        metrics = [
+            ('sqlcrew_stage_runs_total', 'counter', 'Stage executions', 'count'),
+            ('sqlcrew_stage_errors_total', 'counter', 'Stage executions that failed', 'errors'),
+            ('sqlcrew_stage_wall_seconds_total', 'counter', 'Wall time spent per stage', 'wall_time'),
+            ('sqlcrew_stage_db_seconds_total', 'counter', 'Database time spent per stage', 'db_time'),
+            ('sqlcrew_llm_prompt_tokens_total', 'counter', 'LLM prompt tokens per stage', 'prompt_tokens'),
+            ('sqlcrew_llm_completion_tokens_total', 'counter', 'LLM completion tokens per stage', 'completion_tokens'),
+            ('sqlcrew_db_rows_total', 'counter', 'Rows returned by the database per stage', 'rows'),
+            ('sqlcrew_db_bytes_total', 'counter', 'Bytes transferred from the database per stage', 'bytes'),
+        ]
+        with self._lock:
+            stages = {stage: dict(stats) for stage, stats in self._stages.items()}
+            counters = {name: (help_text, dict(series)) for name, (help_text, series) in self._counters.items()}
+
+        lines = []
+        for name, metric_type, help_text, key in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for stage, stats in sorted(stages.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {stats[key]}')
+        for name, (help_text, series) in sorted(counters.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(series.items()):
+                rendered = ','.join(f'{label}="{label_value}"' for label, label_value in labels)
+                lines.append(f'{name}{{{rendered}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = _MetricsRegistry()
+
+
+def render_prometheus() -> str:
+    """Retorna las métricas acumuladas en formato de exposición de Prometheus"""
+    return metrics_registry.render()
+
+
+def _write_metrics_file() -> None:
+    if not METRICS_FILE:
+        return
+    try:
+        directory = os.path.dirname(METRICS_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{METRICS_FILE}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(render_prometheus())
+        os.replace(tmp_path, METRICS_FILE)
+    except OSError as e:
+        logger.error(f"Error writing metrics file: {str(e)}")
+
+
+def _export_trace(trace: Trace) -> None:
+    records = [json.dumps({'event': 'span', 'question': trace.question, 'table': trace.table, **asdict(span)},
+                          default=str, ensure_ascii=False)
+               for span in trace.spans]
+    for record in records:
+        logger.info(record)
+
+    if TRACE_LOG_FILE:
+        try:
+            directory = os.path.dirname(TRACE_LOG_FILE)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(TRACE_LOG_FILE, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(records) + '\n')
+        except OSError as e:
+            logger.error(f"Error writing trace log: {str(e)}")
+
+    _write_metrics_file()
+
+
+@contextmanager
+def start_trace(question: str, table: str):
+    """
+    Abre una traza para una pregunta; los spans creados dentro quedan asociados a ella
+
+    Args:
+        question: Pregunta del usuario
+        table: Tabla analizada
+    """
+    trace = Trace(question=question, table=table)
+    if not TRACING_ENABLED:
+        yield trace
+        return
+
+    token = _current_trace.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.wall_time = time.perf_counter() - start
+        _current_trace.reset(token)
+        _export_trace(trace)
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Mide una etapa dentro de la traza activa. Sin traza activa no registra nada.
+
+    Args:
+        stage: Nombre de la etapa ('schema', 'sql', 'viz', 'explain', 'render', ...)
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    current = Span(trace_id=trace.trace_id, stage=stage,
+                   parent=parent.stage if parent else None, start_ts=time.time())
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.status = 'error'
+        current.error = str(e)
+        raise
+    finally:
+        current.wall_time = time.perf_counter() - start
+        _current_span.reset(token)
+        trace.spans.append(current)
+        metrics_registry.observe(current)
+
+
+def record_llm_call(prompt: str, completion: str) -> None:
+    """Registra tokens de una llamada al LLM en el span activo"""
+    current = _current_span.get()
+    if current is None:
+        return
+    current.llm_calls += 1
+    current.prompt_tokens += count_tokens(prompt)
+    current.completion_tokens += count_tokens(completion)
+
+
+def record_db_call(elapsed: float, rows: int, nbytes: int) -> None:
+    """Registra tiempo, filas y bytes de una consulta en el span activo"""
+    current = _current_span.get()
+    if current is None:
+        return
+    current.db_calls += 1
+    current.db_time += elapsed
+    current.rows_returned += rows
+    current.bytes_transferred += nbytes
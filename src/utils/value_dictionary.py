@@ -0,0 +1,147 @@
+import difflib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from sqlalchemy import text
+
+from config.config import VALUE_DICT_DIR, VALUE_DICT_MAX_CARDINALITY, VALUE_DICT_MAX_VALUES, VALUE_DICT_SAMPLE_ROWS
+from src.utils.cassette import CassetteMiss, recorded
+from src.utils.database import get_data_version
+
+logger = logging.getLogger(__name__)
+
+CATEGORICAL_TYPES = ('CHAR', 'TEXT', 'ENUM', 'BOOL', 'VARCHAR', 'STRING')
+
+_lock = threading.Lock()
+
+
+def _is_categorical(column_type: str) -> bool:
+    return any(t in column_type.upper() for t in CATEGORICAL_TYPES)
+
+
+def _approx_distinct_query(engine, table_name: str, columns: List[str]) -> str:
+    # DuckDB tiene conteo aproximado (HyperLogLog); en el resto se cuenta sobre una muestra acotada
+    if engine.dialect.name == 'duckdb':
+        selects = ', '.join(f'approx_count_distinct("{col}")' for col in columns)
+        return f"SELECT {selects} FROM {table_name}"
+    quote = '`' if engine.dialect.name == 'mysql' else '"'
+    selects = ', '.join(f"COUNT(DISTINCT {quote}{col}{quote})" for col in columns)
+    inner = ', '.join(f"{quote}{col}{quote}" for col in columns)
+    return f"SELECT {selects} FROM (SELECT {inner} FROM {table_name} LIMIT {VALUE_DICT_SAMPLE_ROWS}) AS sample_rows"
+
+
+@recorded('db_meta', key=lambda engine, table_name, columns: ['value_dictionary', table_name,
+                                                              [col['name'] for col in columns]])
+def build_value_dictionary(engine, table_name: str, columns: List[Dict]) -> Dict:
+    """
+    Calcula valores distintos con sus conteos para las columnas categóricas de baja cardinalidad
+
+    Args:
+        engine: Engine de SQLAlchemy
+        table_name: Tabla a analizar
+        columns: Columnas con 'name' y 'type' (formato de SchemaAgent)
+
+    Returns:
+        Dict {columna: {'cardinality': n, 'values': [[valor, conteo], ...]}}
+    """
+    candidates = [col['name'] for col in columns if _is_categorical(str(col['type']))]
+    if not candidates:
+        return {}
+
+    quote = '`' if engine.dialect.name == 'mysql' else '"'
+    dictionary = {}
+    with engine.connect() as connection:
+        cardinalities = connection.execute(text(_approx_distinct_query(engine, table_name, candidates))).one()
+        for col, cardinality in zip(candidates, cardinalities):
+            if not cardinality or cardinality > VALUE_DICT_MAX_CARDINALITY:
+                continue
+            rows = connection.execute(text(
+                f"SELECT {quote}{col}{quote}, COUNT(*) AS n FROM {table_name} "
+                f"WHERE {quote}{col}{quote} IS NOT NULL GROUP BY {quote}{col}{quote} "
+                f"ORDER BY n DESC LIMIT {VALUE_DICT_MAX_VALUES}"
+            )).all()
+            dictionary[col] = {
+                'cardinality': int(cardinality),
+                'values': [[str(value), int(count)] for value, count in rows]
+            }
+    return dictionary
+
+
+def get_value_dictionary(engine, table_name: str, columns: List[Dict]) -> Dict:
+    """
+    Retorna el diccionario de valores de la tabla, recalculándolo sólo si cambiaron los datos
+
+    El diccionario se guarda en VALUE_DICT_DIR/<tabla>.json junto con la versión de datos
+    (conteo y watermark) con la que se calculó.
+    """
+    safe_name = re.sub(r'[^\w.-]', '_', table_name)
+    path = Path(VALUE_DICT_DIR) / f"{safe_name}.json"
+    try:
+        version = get_data_version(engine, table_name)
+        with _lock:
+            if path.exists():
+                with open(path, encoding='utf-8') as f:
+                    cached = json.load(f)
+                if cached.get('version') == version:
+                    return cached['columns']
+
+            dictionary = build_value_dictionary(engine, table_name, columns)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': version, 'columns': dictionary}, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+            logger.info(f"Value dictionary for {table_name} rebuilt ({len(dictionary)} columns)")
+            return dictionary
+    except CassetteMiss:
+        raise
+    except Exception as e:
+        # El diccionario es una ayuda para el prompt: si falla, el análisis continúa sin él
+        logger.error(f"Error building value dictionary for {table_name}: {str(e)}")
+        return {}
+
+
+def match_question_terms(question: str, dictionary: Dict, cutoff: float = 0.8) -> List[Tuple[str, str, str]]:
+    """
+    Busca términos de la pregunta que correspondan (difusamente) a valores conocidos
+
+    Returns:
+        Lista de (término, columna, valor exacto)
+    """
+    words = re.findall(r'\w+', question.lower())
+    terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    matches = {}
+    for col, info in dictionary.items():
+        by_lower = {}
+        for value, _ in info['values']:
+            by_lower.setdefault(value.lower(), value)
+        for term in terms:
+            if len(term) < 3:
+                continue
+            found = difflib.get_close_matches(term, list(by_lower), n=1, cutoff=cutoff)
+            if found:
+                # Un valor se reporta una sola vez, con el primer término que lo menciona
+                matches.setdefault((col, by_lower[found[0]]), term)
+    return [(term, col, value) for (col, value), term in matches.items()]
+
+
+def format_value_hints(question: str, dictionary: Dict, top_values: int = 10) -> str:
+    """Texto compacto con los valores más frecuentes por columna y los términos reconocidos"""
+    if not dictionary:
+        return ''
+    lines = ["Known values of categorical columns (use the exact spelling):"]
+    for col, info in dictionary.items():
+        values = ', '.join(f"'{value}'" for value, _ in info['values'][:top_values])
+        more = f" (+{info['cardinality'] - top_values} more)" if info['cardinality'] > top_values else ''
+        lines.append(f"- {col}: {values}{more}")
+
+    matches = match_question_terms(question, dictionary)
+    if matches:
+        lines.append("Question terms matched to stored values:")
+        lines.extend(f"- '{term}' -> {col} = '{value}'" for term, col, value in matches)
+    return '\n'.join(lines)